@@ -109,6 +109,28 @@ CREATE TABLE consenso_distribuido (
     nodo_iniciador INTEGER REFERENCES sucursales(id_sucursal)
 );
 
+-- Outbox transaccional: eventos de replicación escritos junto con cada cambio
+CREATE TABLE outbox_replicacion (
+    id_evento BIGSERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    datos JSONB NOT NULL,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Último evento de la outbox confirmado por cada nodo
+CREATE TABLE outbox_entregas (
+    id_nodo INTEGER PRIMARY KEY REFERENCES sucursales(id_sucursal),
+    ultimo_evento_confirmado BIGINT NOT NULL DEFAULT 0,
+    fecha_confirmacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Último evento aplicado de cada nodo origen (replicación idempotente)
+CREATE TABLE replicacion_aplicada (
+    id_origen INTEGER PRIMARY KEY REFERENCES sucursales(id_sucursal),
+    ultima_secuencia BIGINT NOT NULL DEFAULT 0,
+    fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Índices para mejorar performance
 CREATE INDEX idx_inventario_nombre ON inventario(nombre);
 CREATE INDEX idx_distribucion_articulo ON distribucion_sucursal(id_articulo);
@@ -116,4 +138,7 @@ CREATE INDEX idx_distribucion_sucursal ON distribucion_sucursal(id_sucursal);
 CREATE INDEX idx_ventas_fecha ON ventas(fecha_venta);
 CREATE INDEX idx_ventas_guia ON ventas(guia_envio);
 CREATE INDEX idx_historial_articulo ON historial_inventario(id_articulo);
-CREATE INDEX idx_historial_fecha ON historial_inventario(fecha_movimiento);
\ No newline at end of file
+CREATE INDEX idx_historial_fecha ON historial_inventario(fecha_movimiento);
+CREATE INDEX idx_clientes_telefono ON clientes(telefono);
+CREATE INDEX idx_clientes_email ON clientes(lower(email));
+CREATE INDEX idx_clientes_nombre_prefijo ON clientes(lower(nombre) text_pattern_ops);
\ No newline at end of file
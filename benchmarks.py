@@ -0,0 +1,196 @@
+### Microbenchmarks del sistema de inventario distribuido
+#
+# Uso: python benchmarks.py [nombre]   (sin nombre ejecuta todos)
+
+import sys
+import time
+import pickle
+import timeit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import protocolo
+from nodo_inventario import LocksPorArticulo, CacheInventario, PoolConexionesBD
+
+
+def _medir(funcion, repeticiones=3):
+    """Devuelve las operaciones por segundo de la mejor de varias rondas"""
+    numero, _ = timeit.Timer(funcion).autorange()
+    mejor = min(timeit.repeat(funcion, number=numero, repeat=repeticiones))
+    return numero / mejor
+
+
+def _mensajes_de_ejemplo():
+    inventario = [{
+        'id_articulo': i,
+        'nombre': f"Artículo {i}",
+        'descripcion': f"Producto de prueba para el inventario distribuido, lote {i % 7}",
+        'cantidad': i % 50,
+        'sucursal': 3,
+        'cantidad_total': 200
+    } for i in range(500)]
+    return {
+        'venta_articulo': {'tipo': 'venta_articulo', 'origen': 3,
+                           'datos': {'id_articulo': 1542, 'id_cliente': 87, 'cantidad': 2}},
+        'actualizar_inventario': {'tipo': 'actualizar_inventario', 'origen': 3, 'id_evento': 98231,
+                                  'datos': {'id_articulo': 1542, 'id_sucursal': 3, 'nueva_cantidad': 41,
+                                            'cantidad': 2, 'guia_envio': 'A1B2C3D4E5F6A7B8C9D0',
+                                            'id_cliente': 87}},
+        'eleccion_maestro': {'tipo': 'eleccion_maestro', 'origen': 2, 'iniciador': 2},
+        'respuesta_ok': {'estado': 'ok', 'guia_envio': 'A1B2C3D4E5F6A7B8C9D0'},
+        'inventario_500_filas': {'estado': 'ok', 'inventario': inventario},
+    }
+
+
+def benchmark_codec():
+    """Compara el códec binario con pickle: bytes por mensaje y ops/s"""
+    print("=== CÓDEC BINARIO vs PICKLE ===")
+    print(f"{'mensaje':<24}{'bytes pickle':>14}{'bytes códec':>13}"
+          f"{'cod. pickle/s':>16}{'cod. códec/s':>15}{'dec. pickle/s':>16}{'dec. códec/s':>15}")
+    for nombre, mensaje in _mensajes_de_ejemplo().items():
+        datos_pickle = pickle.dumps(mensaje)
+        datos_codec = protocolo.codificar(mensaje)
+        assert protocolo.decodificar(datos_codec) == mensaje
+        print(f"{nombre:<24}{len(datos_pickle):>14}{len(datos_codec):>13}"
+              f"{_medir(lambda: pickle.dumps(mensaje)):>16,.0f}"
+              f"{_medir(lambda: protocolo.codificar(mensaje)):>15,.0f}"
+              f"{_medir(lambda: pickle.loads(datos_pickle)):>16,.0f}"
+              f"{_medir(lambda: protocolo.decodificar(datos_codec)):>15,.0f}")
+
+
+def benchmark_compresion():
+    """Ratio y velocidad de cada compresión sobre respuestas típicas"""
+    print("=== COMPRESIÓN DE RESPUESTAS ===")
+    direcciones = ['Av. Industrial', 'Calle Los Pinos', 'Jr. Comercial', 'Av. Flores', 'Calle Mercado']
+    clientes = {'estado': 'ok', 'clientes': [{
+        'id_cliente': i,
+        'nombre': f"Cliente {i}",
+        'direccion': f"{direcciones[i % 5]} {100 + i % 900}",
+        'telefono': f"987{i:06d}",
+        'email': f"cliente{i}@gmail.com",
+        'sucursal_registro': i % 8 + 1
+    } for i in range(500)]}
+    cargas = {'inventario_500_filas': _mensajes_de_ejemplo()['inventario_500_filas'],
+              'clientes_500_filas': clientes}
+    algoritmos = {'zlib': protocolo.COMPRESION_ZLIB,
+                  'zlib+diccionario': protocolo.COMPRESION_ZLIB_DICCIONARIO,
+                  'lzma': protocolo.COMPRESION_LZMA}
+    print(f"{'carga':<24}{'algoritmo':<18}{'bytes':>9}{'comprimido':>12}{'ratio':>8}{'comp./s':>10}")
+    for nombre, carga in cargas.items():
+        cuerpo = protocolo.codificar(carga)
+        for nombre_algoritmo, algoritmo in algoritmos.items():
+            comprimido = protocolo._comprimir(cuerpo, algoritmo)
+            assert protocolo._descomprimir(comprimido, algoritmo) == cuerpo
+            print(f"{nombre:<24}{nombre_algoritmo:<18}{len(cuerpo):>9}{len(comprimido):>12}"
+                  f"{len(cuerpo) / len(comprimido):>7.1f}x"
+                  f"{_medir(lambda: protocolo._comprimir(cuerpo, algoritmo)):>10,.0f}")
+
+
+def _ventas_por_segundo(bloquear, articulos, hilos=16, ventas=800, latencia_bd=0.002):
+    """Ventas/s de varios hilos; cada venta retiene su bloqueo lo que dura la transacción"""
+    def vender(i):
+        with bloquear(i % articulos):
+            time.sleep(latencia_bd)  # Ida y vuelta a la BD con la fila bloqueada
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        list(executor.map(vender, range(ventas)))
+    return ventas / (time.perf_counter() - inicio)
+
+
+def benchmark_contencion():
+    """Ventas/s con el bloqueo global anterior frente a las franjas por artículo"""
+    print("=== CONTENCIÓN EN VENTAS (16 hilos, 2 ms por transacción) ===")
+    lock_global = threading.Lock()
+    locks_articulos = LocksPorArticulo()
+    print(f"{'artículos distintos':<22}{'lock global':>14}{'por artículo':>15}")
+    for articulos in (1, 2, 4, 8, 16, 64):
+        globales = _ventas_por_segundo(lambda _: lock_global, articulos)
+        por_articulo = _ventas_por_segundo(locks_articulos.bloquear, articulos)
+        print(f"{articulos:<22}{globales:>14,.0f}{por_articulo:>15,.0f}")
+
+
+def benchmark_cache():
+    """Lecturas/s del inventario en caché, con y sin ventas intercaladas"""
+    print("=== CACHÉ DE INVENTARIO (5000 artículos) ===")
+    filas = [{'id_articulo': i, 'nombre': f"Artículo {i}", 'descripcion': '', 'cantidad': 50,
+              'sucursal': 1, 'cantidad_total': 200} for i in range(5000)]
+    cache = CacheInventario()
+    _, version = cache.obtener(1)
+    cache.guardar(1, version, filas)
+    print(f"{'lectura':<32}{_medir(lambda: cache.obtener(1)):>14,.0f} ops/s")
+    ventas = iter(range(10 ** 9))
+    def leer_tras_venta():
+        cache.parchear({(next(ventas) % 5000, 1): 49})
+        cache.obtener(1)
+    print(f"{'venta (parche) + lectura':<32}{_medir(leer_tras_venta):>14,.0f} ops/s")
+    resumen = cache.resumen()
+    print(f"aciertos {resumen['tasa_aciertos']:.1%}, versión {resumen['version']}")
+
+
+# Misma forma que el descuento condicional de registrar_venta (con cantidad 0 no cambia nada)
+_DESCUENTO_VENTA = """
+    UPDATE bench_distribucion
+    SET cantidad = cantidad - %s, ultima_actualizacion = CURRENT_TIMESTAMP
+    WHERE id_articulo = %s AND id_sucursal = %s AND cantidad >= %s
+    RETURNING cantidad
+"""
+
+
+def benchmark_preparadas(ventas=3000):
+    """Costo por venta de analizar y planificar la sentencia frente a ejecutarla preparada"""
+    print("=== SENTENCIAS PREPARADAS (requiere PostgreSQL) ===")
+    try:
+        pool = PoolConexionesBD({'min_conexiones': 0})
+        pool.registrar_sentencia('bench_descuento', ('integer', 'integer', 'integer', 'integer'), _DESCUENTO_VENTA)
+        conn = pool.obtener()
+    except Exception as e:
+        print(f"PostgreSQL no disponible: {e}")
+        return
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE bench_distribucion AS
+            SELECT i AS id_articulo, s AS id_sucursal, 100 AS cantidad,
+                   CURRENT_TIMESTAMP AS ultima_actualizacion
+            FROM generate_series(1, 10000) i, generate_series(1, 4) s
+        """)
+        cur.execute("CREATE UNIQUE INDEX ON bench_distribucion (id_articulo, id_sucursal)")
+        cur.execute("ANALYZE bench_distribucion")
+        
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + _DESCUENTO_VENTA, (0, 1, 1, 0))
+        planificacion = cur.fetchone()[0][0]['Planning Time']
+        
+        def medir(ejecutar):
+            inicio = time.perf_counter()
+            for i in range(ventas):
+                ejecutar((0, i % 10000 + 1, i % 4 + 1, 0))
+                cur.fetchone()
+            return (time.perf_counter() - inicio) / ventas * 1e6
+        sin_preparar = medir(lambda parametros: cur.execute(_DESCUENTO_VENTA, parametros))
+        preparada = medir(lambda parametros: pool.ejecutar(cur, 'bench_descuento', parametros))
+        print(f"{'planificación (EXPLAIN)':<28}{planificacion * 1000:>10.0f} us")
+        print(f"{'sin preparar':<28}{sin_preparar:>10.0f} us/venta")
+        print(f"{'preparada':<28}{preparada:>10.0f} us/venta")
+        print(f"{'ahorro por venta':<28}{sin_preparar - preparada:>10.0f} us")
+    finally:
+        if not conn.closed:
+            conn.autocommit = False
+        pool.devolver(conn)
+        pool.cerrar()  # Cierra la sesión y con ella la tabla temporal
+
+
+BENCHMARKS = {
+    'codec': benchmark_codec,
+    'compresion': benchmark_compresion,
+    'contencion': benchmark_contencion,
+    'cache': benchmark_cache,
+    'preparadas': benchmark_preparadas,
+}
+
+if __name__ == "__main__":
+    seleccion = sys.argv[1:] or list(BENCHMARKS)
+    for nombre in seleccion:
+        inicio = time.perf_counter()
+        BENCHMARKS[nombre]()
+        print(f"({nombre}: {time.perf_counter() - inicio:.1f}s)\n")
@@ -1,14 +1,25 @@
+import asyncio
+import contextlib
+import csv
+import io
+import queue
 import socket
 import threading
 import datetime
 import time
-import pickle
-from concurrent.futures import ThreadPoolExecutor
+import heapq
+import bisect
+import math
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import random
 import psycopg2
-from psycopg2 import sql
+from psycopg2.extras import Json, execute_values
 import logging
 import hashlib
+import protocolo
+from protocolo import RespuestaStream
 
 # Configuración de logging
 logging.basicConfig(
@@ -20,101 +31,1192 @@ logging.basicConfig(
     ]
 )
 
+class FilasRemotas:
+    """Filas de una respuesta por partes, entregadas a medida que llegan sus fragmentos"""
+    def __init__(self, fragmentos):
+        self.fragmentos = fragmentos
+
+    def __iter__(self):
+        while True:
+            bloque = self.fragmentos.get()
+            if bloque is None:
+                return
+            if isinstance(bloque, Exception):
+                raise bloque
+            yield from bloque
+
+
+class SolicitudPendiente:
+    """Solicitud enviada por una conexión multiplexada que espera su respuesta
+    
+    Con stream, el futuro se resuelve apenas llega la cabecera de la respuesta
+    y su campo de filas es un FilasRemotas que se va llenando con cada
+    fragmento; el plazo pasa a contar desde la última trama recibida.
+    """
+    def __init__(self, timeout=None, stream=False):
+        self.id_solicitud = None
+        self.timeout = timeout
+        self.limite = time.monotonic() + timeout if timeout else None
+        self.futuro = Future()
+        self.ensamblador = protocolo.EnsambladorRespuesta()
+        self.fragmentos = queue.Queue() if stream else None
+        self.en_stream = False
+
+    def entregar(self, tipo, cuerpo):
+        """Recibe una trama de la respuesta; devuelve True cuando la respuesta terminó"""
+        if self.fragmentos is not None:
+            return self._entregar_stream(tipo, cuerpo)
+        respuesta = self.ensamblador.agregar(tipo, cuerpo)
+        if respuesta is None:
+            return False
+        self.futuro.set_result(respuesta)
+        return True
+
+    def _entregar_stream(self, tipo, cuerpo):
+        if self.timeout:
+            self.limite = time.monotonic() + self.timeout
+        if tipo == protocolo.TRAMA_MENSAJE and not self.en_stream:
+            self.futuro.set_result(protocolo.decodificar(cuerpo))
+            return True
+        if tipo == protocolo.TRAMA_STREAM and not self.en_stream:
+            respuesta = protocolo.decodificar(cuerpo)
+            respuesta[respuesta.pop('campo')] = FilasRemotas(self.fragmentos)
+            self.en_stream = True
+            self.futuro.set_result(respuesta)
+            return False
+        if not self.en_stream:
+            raise protocolo.ErrorProtocolo(f"Trama tipo {tipo} antes del inicio del stream")
+        if tipo == protocolo.TRAMA_FRAGMENTO:
+            self.fragmentos.put(protocolo.decodificar(cuerpo))
+            return False
+        if tipo == protocolo.TRAMA_FIN:
+            if cuerpo:
+                # El nodo remoto falló generando filas
+                error = protocolo.decodificar(cuerpo)
+                self.fragmentos.put(RuntimeError(error.get('mensaje', 'Error en el nodo remoto')))
+            else:
+                self.fragmentos.put(None)
+            return True
+        raise protocolo.ErrorProtocolo(f"Trama inesperada tipo {tipo}")
+
+    def fallar(self, error):
+        if not self.futuro.done():
+            self.futuro.set_exception(error)
+        elif self.en_stream:
+            # Quien recorre las filas se entera al llegar al fragmento que falta
+            self.fragmentos.put(error)
+
+
+class ConexionNodo:
+    """Conexión TCP persistente hacia otro nodo
+    
+    Del lado cliente es multiplexada: cada solicitud lleva un id, puede haber
+    muchas en curso a la vez y un hilo lector entrega cada respuesta a la
+    suya aunque lleguen en otro orden.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.lector = sock.makefile('rb')
+        self.ultimo_uso = time.time()
+        # Versión del protocolo y compresión acordadas en el saludo
+        self.version = None
+        self.compresion = protocolo.COMPRESION_NINGUNA
+        self.lock_escritura = threading.Lock()
+        self.lock_pendientes = threading.Lock()
+        self.pendientes = {}  # {id_solicitud: SolicitudPendiente}
+        self.ids = itertools.count(1)
+        self.cerrada = False
+
+    # Lado servidor
+    def recibir(self):
+        """Devuelve (id_solicitud, mensaje) de la siguiente solicitud"""
+        tipo, id_solicitud, cuerpo = protocolo.leer_trama(self.lector)
+        if tipo != protocolo.TRAMA_MENSAJE:
+            raise protocolo.ErrorProtocolo(f"Se esperaba un mensaje y llegó trama tipo {tipo}")
+        return id_solicitud, protocolo.decodificar(cuerpo)
+
+    def enviar_respuesta(self, respuesta, id_solicitud=0):
+        if isinstance(respuesta, RespuestaStream):
+            protocolo.enviar_stream(self.sock, respuesta, self.compresion, id_solicitud, self.lock_escritura)
+        else:
+            protocolo.enviar_mensaje(self.sock, respuesta, self.compresion, id_solicitud, self.lock_escritura)
+
+    # Lado cliente
+    def iniciar_lector(self):
+        self.sock.settimeout(None)  # Los plazos ahora son por solicitud
+        threading.Thread(target=self._leer_respuestas, daemon=True).start()
+
+    def _leer_respuestas(self):
+        """Reparte las tramas recibidas entre las solicitudes en curso"""
+        error = None
+        try:
+            while True:
+                tipo, id_solicitud, cuerpo = protocolo.leer_trama(self.lector)
+                self.ultimo_uso = time.time()
+                with self.lock_pendientes:
+                    solicitud = self.pendientes.get(id_solicitud)
+                if solicitud is None:
+                    continue  # Solicitud vencida: se descarta su respuesta
+                try:
+                    terminada = solicitud.entregar(tipo, cuerpo)
+                except protocolo.ErrorProtocolo as e:
+                    solicitud.fallar(e)
+                    terminada = True
+                if terminada:
+                    with self.lock_pendientes:
+                        self.pendientes.pop(id_solicitud, None)
+        except EOFError:
+            error = ConnectionError("El nodo remoto cerró la conexión")
+        except Exception as e:
+            error = e if isinstance(e, ConnectionError) else ConnectionError(str(e))
+        finally:
+            self.cerrar(error)
+
+    def solicitar(self, mensaje, timeout=None, stream=False):
+        """Envía un mensaje sin esperar la respuesta; devuelve su SolicitudPendiente"""
+        solicitud = SolicitudPendiente(timeout, stream)
+        with self.lock_pendientes:
+            if self.cerrada:
+                raise ConnectionError("Conexión cerrada")
+            solicitud.id_solicitud = next(self.ids) % 0xFFFFFFFF + 1  # El id 0 es "sin multiplexar"
+            self.pendientes[solicitud.id_solicitud] = solicitud
+        try:
+            protocolo.enviar_mensaje(self.sock, mensaje, self.compresion,
+                                     solicitud.id_solicitud, self.lock_escritura)
+        except Exception as e:
+            self.cerrar(ConnectionError(str(e)))
+            raise
+        self.ultimo_uso = time.time()
+        return solicitud
+
+    def vencer_solicitudes(self):
+        """Falla las solicitudes cuyo plazo ya pasó"""
+        ahora = time.monotonic()
+        with self.lock_pendientes:
+            vencidas = [s for s in self.pendientes.values() if s.limite and s.limite <= ahora]
+            for solicitud in vencidas:
+                del self.pendientes[solicitud.id_solicitud]
+        for solicitud in vencidas:
+            solicitud.fallar(TimeoutError("El nodo no respondió a tiempo"))
+
+    def en_curso(self):
+        with self.lock_pendientes:
+            return len(self.pendientes)
+
+    def esta_sana(self, max_inactividad):
+        """Una conexión sirve si sigue abierta y no lleva demasiado tiempo ociosa"""
+        with self.lock_pendientes:
+            if self.cerrada:
+                return False
+            ocupada = bool(self.pendientes)
+        return ocupada or time.time() - self.ultimo_uso <= max_inactividad
+
+    def cerrar(self, error=None):
+        """Cierra la conexión y falla todas las solicitudes que seguían en curso"""
+        with self.lock_pendientes:
+            self.cerrada = True
+            pendientes = list(self.pendientes.values())
+            self.pendientes.clear()
+        for solicitud in pendientes:
+            solicitud.fallar(error or ConnectionError("Conexión cerrada"))
+        try:
+            # shutdown despierta al hilo lector bloqueado en la lectura
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.lector.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class PoolConexionesNodo:
+    """Mantiene conexiones multiplexadas por nodo
+    
+    Cada solicitud va por la conexión con menos solicitudes en curso; sólo se
+    abre otra cuando todas superan solicitudes_por_conexion, hasta max_por_nodo.
+    Una conexión ociosa más de verificar_tras se prueba con mensaje_sondeo
+    antes de usarla, como el pool de PostgreSQL con SELECT 1.
+    """
+    def __init__(self, nodos_conocidos, max_por_nodo=4, timeout=5.0, max_inactividad=60.0,
+                 compresiones=protocolo.COMPRESIONES_SOPORTADAS, solicitudes_por_conexion=32,
+                 mensaje_sondeo=None, verificar_tras=5.0, timeout_sondeo=1.0):
+        self.nodos_conocidos = nodos_conocidos
+        self.compresiones = compresiones
+        self.max_por_nodo = max_por_nodo
+        self.solicitudes_por_conexion = solicitudes_por_conexion
+        self.timeout = timeout
+        self.max_inactividad = max_inactividad
+        self.mensaje_sondeo = mensaje_sondeo
+        self.verificar_tras = verificar_tras
+        self.timeout_sondeo = timeout_sondeo
+        self.lock = threading.Lock()
+        self.conexiones = {}  # {nodo_id: [ConexionNodo]}
+        self.aperturas = {}   # {nodo_id: Lock}, una apertura a la vez por nodo
+        self.activo = True
+        threading.Thread(target=self._vigilar_plazos, daemon=True).start()
+
+    def _vigilar_plazos(self, intervalo=0.1):
+        """Vence las solicitudes sin respuesta aunque la conexión no reciba nada"""
+        while self.activo:
+            time.sleep(intervalo)
+            with self.lock:
+                conexiones = [c for lista in self.conexiones.values() for c in lista]
+            for conexion in conexiones:
+                conexion.vencer_solicitudes()
+
+    def _conectar(self, nodo_id, timeout):
+        ip, puerto = self.nodos_conocidos[nodo_id]
+        sock = socket.create_connection((ip, puerto), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conexion = ConexionNodo(sock)
+        try:
+            conexion.version, conexion.compresion = protocolo.saludar(
+                sock, conexion.lector, self.compresiones)
+        except Exception:
+            conexion.cerrar()
+            raise
+        conexion.iniciar_lector()
+        return conexion
+
+    def _elegir(self, nodo_id):
+        """Devuelve la conexión menos cargada si no hace falta abrir otra"""
+        while True:
+            with self.lock:
+                conexiones = self.conexiones.get(nodo_id, [])
+                sanas = [c for c in conexiones if c.esta_sana(self.max_inactividad)]
+                viejas = [c for c in conexiones if c not in sanas]
+                self.conexiones[nodo_id] = sanas
+            for conexion in viejas:
+                conexion.cerrar()
+            if not sanas:
+                return None
+            conexion = min(sanas, key=ConexionNodo.en_curso)
+            if conexion.en_curso() >= self.solicitudes_por_conexion and len(sanas) < self.max_por_nodo:
+                return None
+            if self._responde(conexion):
+                return conexion
+            # El nodo pudo reiniciarse o la red cortar la conexión sin avisar
+            logging.warning(f"Conexión ociosa hacia nodo {nodo_id} no respondió la prueba; descartada")
+            self.descartar(nodo_id, conexion)
+
+    def _responde(self, conexion):
+        """Prueba una conexión ociosa antes de usarla; las que están en uso no se prueban"""
+        if (self.mensaje_sondeo is None or conexion.en_curso()
+                or time.time() - conexion.ultimo_uso < self.verificar_tras):
+            return True
+        try:
+            conexion.solicitar(self.mensaje_sondeo, timeout=self.timeout_sondeo).futuro.result(
+                self.timeout_sondeo)
+            return True
+        except Exception:
+            return False
+
+    def obtener(self, nodo_id, timeout=None):
+        """Devuelve (conexion, reutilizada); la conexión se comparte, no se devuelve"""
+        conexion = self._elegir(nodo_id)
+        if conexion is not None:
+            return conexion, True
+        with self.lock:
+            apertura = self.aperturas.setdefault(nodo_id, threading.Lock())
+        with apertura:
+            # Otro hilo pudo abrir una conexión mientras se esperaba
+            conexion = self._elegir(nodo_id)
+            if conexion is not None:
+                return conexion, True
+            conexion = self._conectar(nodo_id, timeout or self.timeout)
+            with self.lock:
+                self.conexiones.setdefault(nodo_id, []).append(conexion)
+            return conexion, False
+
+    def descartar(self, nodo_id, conexion):
+        """Cierra una conexión que falló y la saca del pool"""
+        conexion.cerrar()
+        with self.lock:
+            conexiones = self.conexiones.get(nodo_id, [])
+            if conexion in conexiones:
+                conexiones.remove(conexion)
+
+    def cerrar(self):
+        self.activo = False
+        with self.lock:
+            conexiones = [c for lista in self.conexiones.values() for c in lista]
+            self.conexiones.clear()
+        for conexion in conexiones:
+            conexion.cerrar()
+
+
+# Parámetros de PostgreSQL y tamaño del pool; cada nodo puede sobrescribirlos en config['db_config']
+DB_CONFIG_PREDETERMINADA = {
+    'dbname': "inventario_distribuido",
+    'user': "postgres",
+    'password': "tu_password",
+    'host': "localhost",
+    'port': 5432,
+    'min_conexiones': 2,
+    'max_conexiones': 16,
+    'timeout_espera': 5.0,     # Segundos máximos esperando una conexión libre
+    'verificar_tras': 30.0,    # Una conexión ociosa más tiempo que esto se verifica antes de usarla
+    'timeout_conexion': 5
+}
+
+
+class ConexionBD(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias ya preparó en su sesión"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+
+
+class PoolConexionesBD:
+    """Pool acotado de conexiones a PostgreSQL con préstamo por solicitud
+    
+    Cada préstamo tiene la conexión para sí solo; al devolverla se deshace lo
+    que no se confirmó. Las conexiones rotas (p. ej. tras reiniciar
+    PostgreSQL) se descartan y se reabren en el siguiente préstamo.
+    
+    Las sentencias registradas se preparan en el servidor la primera vez que
+    cada conexión las usa y luego se ejecutan por nombre, sin volver a
+    analizarlas ni planificarlas.
+    """
+    def __init__(self, db_config=None):
+        config = dict(DB_CONFIG_PREDETERMINADA, **(db_config or {}))
+        self.min_conexiones = config.pop('min_conexiones')
+        self.max_conexiones = config.pop('max_conexiones')
+        self.timeout_espera = config.pop('timeout_espera')
+        self.verificar_tras = config.pop('verificar_tras')
+        config['connect_timeout'] = config.pop('timeout_conexion')
+        self.parametros = config
+        self.cupos = threading.BoundedSemaphore(self.max_conexiones)
+        self.lock = threading.Lock()
+        self.libres = []  # [(conexión, instante en que se devolvió)]
+        self.sentencias = {}  # {nombre: (PREPARE ..., EXECUTE ...)}
+        self.metricas = {
+            'prestamos': 0,
+            'esperas': 0,          # Préstamos que encontraron el pool saturado
+            'tiempo_espera': 0.0,
+            'espera_maxima': 0.0,
+            'agotados': 0,         # Préstamos que vencieron sin conseguir conexión
+            'conexiones_abiertas': 0,
+            'reconexiones': 0,
+            'en_uso': 0,
+            'preparaciones': 0     # PREPARE enviados (uno por sentencia y conexión)
+        }
+        for _ in range(self.min_conexiones):
+            try:
+                self.libres.append((self.nueva_conexion(), time.monotonic()))
+            except Exception as e:
+                logging.error(f"Error conectando a PostgreSQL: {e}")
+                break
+
+    def nueva_conexion(self):
+        conn = psycopg2.connect(connection_factory=ConexionBD, **self.parametros)
+        with self.lock:
+            self.metricas['conexiones_abiertas'] += 1
+        return conn
+
+    def _cerrar(self, conn):
+        with self.lock:
+            self.metricas['conexiones_abiertas'] -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _esta_sana(self, conn, devuelta):
+        """Descarta conexiones cerradas y verifica las que llevan tiempo ociosas"""
+        if conn.closed:
+            return False
+        if time.monotonic() - devuelta < self.verificar_tras:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def obtener(self):
+        """Presta una conexión; espera hasta timeout_espera si el pool está saturado"""
+        inicio = time.monotonic()
+        if not self.cupos.acquire(blocking=False):
+            with self.lock:
+                self.metricas['esperas'] += 1
+            if not self.cupos.acquire(timeout=self.timeout_espera):
+                with self.lock:
+                    self.metricas['agotados'] += 1
+                raise TimeoutError("No hay conexiones libres a PostgreSQL")
+        espera = time.monotonic() - inicio
+        try:
+            conn = None
+            while conn is None:
+                with self.lock:
+                    conn, devuelta = self.libres.pop() if self.libres else (None, None)
+                if conn is None:
+                    conn = self.nueva_conexion()
+                elif not self._esta_sana(conn, devuelta):
+                    logging.warning("Conexión a PostgreSQL caída; reconectando")
+                    self._cerrar(conn)
+                    with self.lock:
+                        self.metricas['reconexiones'] += 1
+                    conn = None
+        except Exception:
+            self.cupos.release()
+            raise
+        with self.lock:
+            self.metricas['prestamos'] += 1
+            self.metricas['tiempo_espera'] += espera
+            self.metricas['espera_maxima'] = max(self.metricas['espera_maxima'], espera)
+            self.metricas['en_uso'] += 1
+        return conn
+
+    def devolver(self, conn):
+        """Recupera una conexión prestada, deshaciendo lo que quedó sin confirmar"""
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            sana = not conn.closed
+        except Exception:
+            sana = False
+        if sana:
+            with self.lock:
+                self.libres.append((conn, time.monotonic()))
+        else:
+            self._cerrar(conn)
+        with self.lock:
+            self.metricas['en_uso'] -= 1
+        self.cupos.release()
+
+    def registrar_sentencia(self, nombre, tipos, consulta):
+        """Registra una consulta con parámetros %s de los tipos SQL indicados"""
+        partes = consulta.split('%s')
+        if len(partes) - 1 != len(tipos):
+            raise ValueError(f"La sentencia {nombre} espera {len(partes) - 1} parámetros")
+        texto = partes[0] + ''.join(f"${numero}{parte}" for numero, parte in enumerate(partes[1:], 1))
+        argumentos = f" ({', '.join(['%s'] * len(tipos))})" if tipos else ""
+        self.sentencias[nombre] = (f"PREPARE {nombre} ({', '.join(tipos)}) AS {texto}",
+                                   f"EXECUTE {nombre}{argumentos}")
+
+    def ejecutar(self, cur, nombre, parametros=()):
+        """Ejecuta una sentencia registrada, preparándola si la conexión aún no la tiene"""
+        preparar, ejecutar = self.sentencias[nombre]
+        preparadas = cur.connection.preparadas
+        if nombre not in preparadas:
+            cur.execute(preparar)
+            preparadas.add(nombre)
+            with self.lock:
+                self.metricas['preparaciones'] += 1
+        cur.execute(ejecutar, parametros)
+
+    @contextlib.contextmanager
+    def conexion(self, autocommit=False):
+        """Préstamo de una conexión para un bloque with
+        
+        Con autocommit cada sentencia es su propia transacción: sin BEGIN ni
+        COMMIT aparte, una llamada a una función del servidor es un solo viaje.
+        """
+        conn = self.obtener()
+        try:
+            if autocommit:
+                conn.autocommit = True
+            yield conn
+        finally:
+            if autocommit:
+                try:
+                    conn.autocommit = False
+                except Exception:
+                    pass
+            self.devolver(conn)
+
+    def resumen(self):
+        with self.lock:
+            resumen = dict(self.metricas, libres=len(self.libres), maximo=self.max_conexiones)
+        prestamos = resumen['prestamos']
+        resumen['espera_media'] = resumen['tiempo_espera'] / prestamos if prestamos else 0.0
+        resumen['saturacion'] = resumen['esperas'] / prestamos if prestamos else 0.0
+        return resumen
+
+    def cerrar(self):
+        with self.lock:
+            libres = [conn for conn, _ in self.libres]
+            self.libres.clear()
+        for conn in libres:
+            self._cerrar(conn)
+
+
+class DetectorFallos:
+    """Detector de fallos por latidos con nivel de sospecha phi (phi accrual)
+    
+    Guarda los últimos intervalos entre latidos de cada nodo. phi es -log10
+    de la probabilidad de que el próximo latido llegue todavía más tarde que
+    el tiempo ya transcurrido, según una normal con la media y el desvío de
+    esos intervalos; el nodo queda sospechado cuando phi supera el umbral.
+    """
+    def __init__(self, intervalo=0.1, umbral=8.0, ventana=100, desvio_minimo=0.05):
+        self.intervalo = intervalo
+        self.umbral = umbral
+        self.ventana = ventana
+        self.desvio_minimo = desvio_minimo
+        self.lock = threading.Lock()
+        self.ultimos = {}     # {nodo_id: instante del último latido}
+        self.intervalos = {}  # {nodo_id: deque de intervalos}
+
+    def latido(self, nodo_id):
+        ahora = time.monotonic()
+        with self.lock:
+            anterior = self.ultimos.get(nodo_id)
+            # Una pausa larga (nodo caído que volvió) no es un intervalo normal
+            if anterior is not None and ahora - anterior < 10 * self.intervalo:
+                self.intervalos.setdefault(nodo_id, deque(maxlen=self.ventana)).append(ahora - anterior)
+            self.ultimos[nodo_id] = ahora
+
+    def conocido(self, nodo_id):
+        """Si alguna vez llegó un latido del nodo"""
+        with self.lock:
+            return nodo_id in self.ultimos
+
+    def phi(self, nodo_id):
+        with self.lock:
+            ultimo = self.ultimos.get(nodo_id)
+            if ultimo is None:
+                return math.inf
+            intervalos = self.intervalos.get(nodo_id) or (self.intervalo,)
+            media = sum(intervalos) / len(intervalos)
+            varianza = sum((intervalo - media) ** 2 for intervalo in intervalos) / len(intervalos)
+        desvio = max(math.sqrt(varianza), self.desvio_minimo)
+        probabilidad = 0.5 * math.erfc((time.monotonic() - ultimo - media) / (desvio * math.sqrt(2)))
+        return -math.log10(probabilidad) if probabilidad > 0 else math.inf
+
+    def esta_vivo(self, nodo_id):
+        return self.phi(nodo_id) < self.umbral
+
+    def vista(self):
+        """Vista de membresía: {nodo_id: phi} de los nodos de los que llegó algún latido"""
+        with self.lock:
+            nodos = list(self.ultimos)
+        return {nodo_id: self.phi(nodo_id) for nodo_id in nodos}
+
+
+class InterruptoresNodos:
+    """Interruptor de circuito por nodo: tras varios fallos seguidos deja de intentarlo
+    
+    Cerrado deja pasar todo; abierto rechaza al instante hasta que vence su
+    espera, que se duplica en cada apertura seguida; semiabierto deja pasar
+    una sola prueba, que lo cierra o lo vuelve a abrir.
+    
+    Los fallos de latidos y los de solicitudes se cuentan por separado: cada
+    cuenta vuelve a cero con un éxito de su mismo tipo, así sólo abren el
+    circuito fallos realmente seguidos.
+    """
+    CERRADO, ABIERTO, SEMIABIERTO = 'cerrado', 'abierto', 'semiabierto'
+    
+    def __init__(self, umbral_fallos=3, espera_inicial=0.5, espera_maxima=10.0, al_cerrar=None):
+        self.lock = threading.Lock()
+        self.umbral_fallos = umbral_fallos
+        self.espera_inicial = espera_inicial
+        self.espera_maxima = espera_maxima
+        self.al_cerrar = al_cerrar  # Se llama con el nodo_id cuando un nodo vuelve
+        # {nodo_id: [estado, fallos de solicitudes, fallos de latidos, aperturas seguidas, próximo intento]}
+        self.estados = {}
+        self.rechazos = 0
+    
+    def _estado(self, nodo_id):
+        return self.estados.setdefault(nodo_id, [self.CERRADO, 0, 0, 0, 0.0])
+    
+    def permitir(self, nodo_id):
+        """Indica si se puede enviar al nodo; pasada la espera, el envío es la prueba"""
+        with self.lock:
+            estado = self._estado(nodo_id)
+            if estado[0] == self.CERRADO:
+                return True
+            if estado[0] == self.ABIERTO and time.monotonic() >= estado[4]:
+                estado[0] = self.SEMIABIERTO
+                return True
+            self.rechazos += 1
+            return False
+    
+    def abierto(self, nodo_id):
+        """Como permitir pero sin reservar la prueba: True si un envío se rechazaría"""
+        with self.lock:
+            estado = self.estados.get(nodo_id)
+            if estado is None or estado[0] == self.CERRADO:
+                return False
+            return estado[0] == self.SEMIABIERTO or time.monotonic() < estado[4]
+    
+    def exito(self, nodo_id, latido=False):
+        """Registra una respuesta; un latido cierra el circuito pero no borra fallos de solicitudes
+        
+        Las aperturas seguidas (y con ellas la espera) se olvidan con un éxito
+        con el circuito ya cerrado, no con la prueba que lo cierra.
+        """
+        with self.lock:
+            estado = self._estado(nodo_id)
+            recuperado = estado[0] != self.CERRADO
+            if recuperado:
+                estado[0], estado[1], estado[2] = self.CERRADO, 0, 0
+            elif latido:
+                estado[2] = estado[3] = 0
+            else:
+                estado[1] = estado[2] = estado[3] = 0
+        if recuperado:
+            logging.info(f"Nodo {nodo_id} responde de nuevo; circuito cerrado")
+            if self.al_cerrar:
+                self.al_cerrar(nodo_id)
+    
+    def fallo(self, nodo_id, latido=False):
+        with self.lock:
+            estado = self._estado(nodo_id)
+            cuenta = 2 if latido else 1
+            estado[cuenta] += 1
+            if not (estado[0] == self.SEMIABIERTO
+                    or (estado[0] == self.CERRADO and estado[cuenta] >= self.umbral_fallos)):
+                return
+            if estado[0] == self.SEMIABIERTO:
+                motivo = "falló la prueba"
+            elif latido:
+                motivo = f"{estado[2]} latidos fallidos seguidos"
+            else:
+                motivo = f"{estado[1]} solicitudes fallidas seguidas"
+            estado[3] += 1
+            espera = min(self.espera_maxima,
+                         self.espera_inicial * 2 ** (estado[3] - 1)) * random.uniform(0.8, 1.2)
+            estado[0] = self.ABIERTO
+            estado[4] = time.monotonic() + espera
+        logging.warning(f"Circuito hacia nodo {nodo_id} abierto: {motivo}; próxima prueba en {espera:.1f}s")
+    
+    def vista(self):
+        """{nodo_id: (estado, segundos hasta la próxima prueba)} de los circuitos no cerrados"""
+        ahora = time.monotonic()
+        with self.lock:
+            return {nodo_id: (estado[0], max(0.0, estado[4] - ahora))
+                    for nodo_id, estado in self.estados.items() if estado[0] != self.CERRADO}
+
+
+class PercentilLatencias:
+    """Últimas latencias de una operación, para estimar sus percentiles"""
+    def __init__(self, ventana=200, minimo_muestras=20):
+        self.lock = threading.Lock()
+        self.muestras = deque(maxlen=ventana)
+        self.minimo_muestras = minimo_muestras
+
+    def registrar(self, segundos):
+        with self.lock:
+            self.muestras.append(segundos)
+
+    def percentil(self, fraccion, predeterminado):
+        """Percentil `fraccion` (0-1) de las muestras; predeterminado si aún hay pocas"""
+        with self.lock:
+            if len(self.muestras) < self.minimo_muestras:
+                return predeterminado
+            ordenadas = sorted(self.muestras)
+        return ordenadas[min(len(ordenadas) - 1, int(fraccion * len(ordenadas)))]
+
+
+class LocksPorArticulo:
+    """Bloqueos repartidos en franjas por id_articulo
+    
+    Las operaciones sobre artículos distintos casi nunca comparten franja y
+    corren en paralelo; las del mismo artículo se turnan antes de pedir una
+    conexión a la BD, en lugar de esperar el bloqueo de fila con ella prestada.
+    """
+    def __init__(self, franjas=256):
+        self.franjas = [threading.Lock() for _ in range(franjas)]
+
+    def franja(self, id_articulo):
+        return hash(id_articulo) % len(self.franjas)
+
+    @contextlib.contextmanager
+    def bloquear(self, *ids_articulo):
+        """Toma las franjas de varios artículos siempre en el mismo orden (sin interbloqueos)"""
+        franjas = sorted({self.franja(id_articulo) for id_articulo in ids_articulo})
+        for indice in franjas:
+            self.franjas[indice].acquire()
+        try:
+            yield
+        finally:
+            for indice in reversed(franjas):
+                self.franjas[indice].release()
+
+
+class IndiceCapacidad:
+    """Espacio libre de cada sucursal en memoria, ordenado con un montículo de máximos
+    
+    Se carga una vez al iniciar y se ajusta con cada venta, alta o
+    redistribución confirmada, así ubicar un artículo no consulta la BD.
+    Las entradas viejas del montículo se descartan al llegar a la cima.
+    """
+    CAPACIDAD_PREDETERMINADA = 100  # DEFAULT de capacidad_maxima
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.espacios = {}
+        self.monticulo = []  # [(-espacio, id_sucursal)]
+
+    def cargar(self, espacios):
+        with self.lock:
+            self.espacios = dict(espacios)
+            self._reconstruir()
+
+    def _reconstruir(self):
+        self.monticulo = [(-espacio, id_sucursal) for id_sucursal, espacio in self.espacios.items()]
+        heapq.heapify(self.monticulo)
+
+    def ajustar(self, cambios):
+        """Aplica {id_sucursal: variación del espacio}: negativa al ocupar, positiva al liberar"""
+        with self.lock:
+            for id_sucursal, variacion in cambios.items():
+                if not variacion:
+                    continue
+                espacio = self.espacios.get(id_sucursal, self.CAPACIDAD_PREDETERMINADA) + variacion
+                self.espacios[id_sucursal] = espacio
+                heapq.heappush(self.monticulo, (-espacio, id_sucursal))
+            if len(self.monticulo) > 4 * len(self.espacios) + 64:
+                self._reconstruir()
+
+    def _cima(self):
+        while self.monticulo:
+            espacio, id_sucursal = self.monticulo[0]
+            if self.espacios.get(id_sucursal) == -espacio:
+                return id_sucursal
+            heapq.heappop(self.monticulo)
+        return None
+
+    def mayor(self):
+        """Sucursal con más espacio libre (None si no hay ninguna)"""
+        with self.lock:
+            return self._cima()
+
+    def espacio(self, id_sucursal):
+        with self.lock:
+            return self.espacios.get(id_sucursal, self.CAPACIDAD_PREDETERMINADA)
+
+    def instantanea(self):
+        """{id_sucursal: espacio libre}, sin negativos"""
+        with self.lock:
+            return {id_sucursal: max(espacio, 0) for id_sucursal, espacio in self.espacios.items()}
+
+    def distribuir(self, cantidad_total):
+        """Reparte en proporción al espacio libre; el resto va a la sucursal con más espacio"""
+        with self.lock:
+            cima = self._cima()
+            if cima is None:
+                return {}
+            espacios = {id_sucursal: max(espacio, 0) for id_sucursal, espacio in self.espacios.items()}
+        total = sum(espacios.values())
+        if total:
+            reparto = {id_sucursal: cantidad_total * espacio // total for id_sucursal, espacio in espacios.items()}
+        else:
+            reparto = {id_sucursal: cantidad_total // len(espacios) for id_sucursal in espacios}
+        reparto[cima] += cantidad_total - sum(reparto.values())
+        return reparto
+
+
+class CacheInventario:
+    """Inventario de cada sucursal en memoria, validado con un contador de versión
+    
+    Toda escritura confirmada sube la versión y una entrada sólo se sirve si
+    está al día. Las ventas parchean la fila afectada y mantienen vigentes
+    las entradas; las altas y redistribuciones las invalidan todas.
+    Guarda como mucho max_sucursales entradas de hasta max_filas filas;
+    las listas que entrega son compartidas y no deben modificarse.
+    """
+    def __init__(self, max_sucursales=8, max_filas=100000):
+        self.max_sucursales = max_sucursales
+        self.max_filas = max_filas
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entradas = OrderedDict()  # {id_sucursal: [version, {id_articulo: fila}, lista]}, en orden LRU
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, id_sucursal):
+        """Devuelve (filas, None) si hay acierto o (None, versión) para guardar lo que se lea"""
+        with self.lock:
+            entrada = self.entradas.get(id_sucursal)
+            if entrada and entrada[0] == self.version:
+                self.entradas.move_to_end(id_sucursal)
+                self.aciertos += 1
+                if entrada[2] is None:
+                    entrada[2] = list(entrada[1].values())
+                return entrada[2], None
+            self.fallos += 1
+            return None, self.version
+
+    def guardar(self, id_sucursal, version, filas):
+        """Guarda lo leído con la versión tomada antes de la consulta, si sigue vigente"""
+        if len(filas) > self.max_filas:
+            return
+        with self.lock:
+            if version != self.version:
+                return
+            self.entradas[id_sucursal] = [version, {fila['id_articulo']: fila for fila in filas}, list(filas)]
+            self.entradas.move_to_end(id_sucursal)
+            while len(self.entradas) > self.max_sucursales:
+                self.entradas.popitem(last=False)
+
+    def invalidar(self):
+        with self.lock:
+            self.version += 1
+
+    def parchear(self, cantidades):
+        """Aplica {(id_articulo, id_sucursal): nueva_cantidad} sobre las entradas vigentes"""
+        if not cantidades:
+            return
+        with self.lock:
+            vigentes = [entrada for entrada in self.entradas.values() if entrada[0] == self.version]
+            self.version += 1
+            for entrada in vigentes:
+                entrada[0] = self.version
+            for (id_articulo, id_sucursal), nueva_cantidad in cantidades.items():
+                entrada = self.entradas.get(id_sucursal)
+                if not entrada or entrada[0] != self.version:
+                    continue
+                fila = entrada[1].get(id_articulo)
+                if fila is None:
+                    # Fila que la entrada no tiene: mejor volver a leer
+                    del self.entradas[id_sucursal]
+                else:
+                    # Fila y lista nuevas: las listas ya entregadas no cambian
+                    entrada[1][id_articulo] = dict(fila, cantidad=nueva_cantidad)
+                    entrada[2] = None
+
+    def resumen(self):
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'entradas': len(self.entradas),
+                'version': self.version
+            }
+
+
+class IndicePrefijosClientes:
+    """Índice en memoria de clientes por prefijo del nombre (lista ordenada + bisect)
+    
+    Es una foto de la tabla: se carga al iniciar el nodo y con recargar().
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claves = []  # [(nombre en minúsculas, id_cliente)] ordenadas
+        self.clientes = {}  # {id_cliente: fila}
+
+    def cargar(self, clientes):
+        claves = []
+        filas = {}
+        for cliente in clientes:
+            claves.append((cliente['nombre'].lower(), cliente['id_cliente']))
+            filas[cliente['id_cliente']] = cliente
+        claves.sort()
+        with self.lock:
+            self.claves, self.clientes = claves, filas
+
+    def buscar(self, prefijo, limite):
+        prefijo = prefijo.lower()
+        with self.lock:
+            claves, clientes = self.claves, self.clientes
+        resultado = []
+        posicion = bisect.bisect_left(claves, (prefijo,))
+        while posicion < len(claves) and len(resultado) < limite:
+            nombre, id_cliente = claves[posicion]
+            if not nombre.startswith(prefijo):
+                break
+            resultado.append(clientes[id_cliente])
+            posicion += 1
+        return resultado
+
+    def __len__(self):
+        return len(self.claves)
+
+
+class LoteadorReplicacion:
+    """Agrupa los avisos de eventos nuevos durante una ventana corta o hasta N eventos"""
+    def __init__(self, ventana=0.005, max_eventos=200):
+        self.ventana = ventana
+        self.max_eventos = max_eventos
+        self.condicion = threading.Condition()
+        self.pendientes = 0
+
+    def avisar(self, cantidad=1):
+        with self.condicion:
+            self.pendientes += cantidad
+            self.condicion.notify_all()
+
+    def esperar_lote(self, timeout=1.0):
+        """Espera el primer evento y luego completa el lote o agota la ventana"""
+        with self.condicion:
+            if not self.pendientes:
+                self.condicion.wait(timeout)
+            if self.pendientes:
+                limite = time.monotonic() + self.ventana
+                while self.pendientes < self.max_eventos:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self.condicion.wait(restante)
+            cantidad = self.pendientes
+            self.pendientes = 0
+            return cantidad
+
+
+def coalescer_eventos(eventos):
+    """Deja sólo la última actualización de cada (id_articulo, id_sucursal)
+    
+    Recibe y devuelve [(id_evento, tipo, datos)] en orden; cada actualización
+    conservada queda en la posición de la más reciente, así nunca se adelanta
+    al nuevo_articulo que la precede. La cantidad vendida (delta) de las
+    actualizaciones descartadas se suma a la conservada.
+    """
+    conservadas = {}
+    resultado = []
+    for id_evento, tipo, datos in reversed(eventos):
+        if tipo == 'actualizar_inventario':
+            clave = (datos['id_articulo'], datos['id_sucursal'])
+            if clave in conservadas:
+                conservadas[clave]['cantidad'] += datos.get('cantidad', 0)
+                continue
+            datos = dict(datos, cantidad=datos.get('cantidad', 0))
+            conservadas[clave] = datos
+        resultado.append((id_evento, tipo, datos))
+    resultado.reverse()
+    return resultado
+
+
+def csv_de_articulos(articulos):
+    """Convierte dicts con nombre, descripcion y cantidad en un CSV para COPY"""
+    archivo = io.StringIO()
+    escritor = csv.writer(archivo)
+    escritor.writerow(('nombre', 'descripcion', 'cantidad'))
+    for articulo in articulos:
+        escritor.writerow((articulo['nombre'], articulo.get('descripcion') or '', articulo['cantidad']))
+    archivo.seek(0)
+    return archivo
+
+
 class NodoInventario:
-    def __init__(self, id_nodo, puerto, nodos_conocidos, es_maestro=False):
+    def __init__(self, id_nodo, puerto, nodos_conocidos, es_maestro=False,
+                 max_workers_bd=16, max_solicitudes=1024,
+                 compresiones=protocolo.COMPRESIONES_SOPORTADAS, db_config=None,
+                 indice_clientes=False, intervalo_latido=0.1, duracion_lease=1.0):
         self.id_nodo = id_nodo
         self.puerto = puerto
         self.nodos_conocidos = nodos_conocidos
         self.es_maestro = es_maestro
         self.maestro_actual = 1  # Por defecto el nodo 1 es maestro
         self.activo = True
-        self.lock = threading.Lock()
-        self.transaccion_activa = False
+        self.locks_articulos = LocksPorArticulo()
+        self.capacidad = IndiceCapacidad()  # Se carga en inicializar_bd
+        self.cache_inventario = CacheInventario()
+        self.contador_guias = itertools.count()
         self.eleccion_en_curso = False
         
-        # Conexión a PostgreSQL
-        self.db_conn = self.conectar_postgresql()
+        # Liderazgo por términos: el maestro escribe sólo con el lease vigente
+        self.lock_liderazgo = threading.Lock()
+        self.termino = 0               # Término conocido más alto; el nodo 1 es maestro del término 0
+        self.voto = (0, None)          # (término, candidato votado en ese término)
+        self.duracion_lease = duracion_lease
+        self.lease_maestro_hasta = 0.0  # Hasta cuándo este nodo reconoce al maestro sin votar a otro
+        self.acks_lease = {}           # {nodo_id: instante de envío del último latido confirmado}
+        
+        # Redirecciones al maestro: pasado este percentil se cubre con el siguiente candidato
+        self.latencias_maestro = PercentilLatencias()
+        
+        # Latidos en segundo plano: la vitalidad de cada nodo se consulta en memoria
+        self.detector = DetectorFallos(intervalo=intervalo_latido)
+        self.latidos_en_curso = set()
+        
+        # Un nodo caído se rechaza al instante en vez de esperar su timeout en cada envío
+        self.interruptores = InterruptoresNodos(al_cerrar=self._nodo_recuperado)
+        
+        # Conexiones persistentes hacia los demás nodos; compresiones en orden de preferencia
+        self.compresiones = compresiones
+        self.pool_conexiones = PoolConexionesNodo(nodos_conocidos, compresiones=compresiones,
+                                                  mensaje_sondeo={'tipo': 'ping', 'origen': id_nodo})
+        
+        # Pool acotado para el trabajo bloqueante del servidor asyncio
+        self.executor_bd = ThreadPoolExecutor(max_workers=max_workers_bd,
+                                              thread_name_prefix=f"nodo{id_nodo}-bd")
+        # Hilos para enviar a varios nodos en paralelo
+        self.executor_red = ThreadPoolExecutor(max_workers=max(4, 2 * len(nodos_conocidos)),
+                                               thread_name_prefix=f"nodo{id_nodo}-red")
+        self.max_solicitudes = max_solicitudes
+        self.cupo_solicitudes_hilos = threading.BoundedSemaphore(max_solicitudes)
+        
+        # Envío asíncrono de eventos de replicación desde la outbox
+        self.loteador = LoteadorReplicacion()
+        
+        # Pool de conexiones a PostgreSQL: cada solicitud toma la suya
+        self.pool_bd = PoolConexionesBD(db_config)
+        for nombre, (tipos, consulta) in self.SENTENCIAS_PREPARADAS.items():
+            self.pool_bd.registrar_sentencia(nombre, tipos, consulta)
         self.inicializar_bd()
         
+        # Búsqueda de clientes por nombre sin ir a la BD (opcional: ocupa memoria)
+        self.indice_clientes = IndicePrefijosClientes() if indice_clientes else None
+        if self.indice_clientes is not None:
+            self.recargar_indice_clientes()
+        
     def conectar_postgresql(self):
+        """Abre una conexión dedicada, fuera del pool"""
         try:
-            conn = psycopg2.connect(
-                dbname="inventario_distribuido",
-                user="postgres",
-                password="tu_password",
-                host="localhost"
-            )
-            return conn
+            return self.pool_bd.nueva_conexion()
         except Exception as e:
             logging.error(f"Error conectando a PostgreSQL: {e}")
             return None
             
     def inicializar_bd(self):
-        if not self.db_conn:
-            return
-            
         try:
-            cur = self.db_conn.cursor()
+            with self.pool_bd.conexion() as conn:
+                cur = conn.cursor()
             
-            # Tabla de inventario
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS inventario (
-                    id_articulo SERIAL PRIMARY KEY,
-                    nombre VARCHAR(100) NOT NULL,
-                    descripcion TEXT,
-                    cantidad_total INTEGER NOT NULL,
-                    cantidad_disponible INTEGER NOT NULL,
-                    sucursal_asignada INTEGER,
-                    serie VARCHAR(50),
-                    fecha_ingreso TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+                # Tabla de inventario
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS inventario (
+                        id_articulo SERIAL PRIMARY KEY,
+                        nombre VARCHAR(100) NOT NULL,
+                        descripcion TEXT,
+                        cantidad_total INTEGER NOT NULL,
+                        cantidad_disponible INTEGER NOT NULL,
+                        sucursal_asignada INTEGER,
+                        serie VARCHAR(50),
+                        fecha_ingreso TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
             
-            # Tabla de distribución por sucursal
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS distribucion_sucursal (
-                    id_distribucion SERIAL PRIMARY KEY,
-                    id_articulo INTEGER REFERENCES inventario(id_articulo),
-                    id_sucursal INTEGER NOT NULL,
-                    cantidad INTEGER NOT NULL,
-                    capacidad_maxima INTEGER DEFAULT 100,
-                    espacio_disponible INTEGER,
-                    ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+                # Tabla de distribución por sucursal
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS distribucion_sucursal (
+                        id_distribucion SERIAL PRIMARY KEY,
+                        id_articulo INTEGER REFERENCES inventario(id_articulo),
+                        id_sucursal INTEGER NOT NULL,
+                        cantidad INTEGER NOT NULL,
+                        capacidad_maxima INTEGER DEFAULT 100,
+                        espacio_disponible INTEGER,
+                        ultima_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
             
-            # Tabla de clientes
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS clientes (
-                    id_cliente SERIAL PRIMARY KEY,
-                    nombre VARCHAR(100) NOT NULL,
-                    direccion TEXT NOT NULL,
-                    telefono VARCHAR(20),
-                    email VARCHAR(100),
-                    sucursal_registro INTEGER NOT NULL,
-                    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+                # Tabla de clientes
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS clientes (
+                        id_cliente SERIAL PRIMARY KEY,
+                        nombre VARCHAR(100) NOT NULL,
+                        direccion TEXT NOT NULL,
+                        telefono VARCHAR(20),
+                        email VARCHAR(100),
+                        sucursal_registro INTEGER NOT NULL,
+                        fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
             
-            # Tabla de ventas
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS ventas (
-                    id_venta SERIAL PRIMARY KEY,
-                    id_articulo INTEGER REFERENCES inventario(id_articulo),
-                    id_cliente INTEGER REFERENCES clientes(id_cliente),
-                    id_sucursal INTEGER NOT NULL,
-                    fecha_venta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    guia_envio VARCHAR(100) UNIQUE NOT NULL,
-                    estado VARCHAR(20) DEFAULT 'pendiente'
-                )
-            """)
+                # Índices de búsqueda de clientes (documento único, prefijo del nombre)
+                cur.execute("ALTER TABLE clientes ADD COLUMN IF NOT EXISTS numero_documento VARCHAR(20)")
+                cur.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_clientes_documento ON clientes(numero_documento)
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_clientes_telefono ON clientes(telefono)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_clientes_email ON clientes(lower(email))")
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_clientes_nombre_prefijo
+                    ON clientes(lower(nombre) text_pattern_ops)
+                """)
             
-            self.db_conn.commit()
-            logging.info("Estructura de BD inicializada correctamente")
+                # Tabla de ventas
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS ventas (
+                        id_venta SERIAL PRIMARY KEY,
+                        id_articulo INTEGER REFERENCES inventario(id_articulo),
+                        id_cliente INTEGER REFERENCES clientes(id_cliente),
+                        id_sucursal INTEGER NOT NULL,
+                        fecha_venta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        guia_envio VARCHAR(100) UNIQUE NOT NULL,
+                        estado VARCHAR(20) DEFAULT 'pendiente'
+                    )
+                """)
+                # Columnas que el esquema completo (Create_Tables.sql) exige en cada venta
+                cur.execute("ALTER TABLE ventas ADD COLUMN IF NOT EXISTS cantidad INTEGER")
+                cur.execute("ALTER TABLE ventas ADD COLUMN IF NOT EXISTS precio_unitario DECIMAL(10,2)")
+                cur.execute("ALTER TABLE inventario ADD COLUMN IF NOT EXISTS precio_venta DECIMAL(10,2)")
+            
+                # Eventos de replicación pendientes, escritos en la misma transacción que el cambio
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox_replicacion (
+                        id_evento BIGSERIAL PRIMARY KEY,
+                        tipo VARCHAR(50) NOT NULL,
+                        datos JSONB NOT NULL,
+                        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            
+                # Último evento confirmado por cada nodo
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS outbox_entregas (
+                        id_nodo INTEGER PRIMARY KEY,
+                        ultimo_evento_confirmado BIGINT NOT NULL DEFAULT 0,
+                        fecha_confirmacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            
+                # Último evento aplicado de cada nodo origen (replicación idempotente)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS replicacion_aplicada (
+                        id_origen INTEGER PRIMARY KEY,
+                        ultima_secuencia BIGINT NOT NULL DEFAULT 0,
+                        fecha_aplicacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+            
+                # Una fila de distribución por artículo y sucursal
+                cur.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_distribucion_articulo_sucursal
+                    ON distribucion_sucursal(id_articulo, id_sucursal)
+                """)
+                
+                # Índice de capacidad en memoria: la única lectura completa de la distribución
+                cur.execute("""
+                    SELECT id_sucursal, MAX(capacidad_maxima) - SUM(cantidad)
+                    FROM distribucion_sucursal
+                    GROUP BY id_sucursal
+                """)
+                self.capacidad.cargar({id_sucursal: int(espacio) for id_sucursal, espacio in cur.fetchall()})
+                
+                # Movimientos de stock (mismas columnas que en Create_Tables.sql)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS historial_inventario (
+                        id_movimiento SERIAL PRIMARY KEY,
+                        id_articulo INTEGER NOT NULL REFERENCES inventario(id_articulo),
+                        id_sucursal INTEGER,
+                        tipo_movimiento VARCHAR(20) NOT NULL,
+                        cantidad INTEGER NOT NULL,
+                        cantidad_anterior INTEGER,
+                        cantidad_nueva INTEGER,
+                        motivo TEXT,
+                        fecha_movimiento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        usuario_responsable VARCHAR(50),
+                        id_transaccion VARCHAR(50)
+                    )
+                """)
+                
+                # registrar_venta ya descuenta el stock: el trigger de psql.sql lo descontaría dos veces
+                cur.execute("DROP TRIGGER IF EXISTS tr_actualizar_inventario_venta ON ventas")
+                
+                # Sólo se crea si falta o es anterior, para no pisar la versión de psql.sql (esquema completo)
+                cur.execute("""
+                    SELECT prosrc FROM pg_proc
+                    WHERE oid = to_regprocedure('registrar_venta(integer, integer, integer, integer, character varying)')
+                """)
+                fila = cur.fetchone()
+                if fila is None or self.MARCA_REGISTRAR_VENTA not in fila[0]:
+                    cur.execute(self.FUNCION_REGISTRAR_VENTA)
+                
+                conn.commit()
+                logging.info("Estructura de BD inicializada correctamente")
             
         except Exception as e:
             logging.error(f"Error inicializando BD: {e}")
-            self.db_conn.rollback()
             
     def servidor(self):
         """Escucha conexiones entrantes"""
@@ -131,41 +1233,151 @@ class NodoInventario:
                 except Exception as e:
                     logging.error(f"Error en servidor nodo {self.id_nodo}: {e}")
     
+    # Sólo tocan memoria: se responden en el momento para que los latidos no
+    # esperen detrás de transacciones o streams y el detector no sospeche de más
+    TIPOS_EN_LINEA = ('ping', 'confirmacion_maestro', 'eleccion_maestro')
+    
     def manejar_conexion(self, conn):
-        """Maneja una conexión entrante"""
+        """Atiende todas las solicitudes de una conexión hasta que se cierre
+        
+        Las solicitudes se procesan en paralelo en el pool de BD y cada
+        respuesta sale con el id de su solicitud en cuanto está lista.
+        """
         with conn:
             try:
-                data = conn.recv(4096)
-                if data:
-                    mensaje = pickle.loads(data)
-                    logging.info(f"Nodo {self.id_nodo} recibió mensaje de {mensaje['origen']}: {mensaje['tipo']}")
-                    
-                    # Procesar mensaje según tipo
-                    respuesta = self.procesar_mensaje(mensaje)
+                conexion = ConexionNodo(conn)
+                conexion.version, conexion.compresion = protocolo.responder_saludo(
+                    conn, conexion.lector, self.compresiones)
+                while self.activo:
+                    try:
+                        id_solicitud, mensaje = conexion.recibir()
+                    except EOFError:
+                        break  # El otro nodo cerró la conexión
                     
-                    # Enviar respuesta
-                    conn.sendall(pickle.dumps(respuesta))
+                    # Los latidos llegan cada intervalo desde cada nodo: no pasan por el log
+                    if mensaje['tipo'] in self.TIPOS_EN_LINEA:
+                        conexion.enviar_respuesta(self.procesar_mensaje(mensaje), id_solicitud)
+                        continue
+                    logging.info(f"Nodo {self.id_nodo} recibió mensaje de {mensaje['origen']}: {mensaje['tipo']}")
+                    self.cupo_solicitudes_hilos.acquire()
+                    self.executor_bd.submit(self._responder_solicitud, conexion, id_solicitud, mensaje)
             except Exception as e:
                 logging.error(f"Error manejando conexión: {e}")
+    
+    def _responder_solicitud(self, conexion, id_solicitud, mensaje):
+        try:
+            # Procesar mensaje según tipo
+            respuesta = self.procesar_mensaje(mensaje)
+            
+            # Enviar respuesta (por partes si es un resultado grande)
+            conexion.enviar_respuesta(respuesta, id_solicitud)
+        except Exception as e:
+            logging.error(f"Error respondiendo solicitud {id_solicitud}: {e}")
+        finally:
+            self.cupo_solicitudes_hilos.release()
                 
+    def servidor_async(self):
+        """Escucha conexiones entrantes con asyncio en lugar de un hilo por conexión"""
+        try:
+            asyncio.run(self._servidor_async())
+        except Exception as e:
+            logging.error(f"Error en servidor asyncio nodo {self.id_nodo}: {e}")
+    
+    async def _servidor_async(self):
+        # Limita las solicitudes en curso para no acumular trabajo sin fin en el executor
+        self.cupo_solicitudes = asyncio.Semaphore(self.max_solicitudes)
+        server = await asyncio.start_server(self.manejar_conexion_async, '0.0.0.0', self.puerto,
+                                            reuse_address=True)
+        logging.info(f"Nodo {self.id_nodo} escuchando (asyncio) en puerto {self.puerto}")
+        async with server:
+            while self.activo:
+                await asyncio.sleep(0.5)
+    
+    async def manejar_conexion_async(self, reader, writer):
+        """Atiende todas las solicitudes de una conexión dentro del bucle de eventos"""
+        tareas = set()
+        try:
+            _, compresion = await protocolo.responder_saludo_async(reader, writer, self.compresiones)
+            while self.activo:
+                try:
+                    tipo, id_solicitud, cuerpo = await protocolo.leer_trama_async(reader)
+                except EOFError:
+                    break  # El otro nodo cerró la conexión
+                if tipo != protocolo.TRAMA_MENSAJE:
+                    raise protocolo.ErrorProtocolo(f"Trama inesperada tipo {tipo}")
+                mensaje = protocolo.decodificar(cuerpo)
+                # Los latidos llegan cada intervalo desde cada nodo: no pasan por el log
+                if mensaje['tipo'] not in self.TIPOS_EN_LINEA:
+                    logging.info(f"Nodo {self.id_nodo} recibió mensaje de {mensaje['origen']}: {mensaje['tipo']}")
+                
+                # Cada solicitud en su propia tarea: las respuestas salen en cuanto están listas
+                await self.cupo_solicitudes.acquire()
+                tarea = asyncio.create_task(
+                    self._responder_solicitud_async(writer, id_solicitud, mensaje, compresion))
+                tareas.add(tarea)
+                tarea.add_done_callback(tareas.discard)
+        except Exception as e:
+            logging.error(f"Error manejando conexión: {e}")
+        finally:
+            if tareas:
+                await asyncio.gather(*tareas, return_exceptions=True)
+            writer.close()
+    
+    async def _responder_solicitud_async(self, writer, id_solicitud, mensaje, compresion):
+        try:
+            respuesta = await self.procesar_mensaje_async(mensaje)
+            await protocolo.enviar_respuesta_async(writer, respuesta, self.executor_bd,
+                                                   compresion, id_solicitud)
+        except Exception as e:
+            logging.error(f"Error respondiendo solicitud {id_solicitud}: {e}")
+        finally:
+            self.cupo_solicitudes.release()
+    
+    async def procesar_mensaje_async(self, mensaje):
+        """Procesa un mensaje sin bloquear el bucle de eventos"""
+        if mensaje['tipo'] in self.TIPOS_EN_LINEA:
+            return self.procesar_mensaje(mensaje)  # Sólo memoria: no bloquea
+        
+        # El resto usa la BD o la red: se ejecuta en el pool acotado de hilos
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor_bd, self.procesar_mensaje, mensaje)
+    
     def procesar_mensaje(self, mensaje):
         """Procesa diferentes tipos de mensajes"""
         try:
-            if mensaje['tipo'] == 'consulta_inventario':
-                return self.consultar_inventario()
+            if mensaje['tipo'] == 'ping':
+                return self.responder_latido(mensaje)
+            elif mensaje['tipo'] == 'consulta_inventario':
+                return self.consultar_inventario(stream=mensaje.get('stream', False),
+                                                 id_articulo=mensaje.get('id_articulo'),
+                                                 nombre=mensaje.get('nombre'))
             elif mensaje['tipo'] == 'consulta_clientes':
-                return self.consultar_clientes()
+                return self.consultar_clientes(stream=mensaje.get('stream', False),
+                                               despues_de=mensaje.get('despues_de', 0),
+                                               limite=mensaje.get('limite'))
+            elif mensaje['tipo'] == 'buscar_cliente':
+                return self.buscar_cliente(mensaje['datos']['criterio'], mensaje['datos']['valor'],
+                                           mensaje['datos'].get('limite', 20))
             elif mensaje['tipo'] == 'venta_articulo':
                 return self.procesar_venta(mensaje['datos'])
+            elif mensaje['tipo'] == 'venta_lote':
+                return self.procesar_venta_lote(mensaje['datos']['ventas'])
             elif mensaje['tipo'] == 'agregar_articulo':
-                return self.agregar_articulo(mensaje['datos'])
+                return self._escritura_maestro(mensaje, self.agregar_articulo, mensaje['datos'])
+            elif mensaje['tipo'] == 'carga_articulos':
+                return self._escritura_maestro(mensaje, self.cargar_articulos, mensaje['datos']['articulos'])
             elif mensaje['tipo'] == 'eleccion_maestro':
                 return self.participar_eleccion(mensaje)
             elif mensaje['tipo'] == 'confirmacion_maestro':
-                self.actualizar_maestro(mensaje['nuevo_maestro'])
+                if not self.aceptar_maestro(mensaje['nuevo_maestro'], mensaje.get('termino', 0)):
+                    return {'estado': 'error', 'mensaje': 'Término vencido', 'termino': self.termino}
                 return {'estado': 'ok'}
             elif mensaje['tipo'] == 'redistribuir':
-                return self.redistribuir_articulos(mensaje['datos'])
+                return self._escritura_maestro(mensaje, self.redistribuir_articulos, mensaje['datos'])
+            elif mensaje['tipo'] == 'lote_replicacion':
+                return self.aplicar_lote_replicacion(mensaje['origen'], mensaje['datos'])
+            elif mensaje['tipo'] in ('actualizar_inventario', 'nuevo_articulo'):
+                return self.aplicar_evento_replicado(mensaje)
             else:
                 return {'estado': 'error', 'mensaje': 'Tipo de mensaje no reconocido'}
         except Exception as e:
@@ -173,381 +1385,1459 @@ class NodoInventario:
             return {'estado': 'error', 'mensaje': str(e)}
     
     # Funciones de negocio
-    def consultar_inventario(self):
-        """Consulta el inventario local"""
-        try:
-            cur = self.db_conn.cursor()
-            cur.execute("""
-                SELECT i.id_articulo, i.nombre, i.descripcion, 
-                       ds.cantidad, ds.id_sucursal, i.cantidad_total
-                FROM inventario i
-                JOIN distribucion_sucursal ds ON i.id_articulo = ds.id_articulo
-                WHERE ds.id_sucursal = %s
-            """, (self.id_nodo,))
+    
+    # Venta completa en el servidor: descuento condicional, total general, venta,
+    # historial y evento de replicación. Devuelve el nuevo stock de la sucursal,
+    # -1 si no alcanza o -2 si el artículo no está en la sucursal.
+    VENTA_STOCK_INSUFICIENTE = -1
+    VENTA_SIN_ARTICULO = -2
+    MAX_VENTAS_LOTE = 1000
+    ARTICULOS_POR_EVENTO = 10000  # Tamaño de cada evento de replicación de una carga masiva
+    MARCA_REGISTRAR_VENTA = 'registrar_venta v3'  # Versiones anteriores se reemplazan al iniciar
+    FUNCION_REGISTRAR_VENTA = """
+        CREATE OR REPLACE FUNCTION registrar_venta(
+            p_id_articulo INTEGER,
+            p_id_sucursal INTEGER,
+            p_id_cliente INTEGER,
+            p_cantidad INTEGER,
+            p_guia_envio VARCHAR
+        ) RETURNS INTEGER AS $$
+        DECLARE
+            v_nueva_cantidad INTEGER;
+            v_precio DECIMAL(10,2);
+        BEGIN
+            IF p_cantidad IS NULL OR p_cantidad <= 0 THEN
+                RAISE EXCEPTION 'Cantidad inválida: %', p_cantidad;
+            END IF;
+            
+            UPDATE distribucion_sucursal
+            SET cantidad = cantidad - p_cantidad
+            WHERE id_articulo = p_id_articulo AND id_sucursal = p_id_sucursal
+              AND cantidad >= p_cantidad
+            RETURNING cantidad INTO v_nueva_cantidad;
+            
+            IF NOT FOUND THEN
+                IF EXISTS (SELECT 1 FROM distribucion_sucursal
+                           WHERE id_articulo = p_id_articulo AND id_sucursal = p_id_sucursal) THEN
+                    RETURN -1;
+                END IF;
+                RETURN -2;
+            END IF;
+            
+            UPDATE inventario
+            SET cantidad_disponible = cantidad_disponible - p_cantidad
+            WHERE id_articulo = p_id_articulo
+            RETURNING precio_venta INTO v_precio;
+            
+            INSERT INTO ventas (id_articulo, id_cliente, id_sucursal, cantidad, precio_unitario, guia_envio)
+            VALUES (p_id_articulo, p_id_cliente, p_id_sucursal, p_cantidad, COALESCE(v_precio, 0), p_guia_envio);
+            
+            INSERT INTO historial_inventario (
+                id_articulo, id_sucursal, tipo_movimiento,
+                cantidad, cantidad_anterior, cantidad_nueva,
+                motivo, usuario_responsable, id_transaccion
+            ) VALUES (
+                p_id_articulo, p_id_sucursal, 'SALIDA',
+                p_cantidad, v_nueva_cantidad + p_cantidad, v_nueva_cantidad,
+                'VENTA: ' || p_guia_envio, 'SISTEMA', p_guia_envio
+            );
+            
+            -- registrar_venta v3: ids de la outbox en orden de commit (ver BLOQUEO_OUTBOX)
+            PERFORM pg_advisory_xact_lock(hashtext('outbox_replicacion'));
+            INSERT INTO outbox_replicacion (tipo, datos)
+            VALUES ('actualizar_inventario', jsonb_build_object(
+                'id_articulo', p_id_articulo,
+                'id_sucursal', p_id_sucursal,
+                'nueva_cantidad', v_nueva_cantidad,
+                'cantidad', p_cantidad,
+                'guia_envio', p_guia_envio,
+                'id_cliente', p_id_cliente
+            ));
             
-            inventario = []
-            for row in cur.fetchall():
-                inventario.append({
-                    'id_articulo': row[0],
-                    'nombre': row[1],
-                    'descripcion': row[2],
-                    'cantidad': row[3],
-                    'sucursal': row[4],
-                    'cantidad_total': row[5]
-                })
+            RETURN v_nueva_cantidad;
+        END;
+        $$ LANGUAGE plpgsql
+    """
+    
+    CONSULTA_INVENTARIO = """
+        SELECT i.id_articulo, i.nombre, i.descripcion, 
+               ds.cantidad, ds.id_sucursal, i.cantidad_total
+        FROM inventario i
+        JOIN distribucion_sucursal ds ON i.id_articulo = ds.id_articulo
+        WHERE ds.id_sucursal = %s
+    """
+    
+    # Orden por la clave primaria: cada página sigue desde el último id visto
+    CONSULTA_CLIENTES = """
+        SELECT id_cliente, nombre, direccion, telefono, email, sucursal_registro
+        FROM clientes
+        WHERE id_cliente > %s
+        ORDER BY id_cliente
+    """
+    MAX_CLIENTES_PAGINA = 1000
+    
+    # Sentencias de las rutas frecuentes: {nombre: (tipos de los parámetros, consulta)}.
+    # Las de varias filas reciben arreglos (unnest) para tener siempre la misma forma.
+    SENTENCIAS_PREPARADAS = {
+        'registrar_venta': (('integer', 'integer', 'integer', 'integer', 'varchar'),
+                            "SELECT registrar_venta(%s, %s, %s, %s, %s)"),
+        'consulta_inventario': (('integer',), CONSULTA_INVENTARIO),
+        'consulta_inventario_articulo': (('integer', 'integer'), CONSULTA_INVENTARIO + " AND i.id_articulo = %s"),
+        'consulta_inventario_nombre': (('integer', 'text'), CONSULTA_INVENTARIO + " AND lower(i.nombre) LIKE %s"),
+        'consulta_clientes': (('integer', 'bigint'), CONSULTA_CLIENTES + " LIMIT %s"),
+        'registrar_origen': (('integer',), """
+            INSERT INTO replicacion_aplicada (id_origen) VALUES (%s)
+            ON CONFLICT (id_origen) DO NOTHING
+        """),
+        'bloquear_origen': (('integer',), """
+            SELECT ultima_secuencia FROM replicacion_aplicada
+            WHERE id_origen = %s FOR UPDATE
+        """),
+        'avanzar_origen': (('bigint', 'integer'), """
+            UPDATE replicacion_aplicada
+            SET ultima_secuencia = %s, fecha_aplicacion = CURRENT_TIMESTAMP
+            WHERE id_origen = %s
+        """),
+        'fijar_cantidades': (('integer[]', 'integer[]', 'integer[]'), """
+            UPDATE distribucion_sucursal ds
+            SET cantidad = v.nueva_cantidad
+            FROM unnest(%s, %s, %s) AS v(id_articulo, id_sucursal, nueva_cantidad)
+            WHERE ds.id_articulo = v.id_articulo AND ds.id_sucursal = v.id_sucursal
+        """),
+        'descontar_disponible': (('integer[]', 'integer[]'), """
+            UPDATE inventario i
+            SET cantidad_disponible = i.cantidad_disponible - v.cantidad
+            FROM unnest(%s, %s) AS v(id_articulo, cantidad)
+            WHERE i.id_articulo = v.id_articulo
+        """),
+    }
+    
+    @staticmethod
+    def _fila_inventario(row):
+        return {
+            'id_articulo': row[0],
+            'nombre': row[1],
+            'descripcion': row[2],
+            'cantidad': row[3],
+            'sucursal': row[4],
+            'cantidad_total': row[5]
+        }
+    
+    @staticmethod
+    def _fila_cliente(row):
+        return {
+            'id_cliente': row[0],
+            'nombre': row[1],
+            'direccion': row[2],
+            'telefono': row[3],
+            'email': row[4],
+            'sucursal_registro': row[5]
+        }
+    
+    def _filas_por_cursor(self, consulta, parametros, convertir, tam_lote=1000):
+        """Genera filas con un cursor del lado del servidor sin cargarlas todas"""
+        # La conexión queda prestada mientras dure el stream
+        with self.pool_bd.conexion() as conn:
+            cur = conn.cursor(name=f"stream_{self.id_nodo}_{threading.get_ident()}_{time.time_ns()}")
+            cur.itersize = tam_lote
+            try:
+                cur.execute(consulta, parametros)
+                while True:
+                    filas = cur.fetchmany(tam_lote)
+                    if not filas:
+                        break
+                    for row in filas:
+                        yield convertir(row)
+            finally:
+                cur.close()
+    
+    def consultar_inventario(self, stream=False, id_articulo=None, nombre=None):
+        """Consulta el inventario local (desde la caché si está al día)
+        
+        Se puede filtrar por id_articulo y/o por un texto contenido en el nombre.
+        """
+        inventario, version = self.cache_inventario.obtener(self.id_nodo)
+        if inventario is not None:
+            if id_articulo is not None or nombre:
+                inventario = [fila for fila in inventario if self._cumple_filtro(fila, id_articulo, nombre)]
+            if stream:
+                return RespuestaStream({'estado': 'ok'}, 'inventario', iter(inventario))
+            return {'estado': 'ok', 'inventario': inventario}
+        
+        if id_articulo is not None:
+            sentencia, parametros = 'consulta_inventario_articulo', (self.id_nodo, id_articulo)
+        elif nombre:
+            sentencia, parametros = 'consulta_inventario_nombre', (self.id_nodo, self._patron_like(nombre, True))
+        else:
+            sentencia, parametros = 'consulta_inventario', (self.id_nodo,)
+        if stream:
+            # Los cursores con nombre no admiten EXECUTE: va la consulta en texto
+            consulta = self.SENTENCIAS_PREPARADAS[sentencia][1]
+            filas = self._filas_por_cursor(consulta, parametros, self._fila_inventario)
+            if id_articulo is not None and nombre:
+                filas = (fila for fila in filas if self._cumple_filtro(fila, None, nombre))
+            return RespuestaStream({'estado': 'ok'}, 'inventario', filas)
+        try:
+            with self.pool_bd.conexion() as conn:
+                cur = conn.cursor()
+                self.pool_bd.ejecutar(cur, sentencia, parametros)
                 
+                inventario = [self._fila_inventario(row) for row in cur.fetchall()]
+                
+            if sentencia == 'consulta_inventario':
+                self.cache_inventario.guardar(self.id_nodo, version, inventario)
+            elif id_articulo is not None and nombre:
+                inventario = [fila for fila in inventario if self._cumple_filtro(fila, None, nombre)]
             return {'estado': 'ok', 'inventario': inventario}
         except Exception as e:
             logging.error(f"Error consultando inventario: {e}")
             return {'estado': 'error', 'mensaje': str(e)}
     
-    def consultar_clientes(self):
-        """Consulta los clientes (distribuido)"""
+    @staticmethod
+    def _cumple_filtro(fila, id_articulo, nombre):
+        return ((id_articulo is None or fila['id_articulo'] == id_articulo)
+                and (not nombre or nombre.lower() in fila['nombre'].lower()))
+    
+    @staticmethod
+    def _patron_like(texto, contiene=False):
+        """Patrón LIKE en minúsculas que busca el texto literal al comienzo (o en cualquier parte)"""
+        texto = texto.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{texto}%" if contiene else f"{texto}%"
+    
+    def consulta_inventario_global(self, id_articulo=None, nombre=None, plazo=3.0):
+        """Consulta el inventario de todas las sucursales en paralelo con un plazo común
+        
+        El filtro se aplica en cada nodo y cada uno envía sus filas por partes,
+        que se combinan a medida que llegan. Devuelve cada artículo con su stock
+        en cada sucursal que respondió; si alguna no respondió a tiempo (o
+        respondió con error) 'completo' es False y figura en 'sin_respuesta'.
+        """
+        mensaje = {'tipo': 'consulta_inventario', 'stream': True}
+        if id_articulo is not None:
+            mensaje['id_articulo'] = id_articulo
+        if nombre:
+            mensaje['nombre'] = nombre
+        
+        # La consulta local corre en otro hilo mientras se espera a las demás sucursales
+        local = self.executor_bd.submit(self.consultar_inventario, id_articulo=id_articulo, nombre=nombre)
+        respuestas = self.difundir(mensaje, plazo=plazo)
+        respuestas[self.id_nodo] = local.result()
+        
+        articulos = {}
+        sin_respuesta = []
+        for id_sucursal, respuesta in sorted(respuestas.items()):
+            if not respuesta or respuesta.get('estado') != 'ok':
+                sin_respuesta.append(id_sucursal)
+                continue
+            try:
+                for fila in respuesta['inventario']:
+                    articulo = articulos.setdefault(fila['id_articulo'], {
+                        'id_articulo': fila['id_articulo'],
+                        'nombre': fila['nombre'],
+                        'descripcion': fila['descripcion'],
+                        'cantidad_total': fila['cantidad_total'],
+                        'sucursales': {}
+                    })
+                    articulo['sucursales'][id_sucursal] = fila['cantidad']
+            except Exception as e:
+                # El stream se cortó a medias: la sucursal queda fuera del resultado
+                logging.error(f"Inventario de sucursal {id_sucursal} interrumpido: {e}")
+                for id_articulo in list(articulos):
+                    articulos[id_articulo]['sucursales'].pop(id_sucursal, None)
+                    if not articulos[id_articulo]['sucursales']:
+                        del articulos[id_articulo]
+                sin_respuesta.append(id_sucursal)
+        
+        if sin_respuesta:
+            logging.warning(f"Inventario global parcial: sin respuesta de {sin_respuesta}")
+        return {'estado': 'ok',
+                'inventario': [articulos[id_articulo] for id_articulo in sorted(articulos)],
+                'completo': not sin_respuesta,
+                'sin_respuesta': sin_respuesta}
+    
+    def consultar_clientes(self, stream=False, despues_de=0, limite=None):
+        """Consulta los clientes por páginas de id_cliente (paginación por clave)
+        
+        Devuelve hasta `limite` clientes con id mayor que `despues_de` y en
+        'siguiente' el id desde el que pedir la próxima página (None al final).
+        Con stream se exporta todo desde `despues_de` con un cursor del servidor.
+        """
+        if stream:
+            return RespuestaStream({'estado': 'ok'}, 'clientes', self._filas_por_cursor(
+                self.CONSULTA_CLIENTES, (despues_de,), self._fila_cliente))
+        limite = min(limite or self.MAX_CLIENTES_PAGINA, self.MAX_CLIENTES_PAGINA)
         try:
-            cur = self.db_conn.cursor()
-            cur.execute("SELECT * FROM clientes")
-            
-            clientes = []
-            for row in cur.fetchall():
-                clientes.append({
-                    'id_cliente': row[0],
-                    'nombre': row[1],
-                    'direccion': row[2],
-                    'telefono': row[3],
-                    'email': row[4],
-                    'sucursal_registro': row[5]
-                })
+            with self.pool_bd.conexion() as conn:
+                cur = conn.cursor()
+                self.pool_bd.ejecutar(cur, 'consulta_clientes', (despues_de, limite))
                 
-            return {'estado': 'ok', 'clientes': clientes}
+                clientes = [self._fila_cliente(row) for row in cur.fetchall()]
+                
+            siguiente = clientes[-1]['id_cliente'] if len(clientes) == limite else None
+            return {'estado': 'ok', 'clientes': clientes, 'siguiente': siguiente}
         except Exception as e:
             logging.error(f"Error consultando clientes: {e}")
             return {'estado': 'error', 'mensaje': str(e)}
     
+    # Cada criterio usa su índice: igualdad exacta o LIKE 'prefijo%' sobre lower(nombre)
+    CRITERIOS_BUSQUEDA_CLIENTE = {
+        'documento': "numero_documento = %s",
+        'telefono': "telefono = %s",
+        'email': "lower(email) = lower(%s)",
+        'nombre': "lower(nombre) LIKE %s",
+    }
+    
+    def buscar_cliente(self, criterio, valor, limite=20):
+        """Busca clientes por documento, teléfono, email o prefijo del nombre"""
+        condicion = self.CRITERIOS_BUSQUEDA_CLIENTE.get(criterio)
+        if condicion is None:
+            return {'estado': 'error', 'mensaje': f"Criterio de búsqueda no válido: {criterio}"}
+        limite = min(limite or 20, self.MAX_CLIENTES_PAGINA)
+        
+        if criterio == 'nombre':
+            if self.indice_clientes is not None:
+                return {'estado': 'ok', 'clientes': self.indice_clientes.buscar(valor, limite)}
+            valor = self._patron_like(valor)
+        try:
+            with self.pool_bd.conexion() as conn:
+                cur = conn.cursor()
+                cur.execute(f"""
+                    SELECT id_cliente, nombre, direccion, telefono, email, sucursal_registro
+                    FROM clientes
+                    WHERE {condicion}
+                    ORDER BY {'lower(nombre), ' if criterio == 'nombre' else ''}id_cliente
+                    LIMIT %s
+                """, (valor, limite))
+                
+                clientes = [self._fila_cliente(row) for row in cur.fetchall()]
+                
+            return {'estado': 'ok', 'clientes': clientes}
+        except Exception as e:
+            logging.error(f"Error buscando cliente: {e}")
+            return {'estado': 'error', 'mensaje': str(e)}
+    
+    def recargar_indice_clientes(self):
+        """Vuelve a cargar el índice de prefijos de clientes desde la BD"""
+        try:
+            self.indice_clientes.cargar(self._filas_por_cursor(
+                self.CONSULTA_CLIENTES, (0,), self._fila_cliente, tam_lote=10000))
+            logging.info(f"Índice de clientes cargado: {len(self.indice_clientes)} clientes")
+        except Exception as e:
+            logging.error(f"Error cargando índice de clientes: {e}")
+    
+    def iterar_clientes(self, tam_pagina=None):
+        """Genera todos los clientes página a página, sin tenerlos todos en memoria"""
+        despues_de = 0
+        while despues_de is not None:
+            pagina = self.consultar_clientes(despues_de=despues_de, limite=tam_pagina)
+            if pagina['estado'] != 'ok':
+                raise RuntimeError(pagina['mensaje'])
+            yield from pagina['clientes']
+            despues_de = pagina['siguiente']
+    
+    def _en_transaccion(self, funcion, *args, intentos=5, autocommit=False):
+        """Ejecuta funcion(conn, *args) con una conexión del pool
+        
+        Si PostgreSQL aborta la transacción por un conflicto de serialización
+        o un interbloqueo, se repite con una espera exponencial aleatoria.
+        """
+        for intento in range(intentos):
+            try:
+                with self.pool_bd.conexion(autocommit) as conn:
+                    return funcion(conn, *args)
+            except psycopg2.extensions.TransactionRollbackError as e:
+                if intento == intentos - 1:
+                    raise
+                espera = min(0.5, 0.01 * 2 ** intento) * random.uniform(0.5, 1.5)
+                logging.warning(f"Conflicto de concurrencia ({e.pgcode}); reintento {intento + 1} "
+                                f"en {espera * 1000:.0f} ms")
+                time.sleep(espera)
+    
     def procesar_venta(self, datos_venta):
-        """Procesa una venta con exclusión mutua"""
-        with self.lock:
+        """Procesa una venta con exclusión mutua por artículo"""
+        if datos_venta['cantidad'] <= 0:
+            return {'estado': 'error', 'mensaje': 'Cantidad inválida'}
+        
+        # Sólo esperan entre sí las ventas del mismo artículo (o de la misma franja)
+        with self.locks_articulos.bloquear(datos_venta['id_articulo']):
             try:
-                # Verificar disponibilidad
-                cur = self.db_conn.cursor()
-                cur.execute("""
-                    SELECT cantidad FROM distribucion_sucursal
-                    WHERE id_articulo = %s AND id_sucursal = %s FOR UPDATE
-                """, (datos_venta['id_articulo'], self.id_nodo))
-                
-                cantidad = cur.fetchone()[0]
-                if cantidad < datos_venta['cantidad']:
-                    return {'estado': 'error', 'mensaje': 'Stock insuficiente'}
-                
-                # Actualizar inventario
-                nueva_cantidad = cantidad - datos_venta['cantidad']
-                cur.execute("""
-                    UPDATE distribucion_sucursal
-                    SET cantidad = %s
-                    WHERE id_articulo = %s AND id_sucursal = %s
-                """, (nueva_cantidad, datos_venta['id_articulo'], self.id_nodo))
-                
-                # Actualizar inventario general
-                cur.execute("""
-                    UPDATE inventario
-                    SET cantidad_disponible = cantidad_disponible - %s
-                    WHERE id_articulo = %s
-                """, (datos_venta['cantidad'], datos_venta['id_articulo']))
-                
-                # Generar guía de envío
-                guia_envio = self.generar_guia_envio(datos_venta)
-                
-                # Registrar venta
-                cur.execute("""
-                    INSERT INTO ventas (id_articulo, id_cliente, id_sucursal, guia_envio)
-                    VALUES (%s, %s, %s, %s)
-                """, (datos_venta['id_articulo'], datos_venta['id_cliente'], self.id_nodo, guia_envio))
-                
-                self.db_conn.commit()
-                
-                # Replicar cambios a otros nodos
-                self.replicar_venta(datos_venta, nueva_cantidad, guia_envio)
-                
-                return {'estado': 'ok', 'guia_envio': guia_envio}
+                resultado = self._en_transaccion(self._transaccion_venta, datos_venta, autocommit=True)
             except Exception as e:
-                self.db_conn.rollback()
                 logging.error(f"Error procesando venta: {e}")
                 return {'estado': 'error', 'mensaje': str(e)}
+        
+        # El despachador envía el evento a los demás nodos en segundo plano
+        if resultado['estado'] == 'ok':
+            self.capacidad.ajustar({self.id_nodo: datos_venta['cantidad']})
+            self.loteador.avisar()
+        
+        return resultado
     
-    def generar_guia_envio(self, datos_venta):
-        """Genera un ID único para la guía de envío"""
-        cadena = f"{datos_venta['id_articulo']}-{self.id_nodo}-{datos_venta['id_cliente']}-{time.time()}"
-        return hashlib.sha256(cadena.encode()).hexdigest()[:20].upper()
+    def _transaccion_venta(self, conn, datos_venta):
+        """Registra la venta con una sola llamada a registrar_venta (un viaje a la BD)"""
+        guia_envio = self.generar_guia_envio(datos_venta)
+        cur = conn.cursor()
+        self.pool_bd.ejecutar(cur, 'registrar_venta',
+                              (datos_venta['id_articulo'], self.id_nodo, datos_venta['id_cliente'],
+                               datos_venta['cantidad'], guia_envio))
+        nueva_cantidad = cur.fetchone()[0]
+        
+        if nueva_cantidad == self.VENTA_STOCK_INSUFICIENTE:
+            return {'estado': 'error', 'mensaje': 'Stock insuficiente'}
+        if nueva_cantidad == self.VENTA_SIN_ARTICULO:
+            return {'estado': 'error', 'mensaje': 'Artículo no disponible en esta sucursal'}
+        self.cache_inventario.parchear({(datos_venta['id_articulo'], self.id_nodo): nueva_cantidad})
+        return {'estado': 'ok', 'guia_envio': guia_envio}
     
-    def replicar_venta(self, datos_venta, nueva_cantidad, guia_envio):
-        """Replica la venta a otros nodos para consistencia"""
-        mensaje = {
-            'tipo': 'actualizar_inventario',
-            'datos': {
-                'id_articulo': datos_venta['id_articulo'],
+    def procesar_venta_lote(self, ventas):
+        """Procesa muchas ventas en una sola transacción, con resultado por venta
+        
+        El stock de todos los artículos se bloquea y valida con una consulta;
+        las ventas se aceptan en el orden recibido mientras alcance y todas las
+        escrituras van en sentencias por lotes. Se replica un único evento.
+        """
+        if len(ventas) > self.MAX_VENTAS_LOTE:
+            return {'estado': 'error', 'mensaje': f"Máximo {self.MAX_VENTAS_LOTE} ventas por lote"}
+        
+        with self.locks_articulos.bloquear(*(venta['id_articulo'] for venta in ventas)):
+            try:
+                resultado = self._en_transaccion(self._transaccion_venta_lote, ventas)
+            except Exception as e:
+                logging.error(f"Error procesando lote de ventas: {e}")
+                return {'estado': 'error', 'mensaje': str(e)}
+        
+        if resultado['aceptadas']:
+            self.loteador.avisar()
+        
+        return resultado
+    
+    def _transaccion_venta_lote(self, conn, ventas):
+        """Bloquea y valida el stock del lote con una consulta y escribe por lotes"""
+        cur = conn.cursor()
+        ids_articulo = sorted({venta['id_articulo'] for venta in ventas})
+        cur.execute("""
+            SELECT ds.id_articulo, ds.cantidad, COALESCE(i.precio_venta, 0)
+            FROM distribucion_sucursal ds JOIN inventario i ON i.id_articulo = ds.id_articulo
+            WHERE ds.id_sucursal = %s AND ds.id_articulo = ANY(%s)
+            ORDER BY ds.id_articulo FOR UPDATE OF ds
+        """, (self.id_nodo, ids_articulo))
+        filas = cur.fetchall()
+        stock = {id_articulo: cantidad for id_articulo, cantidad, _ in filas}
+        precios = {id_articulo: precio for id_articulo, _, precio in filas}
+        
+        resultados = []
+        filas_ventas = []
+        historial = []
+        vendidas = {}  # {id_articulo: cantidad vendida en el lote}
+        for venta in ventas:
+            id_articulo, cantidad = venta['id_articulo'], venta['cantidad']
+            if cantidad <= 0:
+                resultados.append({'estado': 'error', 'mensaje': 'Cantidad inválida'})
+                continue
+            if id_articulo not in stock:
+                resultados.append({'estado': 'error', 'mensaje': 'Artículo no disponible en esta sucursal'})
+                continue
+            if stock[id_articulo] < cantidad:
+                resultados.append({'estado': 'error', 'mensaje': 'Stock insuficiente'})
+                continue
+            
+            guia_envio = self.generar_guia_envio(venta)
+            stock[id_articulo] -= cantidad
+            vendidas[id_articulo] = vendidas.get(id_articulo, 0) + cantidad
+            filas_ventas.append((id_articulo, venta['id_cliente'], self.id_nodo, cantidad,
+                                 precios[id_articulo], guia_envio))
+            historial.append((id_articulo, self.id_nodo, 'SALIDA', cantidad, stock[id_articulo] + cantidad,
+                              stock[id_articulo], f"VENTA: {guia_envio}", 'SISTEMA', guia_envio))
+            resultados.append({'estado': 'ok', 'guia_envio': guia_envio})
+        
+        if vendidas:
+            articulos = [(id_articulo, stock[id_articulo], cantidad)
+                         for id_articulo, cantidad in sorted(vendidas.items())]
+            ids, nuevas_cantidades, cantidades = (list(columna) for columna in zip(*articulos))
+            self.pool_bd.ejecutar(cur, 'fijar_cantidades', (ids, [self.id_nodo] * len(ids), nuevas_cantidades))
+            self.pool_bd.ejecutar(cur, 'descontar_disponible', (ids, cantidades))
+            execute_values(cur, """
+                INSERT INTO ventas (id_articulo, id_cliente, id_sucursal, cantidad, precio_unitario, guia_envio)
+                VALUES %s
+            """, filas_ventas, page_size=1000)
+            execute_values(cur, """
+                INSERT INTO historial_inventario (
+                    id_articulo, id_sucursal, tipo_movimiento, cantidad, cantidad_anterior,
+                    cantidad_nueva, motivo, usuario_responsable, id_transaccion
+                ) VALUES %s
+            """, historial, page_size=1000)
+            
+            # Un solo evento con el stock final de cada artículo vendido
+            self.registrar_evento(cur, 'actualizar_inventario_lote', {
                 'id_sucursal': self.id_nodo,
-                'nueva_cantidad': nueva_cantidad,
-                'guia_envio': guia_envio,
-                'id_cliente': datos_venta['id_cliente']
-            }
-        }
+                'articulos': [{'id_articulo': id_articulo, 'nueva_cantidad': nueva_cantidad, 'cantidad': cantidad}
+                              for id_articulo, nueva_cantidad, cantidad in articulos]
+            })
         
-        for nodo_id, (ip, puerto) in self.nodos_conocidos.items():
-            if nodo_id != self.id_nodo:
-                try:
-                    self.enviar_mensaje(nodo_id, mensaje)
-                except Exception as e:
-                    logging.error(f"Error replicando a nodo {nodo_id}: {e}")
+        conn.commit()
+        self.capacidad.ajustar({self.id_nodo: sum(vendidas.values())})
+        self.cache_inventario.parchear({(id_articulo, self.id_nodo): stock[id_articulo] for id_articulo in vendidas})
+        aceptadas = len(filas_ventas)
+        return {'estado': 'ok', 'aceptadas': aceptadas, 'rechazadas': len(ventas) - aceptadas,
+                'resultados': resultados}
+    
+    def generar_guia_envio(self, datos_venta):
+        """Genera un ID único para la guía de envío"""
+        # El contador distingue ventas iguales generadas en el mismo instante (lotes)
+        cadena = (f"{datos_venta['id_articulo']}-{self.id_nodo}-{datos_venta['id_cliente']}-"
+                  f"{time.time()}-{next(self.contador_guias)}")
+        return hashlib.sha256(cadena.encode()).hexdigest()[:20].upper()
     
     def agregar_articulo(self, datos_articulo):
         """Agrega un nuevo artículo al inventario distribuido"""
         if not self.es_maestro and self.maestro_actual != self.id_nodo:
             # Redirigir al nodo maestro
             return self.redirigir_a_maestro('agregar_articulo', datos_articulo)
-            
-        with self.lock:
-            try:
-                cur = self.db_conn.cursor()
-                
-                # Insertar en inventario general
-                cur.execute("""
-                    INSERT INTO inventario (nombre, descripcion, cantidad_total, cantidad_disponible)
-                    VALUES (%s, %s, %s, %s) RETURNING id_articulo
-                """, (datos_articulo['nombre'], datos_articulo['descripcion'], 
-                      datos_articulo['cantidad'], datos_articulo['cantidad']))
-                
-                id_articulo = cur.fetchone()[0]
-                
-                # Distribuir entre sucursales
-                sucursales = self.obtener_sucursales_optimas(datos_articulo['cantidad'])
-                for sucursal, cantidad in sucursales.items():
-                    cur.execute("""
-                        INSERT INTO distribucion_sucursal 
-                        (id_articulo, id_sucursal, cantidad, espacio_disponible)
-                        VALUES (%s, %s, %s, %s)
-                    """, (id_articulo, sucursal, cantidad, 
-                          self.calcular_espacio_disponible(sucursal) - cantidad))
-                
-                self.db_conn.commit()
-                
-                # Replicar a otros nodos
-                self.replicar_nuevo_articulo(id_articulo, datos_articulo, sucursales)
-                
-                return {'estado': 'ok', 'id_articulo': id_articulo}
-            except Exception as e:
-                self.db_conn.rollback()
-                logging.error(f"Error agregando artículo: {e}")
-                return {'estado': 'error', 'mensaje': str(e)}
+        if not self.tengo_lease():
+            return self._sin_lease()
+        
+        # El artículo es nuevo: nadie más lo toca, basta con los bloqueos de fila de la BD
+        try:
+            id_articulo = self._en_transaccion(self._transaccion_nuevo_articulo, datos_articulo)
+        except Exception as e:
+            logging.error(f"Error agregando artículo: {e}")
+            return {'estado': 'error', 'mensaje': str(e)}
+        
+        self.loteador.avisar()
+        
+        return {'estado': 'ok', 'id_articulo': id_articulo}
     
-    def obtener_sucursales_optimas(self, cantidad_total):
-        """Distribuye el artículo entre sucursales con más espacio"""
+    def _transaccion_nuevo_articulo(self, conn, datos_articulo):
+        """Inserta el artículo y su distribución; devuelve el id asignado"""
+        cur = conn.cursor()
+        
+        # Insertar en inventario general
+        cur.execute("""
+            INSERT INTO inventario (nombre, descripcion, cantidad_total, cantidad_disponible)
+            VALUES (%s, %s, %s, %s) RETURNING id_articulo
+        """, (datos_articulo['nombre'], datos_articulo['descripcion'], 
+              datos_articulo['cantidad'], datos_articulo['cantidad']))
+        
+        id_articulo = cur.fetchone()[0]
+        
+        # Distribuir entre sucursales
+        sucursales = self.obtener_sucursales_optimas(datos_articulo['cantidad'])
+        execute_values(cur, """
+            INSERT INTO distribucion_sucursal 
+            (id_articulo, id_sucursal, cantidad, espacio_disponible)
+            VALUES %s
+        """, [(id_articulo, sucursal, cantidad, self.capacidad.espacio(sucursal) - cantidad)
+              for sucursal, cantidad in sucursales.items()])
+        
+        # Replicar a otros nodos (vía outbox, en la misma transacción)
+        self.replicar_nuevo_articulo(cur, id_articulo, datos_articulo, sucursales)
+        
+        conn.commit()
+        self.capacidad.ajustar({sucursal: -cantidad for sucursal, cantidad in sucursales.items()})
+        self.cache_inventario.invalidar()
+        return id_articulo
+    
+    def cargar_articulos(self, origen):
+        """Carga masiva de artículos desde un CSV (ruta o archivo) o una lista de dicts
+        
+        El CSV lleva cabecera nombre,descripcion,cantidad. Las filas entran con
+        COPY a una tabla temporal, la distribución de todas se calcula con una
+        sola sentencia y se replican como pocos eventos compactos.
+        """
+        if not self.es_maestro and self.maestro_actual != self.id_nodo:
+            # El maestro asigna los ids: se le envían los artículos ya leídos
+            if isinstance(origen, str):
+                with open(origen, newline='', encoding='utf-8') as archivo:
+                    origen = list(csv.DictReader(archivo))
+            elif not isinstance(origen, list):
+                origen = list(csv.DictReader(origen))
+            articulos = [{'nombre': a['nombre'], 'descripcion': a.get('descripcion') or '',
+                          'cantidad': int(a['cantidad'])} for a in origen]
+            return self.redirigir_a_maestro('carga_articulos', {'articulos': articulos})
+        if not self.tengo_lease():
+            return self._sin_lease()
+        
         try:
-            cur = self.db_conn.cursor()
+            if isinstance(origen, str):
+                with open(origen, newline='', encoding='utf-8') as archivo:
+                    return self._carga_articulos(archivo)
+            if isinstance(origen, list):
+                origen = csv_de_articulos(origen)
+            return self._carga_articulos(origen)
+        except Exception as e:
+            logging.error(f"Error en carga masiva de artículos: {e}")
+            return {'estado': 'error', 'mensaje': str(e)}
+    
+    def _carga_articulos(self, archivo):
+        inicio = time.monotonic()
+        with self.pool_bd.conexion() as conn:
+            cur = conn.cursor()
+            self._crear_staging_articulos(cur)
+            cur.copy_expert("""
+                COPY staging_articulos (nombre, descripcion, cantidad)
+                FROM STDIN WITH (FORMAT csv, HEADER true)
+            """, archivo)
+            # Ids del inventario asignados de una vez desde su secuencia
             cur.execute("""
-                SELECT id_sucursal, espacio_disponible 
-                FROM distribucion_sucursal
-                GROUP BY id_sucursal, espacio_disponible
-                ORDER BY espacio_disponible DESC
+                UPDATE staging_articulos
+                SET id_articulo = nextval(pg_get_serial_sequence('inventario', 'id_articulo')::regclass)
             """)
+            cargados = cur.rowcount
+            if not cargados:
+                return {'estado': 'ok', 'cargados': 0}
             
-            sucursales = {}
-            resultados = cur.fetchall()
-            total_espacio = sum(row[1] for row in resultados)
+            espacios = self._espacios_sucursales()
+            ocupado = self._insertar_staging_articulos(cur, espacios)
             
-            for row in resultados:
-                proporcion = row[1] / total_espacio if total_espacio > 0 else 1/len(resultados)
-                sucursales[row[0]] = int(cantidad_total * proporcion)
-                
-            # Ajustar redondeo
-            diferencia = cantidad_total - sum(sucursales.values())
-            if diferencia != 0:
-                sucursales[resultados[0][0]] += diferencia
-                
+            cur.execute("SELECT MIN(id_articulo), MAX(id_articulo) FROM staging_articulos")
+            primer_id, ultimo_id = cur.fetchone()
+            
+            # Eventos de replicación armados en el servidor, de hasta ARTICULOS_POR_EVENTO artículos.
+            # Se arman antes del bloqueo de la outbox: mientras se tiene, las ventas esperan
+            cur.execute("""
+                CREATE TEMP TABLE eventos_carga ON COMMIT DROP AS
+                SELECT bloque,
+                       jsonb_build_object('espacios', %s::jsonb,
+                                          'articulos', jsonb_agg(jsonb_build_array(
+                                              id_articulo, nombre, descripcion, cantidad) ORDER BY id_articulo)) AS datos
+                FROM (SELECT *, (ROW_NUMBER() OVER (ORDER BY id_articulo) - 1) / %s AS bloque
+                      FROM staging_articulos) s
+                GROUP BY bloque
+            """, (Json([[id_sucursal, espacio] for id_sucursal, espacio in espacios.items()]),
+                  self.ARTICULOS_POR_EVENTO))
+            cur.execute(self.BLOQUEO_OUTBOX)
+            cur.execute("""
+                INSERT INTO outbox_replicacion (tipo, datos)
+                SELECT 'nuevos_articulos_lote', datos FROM eventos_carga ORDER BY bloque
+            """)
+            conn.commit()
+        self.capacidad.ajustar({id_sucursal: -cantidad for id_sucursal, cantidad in ocupado.items()})
+        self.cache_inventario.invalidar()
+        
+        self.loteador.avisar()
+        logging.info(f"Carga masiva: {cargados} artículos en {time.monotonic() - inicio:.1f}s")
+        return {'estado': 'ok', 'cargados': cargados, 'primer_id': primer_id, 'ultimo_id': ultimo_id}
+    
+    def _crear_staging_articulos(self, cur):
+        """Tabla temporal de la carga masiva; se borra al terminar la transacción"""
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staging_articulos (
+                id_articulo INTEGER,
+                nombre VARCHAR(100) NOT NULL,
+                descripcion TEXT,
+                cantidad INTEGER NOT NULL
+            ) ON COMMIT DROP
+        """)
+        cur.execute("TRUNCATE staging_articulos")
+    
+    def _espacios_sucursales(self):
+        """Espacio libre de cada sucursal según el índice de capacidad"""
+        espacios = self.capacidad.instantanea()
+        if not sum(espacios.values()):
+            # Sin datos de espacio: partes iguales entre las demás sucursales
+            espacios = {nodo_id: 1 for nodo_id in self.nodos_conocidos if nodo_id != self.id_nodo}
+        return espacios
+    
+    def _insertar_staging_articulos(self, cur, espacios):
+        """Pasa los artículos de staging_articulos al inventario y los distribuye
+        
+        Cada sucursal recibe la parte proporcional a su espacio (división
+        entera) y el resto va a la de más espacio. Todo es aritmética entera:
+        los nodos que replican el lote obtienen la misma distribución.
+        Devuelve {id_sucursal: cantidad asignada}.
+        """
+        sucursales = list(espacios)
+        cur.execute("""
+            INSERT INTO inventario (id_articulo, nombre, descripcion, cantidad_total, cantidad_disponible)
+            SELECT id_articulo, nombre, descripcion, cantidad, cantidad FROM staging_articulos
+            ON CONFLICT (id_articulo) DO NOTHING
+        """)
+        cur.execute("""
+            WITH insertadas AS (
+            INSERT INTO distribucion_sucursal (id_articulo, id_sucursal, cantidad, espacio_disponible)
+            SELECT id_articulo, id_sucursal, cantidad,
+                   espacio - SUM(cantidad) OVER (PARTITION BY id_sucursal ORDER BY id_articulo)
+            FROM (
+                SELECT s.id_articulo, e.id_sucursal, e.espacio,
+                       s.cantidad::bigint * e.espacio / t.total
+                       + CASE WHEN e.orden = 1
+                              THEN s.cantidad - SUM(s.cantidad::bigint * e.espacio / t.total)
+                                                OVER (PARTITION BY s.id_articulo)
+                              ELSE 0 END AS cantidad
+                FROM staging_articulos s
+                CROSS JOIN (SELECT id_sucursal, espacio,
+                                   ROW_NUMBER() OVER (ORDER BY espacio DESC, id_sucursal) AS orden
+                            FROM unnest(%s::int[], %s::int[]) AS e(id_sucursal, espacio)) e
+                CROSS JOIN (SELECT SUM(espacio) AS total FROM unnest(%s::int[]) AS x(espacio)) t
+            ) d
+            ON CONFLICT (id_articulo, id_sucursal) DO NOTHING
+            RETURNING id_sucursal, cantidad
+            )
+            SELECT id_sucursal, SUM(cantidad) FROM insertadas GROUP BY id_sucursal
+        """, (sucursales, [espacios[s] for s in sucursales], [espacios[s] for s in sucursales]))
+        return {id_sucursal: int(cantidad) for id_sucursal, cantidad in cur.fetchall()}
+    
+    def obtener_sucursales_optimas(self, cantidad_total):
+        """Distribuye el artículo entre sucursales con más espacio (sin consultar la BD)"""
+        sucursales = self.capacidad.distribuir(cantidad_total)
+        if sucursales:
             return sucursales
-        except Exception as e:
-            logging.error(f"Error calculando distribución: {e}")
-            # Distribución equitativa por defecto
-            return {nodo_id: cantidad_total//len(self.nodos_conocidos) 
-                    for nodo_id in self.nodos_conocidos if nodo_id != self.id_nodo}
+        # Distribución equitativa por defecto
+        return {nodo_id: cantidad_total//len(self.nodos_conocidos) 
+                for nodo_id in self.nodos_conocidos if nodo_id != self.id_nodo}
     
-    def calcular_espacio_disponible(self, id_sucursal):
-        """Calcula el espacio disponible en una sucursal"""
-        try:
-            cur = self.db_conn.cursor()
+    def replicar_nuevo_articulo(self, cur, id_articulo, datos_articulo, distribucion):
+        """Registra en la outbox el nuevo artículo a replicar en todos los nodos"""
+        # JSON sólo admite claves de texto: la distribución viaja como {"id_sucursal": cantidad}
+        self.registrar_evento(cur, 'nuevo_articulo', {
+            'id_articulo': id_articulo,
+            'articulo': datos_articulo,
+            'distribucion': distribucion
+        })
+    
+    # Replicación asíncrona (outbox transaccional)
+    # Los ids de BIGSERIAL no se confirman en orden: sin este bloqueo, un evento de id
+    # menor podría confirmarse después de despachar uno mayor y no enviarse nunca.
+    # Se toma justo antes de insertar en la outbox y se libera con el commit.
+    BLOQUEO_OUTBOX = "SELECT pg_advisory_xact_lock(hashtext('outbox_replicacion'))"
+    
+    def registrar_evento(self, cur, tipo, datos):
+        """Inserta un evento de replicación; la transacción debe confirmarse enseguida"""
+        cur.execute(self.BLOQUEO_OUTBOX)
+        cur.execute("""
+            INSERT INTO outbox_replicacion (tipo, datos) VALUES (%s, %s)
+        """, (tipo, Json(datos)))
+    
+    def despachar_outbox(self):
+        """Envía en orden los eventos de la outbox a cada nodo, en lotes y con reintentos"""
+        # Conexión propia: los commits del despachador no deben mezclarse con los de las ventas
+        conn = None
+        quedan = False
+        while self.activo:
+            if not quedan:
+                self.loteador.esperar_lote()
+            quedan = False
+            try:
+                if conn is None or conn.closed:
+                    conn = self.conectar_postgresql()
+                    if conn is None:
+                        continue
+                # Si el lote se llenó quedan eventos: seguir sin esperar
+                quedan = self._despachar_pendientes(conn, self.loteador.max_eventos)
+            except Exception as e:
+                logging.error(f"Error despachando outbox: {e}")
+                try:
+                    conn.rollback()
+                except Exception:
+                    conn = None
+    
+    def _despachar_pendientes(self, conn, max_eventos):
+        """Despacha un lote por nodo; devuelve True si quedan eventos pendientes"""
+        cur = conn.cursor()
+        cur.execute("SELECT id_nodo, ultimo_evento_confirmado FROM outbox_entregas")
+        confirmados = dict(cur.fetchall())
+        
+        lotes = {}
+        for nodo_id in self.nodos_conocidos:
+            if nodo_id == self.id_nodo or self.interruptores.abierto(nodo_id):
+                # Circuito abierto: sus eventos siguen en la outbox desde su última
+                # confirmación y se reenvían cuando el circuito deja pasar la prueba
+                continue
             cur.execute("""
-                SELECT capacidad_maxima - SUM(cantidad)
-                FROM distribucion_sucursal
-                WHERE id_sucursal = %s
-                GROUP BY capacidad_maxima
-            """, (id_sucursal,))
-            
-            return cur.fetchone()[0] or 100  # Valor por defecto si no hay registros
-        except Exception as e:
-            logging.error(f"Error calculando espacio: {e}")
-            return 100
+                SELECT id_evento, tipo, datos FROM outbox_replicacion
+                WHERE id_evento > %s ORDER BY id_evento LIMIT %s
+            """, (confirmados.get(nodo_id, 0), max_eventos))
+            eventos = cur.fetchall()
+            if eventos:
+                lotes[nodo_id] = eventos
+        conn.commit()
+        
+        # Un mensaje por nodo con sus eventos en orden; los nodos se atienden en paralelo
+        futuros = {self.executor_red.submit(self._enviar_lote, nodo_id,
+                                            confirmados.get(nodo_id, 0), eventos): nodo_id
+                   for nodo_id, eventos in lotes.items()}
+        quedan = False
+        for futuro, nodo_id in futuros.items():
+            ultimo = futuro.result()
+            eventos = lotes[nodo_id]
+            if ultimo is not None and ultimo != eventos[-1][0]:
+                # El nodo indicó otra secuencia aplicada: reenviar desde ahí enseguida
+                logging.warning(f"Nodo {nodo_id} tiene aplicado hasta el evento {ultimo}; reenviando")
+                quedan = True
+            if ultimo is not None:
+                cur.execute("""
+                    INSERT INTO outbox_entregas (id_nodo, ultimo_evento_confirmado)
+                    VALUES (%s, %s)
+                    ON CONFLICT (id_nodo) DO UPDATE
+                    SET ultimo_evento_confirmado = EXCLUDED.ultimo_evento_confirmado,
+                        fecha_confirmacion = CURRENT_TIMESTAMP
+                """, (nodo_id, ultimo))
+                quedan = quedan or len(eventos) == max_eventos
+        
+        # Purgar los eventos que ya confirmaron todos los nodos
+        otros = [nodo_id for nodo_id in self.nodos_conocidos if nodo_id != self.id_nodo]
+        cur.execute("""
+            DELETE FROM outbox_replicacion
+            WHERE id_evento <= (SELECT MIN(ultimo_evento_confirmado) FROM outbox_entregas
+                                WHERE id_nodo = ANY(%s))
+              AND (SELECT COUNT(*) FROM outbox_entregas WHERE id_nodo = ANY(%s)) = %s
+        """, (otros, otros, len(otros)))
+        conn.commit()
+        return quedan
     
-    def replicar_nuevo_articulo(self, id_articulo, datos_articulo, distribucion):
-        """Replica el nuevo artículo a todos los nodos"""
-        mensaje = {
-            'tipo': 'nuevo_articulo',
+    def _enviar_lote(self, nodo_id, desde, eventos):
+        """Envía los eventos (desde, hasta] como un único mensaje; devuelve el último confirmado"""
+        hasta = eventos[-1][0]
+        # Un lote rechazado cuenta como fallo del nodo: su circuito espacia los reintentos
+        respuesta = self.enviar_mensaje(nodo_id, {
+            'tipo': 'lote_replicacion',
             'datos': {
-                'id_articulo': id_articulo,
-                'articulo': datos_articulo,
-                'distribucion': distribucion
+                'desde': desde,
+                'hasta': hasta,
+                'eventos': [{'id_evento': id_evento, 'tipo': tipo, 'datos': datos}
+                            for id_evento, tipo, datos in coalescer_eventos(eventos)]
             }
-        }
+        }, confirma=lambda respuesta: respuesta.get('estado') == 'ok' or 'ultima_secuencia' in respuesta)
+        if not respuesta:
+            return None
+        if respuesta.get('estado') != 'ok':
+            # Si el nodo informa su última secuencia aplicada, el envío continúa desde ella
+            return respuesta.get('ultima_secuencia')
+        return hasta
+    
+    def aplicar_evento_replicado(self, mensaje):
+        """Aplica un evento suelto de replicación (actualizar_inventario / nuevo_articulo)
         
-        for nodo_id, (ip, puerto) in self.nodos_conocidos.items():
-            if nodo_id != self.id_nodo:
-                try:
-                    self.enviar_mensaje(nodo_id, mensaje)
-                except Exception as e:
-                    logging.error(f"Error replicando a nodo {nodo_id}: {e}")
+        Es un lote de un solo evento: sólo se acepta el que sigue a la última
+        secuencia aplicada, así un evento adelantado no salta a los anteriores.
+        """
+        if 'id_evento' not in mensaje:
+            return {'estado': 'error', 'mensaje': 'Evento sin número de secuencia'}
+        return self.aplicar_lote_replicacion(mensaje['origen'], {
+            'desde': mensaje['id_evento'] - 1,
+            'hasta': mensaje['id_evento'],
+            'eventos': [{'id_evento': mensaje['id_evento'], 'tipo': mensaje['tipo'],
+                         'datos': mensaje['datos']}]
+        })
+    
+    def aplicar_lote_replicacion(self, id_origen, lote):
+        """Aplica un lote de eventos de otro nodo en una sola transacción
+        
+        Cada origen numera sus eventos; sólo se acepta un lote que continúa
+        exactamente la última secuencia aplicada, y los repetidos se confirman
+        sin volver a aplicarse.
+        Los lotes de un mismo origen se ordenan con el bloqueo de su fila en
+        replicacion_aplicada; los de orígenes distintos corren en paralelo.
+        """
+        try:
+            return self._en_transaccion(self._transaccion_lote_replicacion, id_origen, lote)
+        except Exception as e:
+            logging.error(f"Error aplicando replicación de nodo {id_origen}: {e}")
+            return {'estado': 'error', 'mensaje': str(e)}
+    
+    def _transaccion_lote_replicacion(self, conn, id_origen, lote):
+        """Comprueba la secuencia del origen y aplica el lote"""
+        cur = conn.cursor()
+        self.pool_bd.ejecutar(cur, 'registrar_origen', (id_origen,))
+        self.pool_bd.ejecutar(cur, 'bloquear_origen', (id_origen,))
+        ultima = cur.fetchone()[0]
+        
+        if lote['hasta'] <= ultima:
+            conn.rollback()
+            return {'estado': 'ok', 'ultima_secuencia': ultima, 'duplicado': True}
+        if lote['desde'] != ultima:
+            # Hueco o solapamiento parcial: un lote coalescido no puede aplicarse a medias
+            conn.rollback()
+            return {'estado': 'error', 'mensaje': 'Eventos fuera de orden',
+                    'ultima_secuencia': ultima}
+        
+        eventos = [evento for evento in lote['eventos'] if evento['id_evento'] > ultima]
+        cambios_capacidad, cantidades, altas = self._aplicar_eventos(cur, eventos)
+        
+        self.pool_bd.ejecutar(cur, 'avanzar_origen', (lote['hasta'], id_origen))
+        
+        conn.commit()
+        self.capacidad.ajustar(cambios_capacidad)
+        if altas:
+            self.cache_inventario.invalidar()
+        else:
+            self.cache_inventario.parchear(cantidades)
+        return {'estado': 'ok', 'ultima_secuencia': lote['hasta']}
+    
+    def _aplicar_eventos(self, cur, eventos):
+        """Aplica eventos ya deduplicados con sentencias por lotes
+        
+        Devuelve la variación de espacio libre por sucursal (índice de capacidad),
+        las cantidades finales por (id_articulo, id_sucursal) y si hubo altas
+        (para la caché de inventario).
+        """
+        articulos = []
+        distribuciones = []
+        lotes_articulos = []
+        cantidades = {}  # {(id_articulo, id_sucursal): nueva_cantidad}, gana la más reciente
+        deltas = {}
+        cambios_capacidad = {}
+        for evento in eventos:
+            datos = evento['datos']
+            if evento['tipo'] == 'nuevo_articulo':
+                articulo = datos['articulo']
+                articulos.append((datos['id_articulo'], articulo['nombre'], articulo.get('descripcion'),
+                                  articulo['cantidad'], articulo['cantidad']))
+                distribuciones.extend((datos['id_articulo'], int(id_sucursal), cantidad)
+                                      for id_sucursal, cantidad in datos['distribucion'].items())
+                for id_sucursal, cantidad in datos['distribucion'].items():
+                    cambios_capacidad[int(id_sucursal)] = cambios_capacidad.get(int(id_sucursal), 0) - cantidad
+            elif evento['tipo'] == 'actualizar_inventario':
+                # La fila de la sucursal origen es suya: se copia su valor absoluto.
+                # El total general es compartido: se descuenta la cantidad vendida.
+                cantidades[(datos['id_articulo'], datos['id_sucursal'])] = datos['nueva_cantidad']
+                deltas[datos['id_articulo']] = deltas.get(datos['id_articulo'], 0) + datos.get('cantidad', 0)
+                cambios_capacidad[datos['id_sucursal']] = (cambios_capacidad.get(datos['id_sucursal'], 0)
+                                                           + datos.get('cantidad', 0))
+            elif evento['tipo'] == 'nuevos_articulos_lote':
+                lotes_articulos.append(datos)
+            elif evento['tipo'] == 'actualizar_inventario_lote':
+                for articulo in datos['articulos']:
+                    cantidades[(articulo['id_articulo'], datos['id_sucursal'])] = articulo['nueva_cantidad']
+                    deltas[articulo['id_articulo']] = deltas.get(articulo['id_articulo'], 0) + articulo['cantidad']
+                    cambios_capacidad[datos['id_sucursal']] = (cambios_capacidad.get(datos['id_sucursal'], 0)
+                                                               + articulo['cantidad'])
+        
+        if articulos:
+            execute_values(cur, """
+                INSERT INTO inventario (id_articulo, nombre, descripcion, cantidad_total, cantidad_disponible)
+                VALUES %s ON CONFLICT (id_articulo) DO NOTHING
+            """, articulos)
+        for lote in lotes_articulos:
+            # Misma inserción y distribución que hizo el maestro, con sus espacios
+            self._crear_staging_articulos(cur)
+            execute_values(cur, """
+                INSERT INTO staging_articulos (id_articulo, nombre, descripcion, cantidad) VALUES %s
+            """, lote['articulos'], page_size=1000)
+            ocupado = self._insertar_staging_articulos(
+                cur, {id_sucursal: espacio for id_sucursal, espacio in lote['espacios']})
+            for id_sucursal, cantidad in ocupado.items():
+                cambios_capacidad[id_sucursal] = cambios_capacidad.get(id_sucursal, 0) - cantidad
+        if articulos or lotes_articulos:
+            # Mantener la secuencia local por delante de los ids replicados. Sólo en las
+            # réplicas: en el maestro haría retroceder un nextval aún sin confirmar
+            cur.execute("""
+                SELECT setval(pg_get_serial_sequence('inventario', 'id_articulo'),
+                              GREATEST((SELECT MAX(id_articulo) FROM inventario), 1))
+            """)
+        if distribuciones:
+            execute_values(cur, """
+                INSERT INTO distribucion_sucursal (id_articulo, id_sucursal, cantidad)
+                VALUES %s ON CONFLICT (id_articulo, id_sucursal) DO NOTHING
+            """, distribuciones)
+        # Filas en orden de id: dos lotes concurrentes las bloquean en el mismo orden
+        if cantidades:
+            filas = sorted((id_articulo, id_sucursal, nueva_cantidad)
+                           for (id_articulo, id_sucursal), nueva_cantidad in cantidades.items())
+            self.pool_bd.ejecutar(cur, 'fijar_cantidades', [list(columna) for columna in zip(*filas)])
+        if deltas:
+            self.pool_bd.ejecutar(cur, 'descontar_disponible',
+                                  [list(columna) for columna in zip(*sorted(deltas.items()))])
+        return cambios_capacidad, cantidades, bool(articulos or lotes_articulos)
+    
+    def _nodo_recuperado(self, nodo_id):
+        """Al cerrarse el circuito de un nodo, despachar enseguida lo que acumuló"""
+        self.loteador.avisar()
     
     def redistribuir_articulos(self, datos_redistribucion):
         """Redistribuye artículos cuando una sucursal falla"""
         if not self.es_maestro and self.maestro_actual != self.id_nodo:
-            return {'estado': 'error', 'mensaje': 'Solo el maestro puede redistribuir'}
+            return {'estado': 'error', 'mensaje': 'Solo el maestro puede redistribuir', **self._pista_maestro()}
+        if not self.tengo_lease():
+            return self._sin_lease()
             
-        with self.lock:
+        with self.locks_articulos.bloquear(datos_redistribucion['id_articulo']):
             try:
-                cur = self.db_conn.cursor()
-                
-                # Actualizar inventario general
-                cur.execute("""
-                    UPDATE inventario
-                    SET cantidad_disponible = cantidad_disponible - %s
-                    WHERE id_articulo = %s
-                """, (datos_redistribucion['cantidad'], datos_redistribucion['id_articulo']))
-                
-                # Distribuir a otras sucursales
-                for sucursal, cantidad in datos_redistribucion['nueva_distribucion'].items():
-                    cur.execute("""
-                        UPDATE distribucion_sucursal
-                        SET cantidad = cantidad + %s,
-                            espacio_disponible = espacio_disponible - %s
-                        WHERE id_articulo = %s AND id_sucursal = %s
-                    """, (cantidad, cantidad, datos_redistribucion['id_articulo'], sucursal))
-                
-                self.db_conn.commit()
-                return {'estado': 'ok'}
+                return self._en_transaccion(self._transaccion_redistribucion, datos_redistribucion)
             except Exception as e:
-                self.db_conn.rollback()
                 logging.error(f"Error redistribuyendo artículos: {e}")
                 return {'estado': 'error', 'mensaje': str(e)}
     
-    # Funciones para elección de maestro
-    def verificar_maestro(self):
-        """Verifica si el nodo maestro está activo"""
-        if self.maestro_actual == self.id_nodo:
-            return True
+    def _transaccion_redistribucion(self, conn, datos_redistribucion):
+        """Mueve la cantidad del artículo a las nuevas sucursales"""
+        cur = conn.cursor()
+        
+        # Actualizar inventario general
+        cur.execute("""
+            UPDATE inventario
+            SET cantidad_disponible = cantidad_disponible - %s
+            WHERE id_articulo = %s
+        """, (datos_redistribucion['cantidad'], datos_redistribucion['id_articulo']))
+        
+        # Distribuir a otras sucursales
+        for sucursal, cantidad in datos_redistribucion['nueva_distribucion'].items():
+            cur.execute("""
+                UPDATE distribucion_sucursal
+                SET cantidad = cantidad + %s,
+                    espacio_disponible = espacio_disponible - %s
+                WHERE id_articulo = %s AND id_sucursal = %s
+            """, (cantidad, cantidad, datos_redistribucion['id_articulo'], sucursal))
+        
+        conn.commit()
+        self.capacidad.ajustar({int(sucursal): -cantidad
+                                for sucursal, cantidad in datos_redistribucion['nueva_distribucion'].items()})
+        self.cache_inventario.invalidar()
+        return {'estado': 'ok'}
+    
+    # Detección de fallos por latidos
+    def enviar_latidos(self):
+        """Envía un ping por intervalo a cada nodo y vigila al maestro"""
+        while self.activo:
+            for nodo_id in self.nodos_conocidos:
+                # Un nodo que aún no respondió el latido anterior no recibe otro
+                if nodo_id != self.id_nodo and nodo_id not in self.latidos_en_curso:
+                    self.latidos_en_curso.add(nodo_id)
+                    try:
+                        self.executor_red.submit(self._enviar_latido, nodo_id)
+                    except RuntimeError:
+                        return  # El nodo se está cerrando
             
-        try:
-            respuesta = self.enviar_mensaje(self.maestro_actual, {'tipo': 'ping'})
-            return respuesta is not None
-        except:
-            return False
+            if (self.maestro_actual != self.id_nodo and not self.eleccion_en_curso
+                    and self.detector.conocido(self.maestro_actual)
+                    and not self.detector.esta_vivo(self.maestro_actual)):
+                logging.warning(f"Maestro {self.maestro_actual} sospechado caído "
+                                f"(phi {self.detector.phi(self.maestro_actual):.1f}), iniciando elección...")
+                threading.Thread(target=self.iniciar_eleccion, daemon=True).start()
+            
+            time.sleep(self.detector.intervalo)
     
-    def iniciar_eleccion(self):
-        """Inicia una elección de nodo maestro"""
-        if self.eleccion_en_curso:
+    def _enviar_latido(self, nodo_id):
+        """Un ping sin reintentos; la respuesta cuenta como latido del nodo"""
+        if not self.interruptores.permitir(nodo_id):
+            # Circuito abierto: el nodo se vuelve a probar cuando vence su espera
+            self.latidos_en_curso.discard(nodo_id)
             return
-            
-        self.eleccion_en_curso = True
-        logging.info(f"Nodo {self.id_nodo} iniciando elección de maestro")
+        plazo = 5 * self.detector.intervalo
+        mensaje = {'tipo': 'ping', 'origen': self.id_nodo}
+        if self.es_maestro:
+            # Los latidos del maestro renuevan su lease en cada nodo que los acepta
+            mensaje['termino'] = self.termino
+        envio = time.monotonic()
+        conexion = None
+        try:
+            conexion, _ = self.pool_conexiones.obtener(nodo_id, plazo)
+            solicitud = conexion.solicitar(mensaje, timeout=plazo)
+        except Exception as e:
+            # Un nodo caído falla en cada intervalo: no llenar el log
+            logging.debug(f"Latido a nodo {nodo_id} fallido: {e}")
+            self.interruptores.fallo(nodo_id, latido=True)
+            if conexion is not None:
+                self.pool_conexiones.descartar(nodo_id, conexion)
+            self.latidos_en_curso.discard(nodo_id)
+            return
+        
+        def al_responder(futuro):
+            self.latidos_en_curso.discard(nodo_id)
+            if futuro.exception() is None:
+                self.detector.latido(nodo_id)
+                self.interruptores.exito(nodo_id, latido=True)
+                if 'termino' in mensaje:
+                    self._confirmar_lease(nodo_id, mensaje['termino'], envio, futuro.result())
+                return
+            self.interruptores.fallo(nodo_id, latido=True)
+            if isinstance(futuro.exception(), ConnectionError):
+                self.pool_conexiones.descartar(nodo_id, conexion)
+        solicitud.futuro.add_done_callback(al_responder)
+    
+    # Liderazgo con términos y lease
+    def responder_latido(self, mensaje):
+        """Responde un ping; si trae término es el maestro renovando su lease"""
+        if 'termino' in mensaje and not self.aceptar_maestro(mensaje['origen'], mensaje['termino']):
+            return {'estado': 'error', 'mensaje': 'Término vencido', 'termino': self.termino}
+        return {'estado': 'ok'}
+    
+    def aceptar_maestro(self, nodo_id, termino):
+        """Reconoce a nodo_id como maestro de `termino` si no es un término vencido"""
+        with self.lock_liderazgo:
+            # Cada término tiene un solo ganador: sólo se rechaza un término viejo
+            # o un reclamo del término en el que este mismo nodo es maestro
+            if termino < self.termino or (termino == self.termino and self.es_maestro
+                                          and nodo_id != self.id_nodo):
+                return False
+            if termino > self.termino or self.maestro_actual != nodo_id:
+                logging.info(f"Nodo {self.id_nodo} reconoce a {nodo_id} como maestro (término {termino})")
+            self.termino = termino
+            self.maestro_actual = nodo_id
+            self.es_maestro = (nodo_id == self.id_nodo)
+            self.lease_maestro_hasta = time.monotonic() + self.duracion_lease
+            return True
+    
+    def _confirmar_lease(self, nodo_id, termino, envio, respuesta):
+        """Anota la confirmación de un latido del maestro o renuncia si hay un término mayor"""
+        with self.lock_liderazgo:
+            if respuesta.get('estado') == 'ok':
+                if self.es_maestro and termino == self.termino:
+                    self.acks_lease[nodo_id] = envio
+            elif respuesta.get('termino', 0) > self.termino:
+                logging.warning(f"Nodo {self.id_nodo} deja de ser maestro: término {respuesta['termino']} "
+                                f"mayor que {self.termino}")
+                self.termino = respuesta['termino']
+                self.es_maestro = False
+    
+    def tengo_lease(self):
+        """Si este nodo es maestro y la mayoría confirmó un latido suyo hace menos del lease
         
-        # Enviar mensaje de elección a nodos con ID mayor
-        mayores = [nodo_id for nodo_id in self.nodos_conocidos if nodo_id > self.id_nodo]
+        Se cuenta desde el envío del latido, antes de que cada nodo renueve su
+        propio plazo: el lease del maestro vence antes que el que le reconocen
+        los demás, así nunca hay dos maestros escribiendo a la vez.
+        """
+        with self.lock_liderazgo:
+            return self.es_maestro and self._tengo_lease_sin_lock()
+    
+    def _tengo_lease_sin_lock(self):
+        necesarios = len(self.nodos_conocidos) // 2  # Este nodo ya cuenta como uno
+        if not necesarios:
+            return True
+        confirmaciones = sorted(self.acks_lease.values(), reverse=True)
+        if len(confirmaciones) < necesarios:
+            return False
+        return time.monotonic() < confirmaciones[necesarios - 1] + 0.9 * self.duracion_lease
+    
+    def _sin_lease(self):
+        return {'estado': 'error', 'mensaje': 'El maestro no tiene el lease vigente', 'termino': self.termino}
+    
+    def verificar_maestro(self):
+        """Verifica si el nodo maestro está activo (según los latidos, sin esperar)"""
+        return self.verificar_conexion(self.maestro_actual)
+    
+    def iniciar_eleccion(self, max_rondas=20):
+        """Pide en paralelo el voto de todos los nodos para un término nuevo
         
-        if not mayores:
-            # Este nodo es el de mayor ID, se convierte en maestro
-            self.convertirse_en_maestro()
-            return
-            
-        respuestas = []
-        for nodo_id in mayores:
-            try:
-                respuesta = self.enviar_mensaje(nodo_id, {
+        Gana quien junta la mayoría. Los nodos no votan mientras reconocen el
+        lease del maestro anterior: el candidato espera a que venza y, si los
+        votos se reparten, repite con una espera aleatoria. Los nodos de id
+        mayor vivos se presentan antes, así rara vez compiten dos a la vez.
+        """
+        with self.lock_liderazgo:
+            if self.eleccion_en_curso:
+                return
+            self.eleccion_en_curso = True
+        logging.info(f"Nodo {self.id_nodo} iniciando elección de maestro")
+        try:
+            mayores_vivos = sum(1 for nodo_id in self.nodos_conocidos
+                                if nodo_id > self.id_nodo and self.detector.esta_vivo(nodo_id))
+            rondas = 0
+            while self.activo and rondas < max_rondas:
+                with self.lock_liderazgo:
+                    restante = self.lease_maestro_hasta - time.monotonic()
+                    maestro = self.maestro_actual
+                if self.es_maestro or (restante > 0 and self.detector.esta_vivo(maestro)):
+                    return  # Ya hay un maestro vivo (quizás este nodo)
+                if restante > 0:
+                    time.sleep(restante)
+                    continue
+                time.sleep(random.uniform(0, 0.05) + 0.05 * mayores_vivos)
+                
+                with self.lock_liderazgo:
+                    if self.es_maestro or time.monotonic() < self.lease_maestro_hasta:
+                        continue  # Apareció otro maestro durante la espera
+                    self.termino += 1
+                    termino = self.termino
+                    self.voto = (termino, self.id_nodo)
+                rondas += 1
+                
+                respuestas = self.difundir({
                     'tipo': 'eleccion_maestro',
-                    'iniciador': self.id_nodo
-                })
-                if respuesta and respuesta.get('estado') == 'ok':
-                    respuestas.append(True)
-            except:
-                continue
+                    'iniciador': self.id_nodo,
+                    'termino': termino
+                }, plazo=self.duracion_lease / 2, modo='quorum',
+                    confirma=lambda respuesta: respuesta.get('voto', False))
+                
+                votos = 1 + sum(1 for respuesta in respuestas.values() if respuesta and respuesta.get('voto'))
+                if votos > len(self.nodos_conocidos) // 2 and self.termino == termino:
+                    self.convertirse_en_maestro(termino)
+                    return
                 
-        if not any(respuestas):
-            # Ningún nodo mayor respondió, este nodo se convierte en maestro
-            self.convertirse_en_maestro()
+                mayor = max((respuesta.get('termino', 0) for respuesta in respuestas.values() if respuesta),
+                            default=0)
+                with self.lock_liderazgo:
+                    self.termino = max(self.termino, mayor)
+                time.sleep(random.uniform(0.05, 0.25))
+            logging.warning(f"Nodo {self.id_nodo}: elección sin resultado tras {rondas} rondas")
+        finally:
+            self.eleccion_en_curso = False
     
     def participar_eleccion(self, mensaje):
-        """Participa en una elección de maestro"""
-        if mensaje['iniciador'] < self.id_nodo:
-            # Este nodo tiene mayor ID, toma el control
-            self.iniciar_eleccion()
-            return {'estado': 'ok', 'tomando_control': True}
-        
-        return {'estado': 'ok', 'tomando_control': False}
-    
-    def convertirse_en_maestro(self):
-        """Convierte este nodo en el maestro"""
-        self.es_maestro = True
-        self.maestro_actual = self.id_nodo
-        self.eleccion_en_curso = False
-        logging.info(f"Nodo {self.id_nodo} es ahora el maestro")
-        
-        # Notificar a todos los nodos
-        for nodo_id, (ip, puerto) in self.nodos_conocidos.items():
-            if nodo_id != self.id_nodo:
-                try:
-                    self.enviar_mensaje(nodo_id, {
-                        'tipo': 'confirmacion_maestro',
-                        'nuevo_maestro': self.id_nodo
-                    })
-                except Exception as e:
-                    logging.error(f"Error notificando a nodo {nodo_id}: {e}")
+        """Vota por el candidato si su término es nuevo y no hay un maestro con lease"""
+        candidato, termino = mensaje['iniciador'], mensaje.get('termino', 0)
+        with self.lock_liderazgo:
+            ahora = time.monotonic()
+            lease_ajeno = not self.es_maestro and ahora < self.lease_maestro_hasta
+            if termino < self.termino or lease_ajeno or (self.es_maestro and self._tengo_lease_sin_lock()):
+                return {'estado': 'ok', 'voto': False, 'termino': self.termino}
+            if termino > self.termino:
+                self.termino = termino
+                self.es_maestro = False
+            if self.voto[0] == termino and self.voto[1] != candidato:
+                return {'estado': 'ok', 'voto': False, 'termino': self.termino}
+            self.voto = (termino, candidato)
+            return {'estado': 'ok', 'voto': True, 'termino': self.termino}
     
-    def actualizar_maestro(self, nuevo_maestro):
-        """Actualiza la referencia al nodo maestro"""
-        self.maestro_actual = nuevo_maestro
-        self.es_maestro = (nuevo_maestro == self.id_nodo)
-        logging.info(f"Nodo {self.id_nodo} reconoce a {nuevo_maestro} como maestro")
+    def convertirse_en_maestro(self, termino):
+        """Asume como maestro de `termino` y toma el lease con la confirmación de la mayoría"""
+        with self.lock_liderazgo:
+            if self.termino != termino:
+                return
+            self.es_maestro = True
+            self.maestro_actual = self.id_nodo
+            self.acks_lease = {}
+        logging.info(f"Nodo {self.id_nodo} es ahora el maestro (término {termino})")
+        
+        # La confirmación vale como primer latido: con la mayoría ya hay lease
+        envio = time.monotonic()
+        respuestas = self.difundir({
+            'tipo': 'confirmacion_maestro',
+            'nuevo_maestro': self.id_nodo,
+            'termino': termino
+        }, plazo=self.duracion_lease / 2, modo='quorum')
+        for nodo_id, respuesta in respuestas.items():
+            if respuesta:
+                self._confirmar_lease(nodo_id, termino, envio, respuesta)
     
     # Funciones de red
-    def enviar_mensaje(self, destino_id, mensaje):
-        """Envía un mensaje a otro nodo"""
+    # Repetirlos no cambia el resultado: se pueden reenviar aunque el primer envío haya llegado
+    TIPOS_IDEMPOTENTES = frozenset({'ping', 'consulta_inventario', 'consulta_clientes', 'buscar_cliente',
+                                    'lote_replicacion', 'eleccion_maestro', 'confirmacion_maestro'})
+    
+    def enviar_mensaje(self, destino_id, mensaje, timeout=None, confirma=None):
+        """Envía un mensaje a otro nodo y espera su respuesta
+        
+        Si se indica, confirma(respuesta) decide si la respuesta cuenta como
+        éxito para el circuito del nodo (por defecto, toda respuesta).
+        """
+        resultado = Future()
+        self._solicitar(destino_id, mensaje, timeout, resultado, confirma)
+        return resultado.result()
+    
+    def enviar_mensaje_async(self, destino_id, mensaje, timeout=None):
+        """Envía un mensaje sin esperar; devuelve un Future con la respuesta (None si falla)
+        
+        Varias solicitudes comparten la misma conexión y sus respuestas
+        pueden llegar en cualquier orden.
+        """
+        resultado = Future()
+        # Abrir una conexión nueva puede bloquear: no hacerlo en el hilo que llama
+        self.executor_red.submit(self._solicitar, destino_id, mensaje, timeout, resultado)
+        return resultado
+    
+    def _solicitar(self, destino_id, mensaje, timeout, resultado, confirma=None):
+        """Envía el mensaje por el pool y deja la respuesta (o None) en resultado"""
         if destino_id not in self.nodos_conocidos:
             logging.error(f"Nodo {destino_id} desconocido")
-            return None
+            resultado.set_result(None)
+            return
+        if not self.interruptores.permitir(destino_id):
+            logging.debug(f"Circuito hacia nodo {destino_id} abierto; {mensaje['tipo']} no enviado")
+            resultado.set_result(None)
+            return
         
-        ip, puerto = self.nodos_conocidos[destino_id]
-        mensaje['origen'] = self.id_nodo
+        def registrar(futuro):
+            respuesta = futuro.result()
+            if respuesta is None or respuesta.get('incierto') or (confirma and not confirma(respuesta)):
+                self.interruptores.fallo(destino_id)
+            else:
+                self.interruptores.exito(destino_id)
+        resultado.add_done_callback(registrar)
+        self._solicitar_por_pool(destino_id, mensaje, timeout, resultado)
+    
+    def _solicitar_por_pool(self, destino_id, mensaje, timeout, resultado, reintentos=1):
+        """Hace el envío de _solicitar; reintenta una vez si la conexión guardada estaba rota
         
+        Si la conexión cae o vence el plazo después de escribir el mensaje, el
+        otro nodo pudo haberlo ejecutado: sólo los tipos idempotentes se
+        reenvían y el resto devuelve un error marcado como incierto.
+        Un mensaje con 'stream' recibe sus filas como un FilasRemotas.
+        """
+        mensaje['origen'] = self.id_nodo
+        timeout = timeout or self.pool_conexiones.timeout
+        reutilizada = False
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5.0)
-                s.connect((ip, puerto))
-                s.sendall(pickle.dumps(mensaje))
-                
-                # Esperar respuesta
-                data = s.recv(4096)
-                if data:
-                    return pickle.loads(data)
-                return None
+            conexion, reutilizada = self.pool_conexiones.obtener(destino_id, timeout)
+            solicitud = conexion.solicitar(mensaje, timeout=timeout, stream=mensaje.get('stream', False))
         except Exception as e:
+            if reutilizada and reintentos:
+                # La conexión guardada estaba rota: reintentar con una nueva
+                self.pool_conexiones.descartar(destino_id, conexion)
+                return self._solicitar_por_pool(destino_id, mensaje, timeout, resultado, reintentos - 1)
             logging.error(f"Error enviando mensaje a nodo {destino_id}: {e}")
-            return None
+            resultado.set_result(None)
+            return
+        
+        def al_responder(futuro):
+            error = futuro.exception()
+            if error is None:
+                resultado.set_result(futuro.result())
+                return
+            if isinstance(error, ConnectionError):
+                self.pool_conexiones.descartar(destino_id, conexion)
+            if mensaje['tipo'] not in self.TIPOS_IDEMPOTENTES:
+                logging.error(f"Sin respuesta de nodo {destino_id} después de enviar {mensaje['tipo']}: {error}")
+                if isinstance(error, ConnectionError):
+                    motivo = "cerró la conexión"
+                elif isinstance(error, TimeoutError):
+                    motivo = "no respondió a tiempo"
+                else:
+                    motivo = "devolvió una respuesta inválida"
+                resultado.set_result({'estado': 'error', 'incierto': True,
+                                      'mensaje': f"El nodo {destino_id} {motivo}; "
+                                                 f"no se sabe si la operación se aplicó"})
+            elif isinstance(error, ConnectionError) and reutilizada and reintentos:
+                self._solicitar_por_pool(destino_id, mensaje, timeout, resultado, reintentos - 1)
+            else:
+                logging.error(f"Error enviando mensaje a nodo {destino_id}: {error}")
+                resultado.set_result(None)
+        solicitud.futuro.add_done_callback(al_responder)
     
-    def redirigir_a_maestro(self, tipo, datos):
-        """Redirige una operación al nodo maestro"""
-        try:
-            respuesta = self.enviar_mensaje(self.maestro_actual, {
-                'tipo': tipo,
-                'datos': datos
-            })
-            return respuesta if respuesta else {'estado': 'error', 'mensaje': 'No se pudo contactar al maestro'}
-        except Exception as e:
-            logging.error(f"Error redirigiendo al maestro: {e}")
-            return {'estado': 'error', 'mensaje': str(e)}
+    def difundir(self, mensaje, destinos=None, plazo=5.0, modo='todos', confirma=None):
+        """Envía un mensaje a varios nodos en paralelo bajo un plazo común
+        
+        modo 'todos' espera a todos los destinos, 'quorum' a que la mayoría del
+        sistema (contando este nodo) haya confirmado y 'sin_espera' no espera.
+        Una respuesta confirma si confirma(respuesta) es verdadero (por defecto, toda respuesta).
+        Devuelve {nodo_id: respuesta}, con None para los nodos que no respondieron.
+        """
+        if destinos is None:
+            destinos = self.nodos_conocidos
+        destinos = [nodo_id for nodo_id in destinos if nodo_id != self.id_nodo]
+        
+        # Cada envío lleva su propia copia: enviar_mensaje_async agrega el origen
+        futuros = {self.enviar_mensaje_async(nodo_id, dict(mensaje), plazo): nodo_id
+                   for nodo_id in destinos}
+        if modo == 'sin_espera':
+            return {}
+        
+        if modo == 'quorum':
+            necesarias = len(self.nodos_conocidos) // 2  # Este nodo ya cuenta como un voto
+        else:
+            necesarias = len(destinos)
+        
+        resultados = {nodo_id: None for nodo_id in destinos}
+        confirmadas = 0
+        limite = time.monotonic() + plazo
+        pendientes = set(futuros)
+        while pendientes and confirmadas < necesarias:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            listos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                respuesta = futuro.result()
+                resultados[futuros[futuro]] = respuesta
+                if respuesta is not None and (confirma is None or confirma(respuesta)):
+                    confirmadas += 1
+        
+        sin_respuesta = [nodo_id for nodo_id, respuesta in resultados.items() if respuesta is None]
+        if confirmadas < necesarias:
+            logging.warning(f"Difusión de {mensaje['tipo']}: {confirmadas}/{necesarias} confirmaciones, "
+                            f"sin respuesta de {sin_respuesta}")
+        return resultados
+    
+    def _pista_maestro(self):
+        """Quién cree este nodo que es el maestro, para corregir cachés ajenas"""
+        return {'maestro': self.maestro_actual, 'termino': self.termino}
+    
+    def _escritura_maestro(self, mensaje, operacion, *args):
+        """Atiende una escritura del maestro; la respuesta lleva la pista del maestro"""
+        if mensaje.get('redirigido') and not self.es_maestro:
+            # No se reenvía otra vez: quien redirigió corrige su caché con la pista
+            return {'estado': 'error', 'mensaje': 'Este nodo no es el maestro', **self._pista_maestro()}
+        respuesta = operacion(*args)
+        if self.es_maestro:
+            respuesta.update(self._pista_maestro())
+        return respuesta
+    
+    def _actualizar_pista_maestro(self, respuesta):
+        """Adopta el maestro que indica una respuesta si es de un término igual o más nuevo"""
+        if not respuesta or 'maestro' not in respuesta:
+            return
+        with self.lock_liderazgo:
+            termino = respuesta.get('termino', 0)
+            if termino > self.termino or (termino == self.termino and not self.es_maestro):
+                self.termino = termino
+                self.maestro_actual = respuesta['maestro']
+    
+    def _candidatos_maestro(self):
+        """El maestro en caché y luego los nodos vivos de id mayor (quienes ganarían una elección)"""
+        vivos = sorted((nodo_id for nodo_id in self.nodos_conocidos
+                        if nodo_id not in (self.id_nodo, self.maestro_actual) and self.detector.esta_vivo(nodo_id)),
+                       reverse=True)
+        return [self.maestro_actual] + vivos
+    
+    # Plazo de las redirecciones más largas que una operación común
+    PLAZOS_REDIRECCION = {'carga_articulos': 120.0}
+    
+    def redirigir_a_maestro(self, tipo, datos, max_destinos=3):
+        """Redirige una operación al maestro en caché, con cobertura si tarda
+        
+        Si el maestro no responde dentro del p95 de las redirecciones
+        anteriores, una solicitud idempotente sale también hacia el siguiente
+        candidato; una escritura sólo pasa al siguiente cuando la anterior
+        falló sin llegar a enviarse o no era el maestro. Sólo el maestro con
+        lease la ejecuta; los demás contestan con la pista del maestro, que
+        corrige la caché y recibe el reintento.
+        """
+        mensaje = {'tipo': tipo, 'datos': datos, 'redirigido': True}
+        inicio = time.monotonic()
+        limite = inicio + self.PLAZOS_REDIRECCION.get(tipo, self.pool_conexiones.timeout)
+        # Una escritura no idempotente nunca está en curso en dos nodos a la vez
+        con_cobertura = tipo in self.TIPOS_IDEMPOTENTES
+        candidatos = self._candidatos_maestro()
+        intentados = []
+        futuros = {}
+        
+        def enviar(nodo_id):
+            intentados.append(nodo_id)
+            futuros[self.enviar_mensaje_async(nodo_id, dict(mensaje), limite - time.monotonic())] = nodo_id
+        
+        def siguiente():
+            # Primero la pista más reciente, luego los candidatos en orden
+            for nodo_id in [self.maestro_actual] + candidatos:
+                if nodo_id not in intentados and nodo_id != self.id_nodo:
+                    return nodo_id
+            return None
+        
+        enviar(candidatos[0])
+        ultima = None
+        while futuros:
+            espera_cobertura = self.latencias_maestro.percentil(0.95, 0.05)
+            cobertura = inicio + espera_cobertura * len(intentados) - time.monotonic()
+            puede_cubrir = con_cobertura and len(intentados) < max_destinos and siguiente() is not None
+            plazo = min(cobertura, limite - time.monotonic()) if puede_cubrir else limite - time.monotonic()
+            if plazo <= 0 and not puede_cubrir:
+                break
+            listos, _ = wait(list(futuros), timeout=max(plazo, 0), return_when=FIRST_COMPLETED)
+            if not listos:
+                if puede_cubrir:
+                    logging.info(f"Redirección de {tipo} lenta; cubriendo con el nodo {siguiente()}")
+                    enviar(siguiente())
+                continue
+            for futuro in listos:
+                nodo_id = futuros.pop(futuro)
+                respuesta = futuro.result()
+                self._actualizar_pista_maestro(respuesta)
+                if respuesta and respuesta.get('incierto'):
+                    return respuesta  # Pudo haberse aplicado: no se reintenta en otro nodo
+                if respuesta and respuesta.get('estado') == 'ok':
+                    if con_cobertura:
+                        self.latencias_maestro.registrar(time.monotonic() - inicio)
+                    return respuesta
+                ultima = respuesta or ultima
+                # Falló o no era el maestro: ir enseguida al siguiente (la pista va primero)
+                if len(intentados) < max_destinos and siguiente() is not None:
+                    enviar(siguiente())
+        
+        if futuros and not con_cobertura:
+            # La escritura ya salió y sigue sin respuesta: el maestro pudo aplicarla
+            return {'estado': 'error', 'incierto': True,
+                    'mensaje': f"El maestro no respondió a tiempo; no se sabe si {tipo} se aplicó"}
+        if ultima and ultima.get('mensaje') != 'Este nodo no es el maestro':
+            return ultima  # Error propio de la operación (p. ej. datos inválidos)
+        return {'estado': 'error', 'mensaje': 'No se pudo contactar al maestro'}
     
     # Interfaz de usuario
     def interfaz_usuario(self):
@@ -560,7 +2850,10 @@ class NodoInventario:
             print("3. Vender artículo")
             print("4. Agregar artículo al sistema")
             print("5. Ver estado del sistema")
-            print("6. Salir")
+            print("6. Cargar artículos desde CSV")
+            print("7. Buscar cliente")
+            print("8. Consultar inventario de todas las sucursales")
+            print("9. Salir")
             
             opcion = input("Seleccione una opción: ")
             
@@ -576,6 +2869,12 @@ class NodoInventario:
                 elif opcion == '5':
                     self.mostrar_estado()
                 elif opcion == '6':
+                    self.cargar_articulos_ui()
+                elif opcion == '7':
+                    self.buscar_cliente_ui()
+                elif opcion == '8':
+                    self.mostrar_inventario_global()
+                elif opcion == '9':
                     self.activo = False
                     print("Saliendo del sistema...")
                 else:
@@ -596,19 +2895,53 @@ class NodoInventario:
         else:
             print(f"Error: {inventario['mensaje']}")
     
+    def mostrar_inventario_global(self):
+        """Muestra el stock de cada artículo en todas las sucursales"""
+        texto = input("ID o nombre del artículo (vacío para todos): ").strip()
+        if texto.isdigit():
+            resultado = self.consulta_inventario_global(id_articulo=int(texto))
+        else:
+            resultado = self.consulta_inventario_global(nombre=texto or None)
+        
+        print("\n=== INVENTARIO DE TODAS LAS SUCURSALES ===")
+        if not resultado['completo']:
+            print(f"⚠️  Resultado parcial: sin respuesta de las sucursales {resultado['sin_respuesta']}")
+        for item in resultado['inventario']:
+            print(f"ID: {item['id_articulo']} | {item['nombre']} | Total sistema: {item['cantidad_total']}")
+            for id_sucursal, cantidad in sorted(item['sucursales'].items()):
+                print(f"  Sucursal {id_sucursal}: {cantidad}")
+            print("-" * 40)
+    
     def mostrar_clientes(self):
         """Muestra la lista de clientes"""
-        clientes = self.consultar_clientes()
-        if clientes['estado'] == 'ok':
+        try:
             print("\n=== CLIENTES REGISTRADOS ===")
-            for cliente in clientes['clientes']:
+            for cliente in self.iterar_clientes():
                 print(f"ID: {cliente['id_cliente']} | {cliente['nombre']}")
                 print(f"  Tel: {cliente['telefono']} | Email: {cliente['email']}")
                 print(f"  Dirección: {cliente['direccion']}")
                 print(f"  Sucursal registro: {cliente['sucursal_registro']}")
                 print("-" * 40)
+        except Exception as e:
+            print(f"Error: {e}")
+    
+    def buscar_cliente_ui(self):
+        """Interfaz para buscar clientes"""
+        print("\n=== BUSCAR CLIENTE ===")
+        criterio = input("Buscar por (documento/telefono/email/nombre): ").strip().lower()
+        valor = input("Valor (para nombre, el comienzo): ")
+        
+        resultado = self.buscar_cliente(criterio, valor)
+        
+        if resultado['estado'] == 'ok':
+            for cliente in resultado['clientes']:
+                print(f"ID: {cliente['id_cliente']} | {cliente['nombre']}")
+                print(f"  Tel: {cliente['telefono']} | Email: {cliente['email']}")
+                print("-" * 40)
+            if not resultado['clientes']:
+                print("Sin resultados")
         else:
-            print(f"Error: {clientes['mensaje']}")
+            print(f"\n❌ Error: {resultado['mensaje']}")
     
     def procesar_venta_ui(self):
         """Interfaz para procesar una venta"""
@@ -648,30 +2981,60 @@ class NodoInventario:
         else:
             print(f"\n❌ Error: {resultado['mensaje']}")
     
+    def cargar_articulos_ui(self):
+        """Interfaz para la carga masiva de artículos"""
+        print("\n=== CARGA MASIVA DE ARTÍCULOS ===")
+        ruta = input("Ruta del CSV (nombre,descripcion,cantidad): ")
+        
+        resultado = self.cargar_articulos(ruta)
+        
+        if resultado['estado'] == 'ok':
+            print(f"\n✅ {resultado['cargados']} artículos cargados")
+        else:
+            print(f"\n❌ Error: {resultado['mensaje']}")
+    
     def mostrar_estado(self):
         """Muestra el estado del sistema"""
         print("\n=== ESTADO DEL SISTEMA ===")
         print(f"Nodo actual: {self.id_nodo}")
         print(f"Rol: {'MAESTRO' if self.es_maestro else 'SUCURSAL'}")
-        print(f"Maestro actual: {self.maestro_actual}")
+        print(f"Maestro actual: {self.maestro_actual} (término {self.termino}"
+              f"{', lease vigente' if self.tengo_lease() else ''})")
         print(f"Nodos conocidos: {len(self.nodos_conocidos)}")
         
-        # Verificar conexión con otros nodos
+        compresion = protocolo.ESTADISTICAS_COMPRESION.resumen()
+        if compresion['ratio']:
+            print(f"Compresión: {compresion['tramas_comprimidas']} tramas, "
+                  f"{compresion['bytes_originales']} -> {compresion['bytes_comprimidos']} bytes "
+                  f"(ratio {compresion['ratio']:.1f}x)")
+        
+        bd = self.pool_bd.resumen()
+        print(f"Pool BD: {bd['en_uso']}/{bd['maximo']} en uso, {bd['libres']} libres, "
+              f"espera media {bd['espera_media'] * 1000:.1f} ms (máx. {bd['espera_maxima'] * 1000:.1f} ms), "
+              f"saturado en {bd['saturacion']:.0%} de los préstamos, {bd['reconexiones']} reconexiones, "
+              f"{bd['preparaciones']} sentencias preparadas")
+        
+        cache = self.cache_inventario.resumen()
+        print(f"Caché de inventario: {cache['aciertos']} aciertos, {cache['fallos']} fallos "
+              f"({cache['tasa_aciertos']:.0%}), {cache['entradas']} entradas, versión {cache['version']}")
+        
+        # Vista de membresía del detector de fallos (sin enviar nada)
         print("\nEstado de nodos:")
+        vista = self.detector.vista()
+        circuitos = self.interruptores.vista()
         for nodo_id, (ip, puerto) in self.nodos_conocidos.items():
             estado = "✅ ACTIVO" if self.verificar_conexion(nodo_id) else "❌ INACTIVO"
-            print(f"Nodo {nodo_id}: {estado}")
+            sospecha = f" (phi {vista[nodo_id]:.1f})" if nodo_id in vista else ""
+            if nodo_id in circuitos:
+                estado_circuito, espera = circuitos[nodo_id]
+                sospecha += f", circuito {estado_circuito} (prueba en {espera:.1f}s)"
+            print(f"Nodo {nodo_id}: {estado}{sospecha}")
     
     def verificar_conexion(self, nodo_id):
-        """Verifica si un nodo está activo"""
+        """Verifica si un nodo está activo según el detector de fallos"""
         if nodo_id == self.id_nodo:
             return True
-            
-        try:
-            respuesta = self.enviar_mensaje(nodo_id, {'tipo': 'ping'})
-            return respuesta is not None
-        except:
-            return False
+        return self.detector.esta_vivo(nodo_id)
 
 def iniciar_nodo_inventario(config):
     """Inicia un nodo del sistema de inventario"""
@@ -679,10 +3042,23 @@ def iniciar_nodo_inventario(config):
         id_nodo=config['id'],
         puerto=config['puerto'],
         nodos_conocidos=config['nodos_conocidos'],
-        es_maestro=(config['id'] == 1)  # El nodo 1 es maestro inicial
+        es_maestro=(config['id'] == 1),  # El nodo 1 es maestro inicial
+        db_config=config.get('db_config'),
+        indice_clientes=config.get('indice_clientes', False),
+        duracion_lease=config.get('duracion_lease', 1.0)
+    )
     
     # Iniciar servidor en segundo plano
-    threading.Thread(target=nodo.servidor, daemon=True).start()
+    if config.get('modo_servidor') == 'async':
+        threading.Thread(target=nodo.servidor_async, daemon=True).start()
+    else:
+        threading.Thread(target=nodo.servidor, daemon=True).start()
+    
+    # Replicación en segundo plano desde la outbox
+    threading.Thread(target=nodo.despachar_outbox, daemon=True).start()
+    
+    # Latidos para el detector de fallos
+    threading.Thread(target=nodo.enviar_latidos, daemon=True).start()
     
     # Pequeña pausa para asegurar que el servidor esté listo
     time.sleep(1)
@@ -720,7 +3096,9 @@ if __name__ == "__main__":
     config = {
         'id': id_nodo,
         'puerto': TODOS_NODOS[id_nodo][1],
-        'nodos_conocidos': TODOS_NODOS
+        'nodos_conocidos': TODOS_NODOS,
+        'modo_servidor': 'async',  # 'hilos' para el servidor de un hilo por conexión
+        'db_config': dict(DB_CONFIG_PREDETERMINADA)  # Credenciales y tamaño del pool de PostgreSQL
     }
     
     # Configurar PostgreSQL antes de iniciar
@@ -728,6 +3106,6 @@ if __name__ == "__main__":
     print("Asegúrese de que:")
     print("1. PostgreSQL esté instalado y corriendo")
     print("2. Exista una base de datos llamada 'inventario_distribuido'")
-    print("3. Las credenciales en el código sean correctas")
+    print("3. Las credenciales de 'db_config' sean correctas")
     
     iniciar_nodo_inventario(config)
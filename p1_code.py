@@ -4,9 +4,9 @@ import socket
 import threading
 import datetime
 import time
-import pickle
 from concurrent.futures import ThreadPoolExecutor
 import random
+import protocolo
 
 class Nodo:
     def __init__(self, id_nodo, puerto, nodos_conocidos):
@@ -41,10 +41,10 @@ class Nodo:
             while self.activo:
                 try:
                     conn, addr = s.accept()
-                    with conn:
-                        data = conn.recv(4096)
-                        if data:
-                            mensaje = pickle.loads(data)
+                    with conn, conn.makefile('rb') as lector:
+                        protocolo.responder_saludo(conn, lector)
+                        mensaje = protocolo.recibir_mensaje(lector)
+                        if mensaje:
                             self.guardar_mensaje(mensaje, es_recepcion=True)
                             print(f"Nodo {self.id_nodo} recibió mensaje de {mensaje['origen']}: {mensaje['contenido']}")
                             
@@ -55,7 +55,7 @@ class Nodo:
                                 'contenido': f"Confirmación de recepción para mensaje: {mensaje['contenido']}",
                                 'timestamp': datetime.datetime.now().isoformat()
                             }
-                            conn.sendall(pickle.dumps(respuesta))
+                            protocolo.enviar_mensaje(conn, respuesta)
                 except Exception as e:
                     print(f"Error en servidor nodo {self.id_nodo}: {e}")
     
@@ -76,13 +76,14 @@ class Nodo:
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.connect((ip, puerto))
-                s.sendall(pickle.dumps(mensaje))
+                lector = s.makefile('rb')
+                protocolo.saludar(s, lector)
+                protocolo.enviar_mensaje(s, mensaje)
                 self.guardar_mensaje(mensaje, es_recepcion=False)
                 
                 # Esperar confirmación
-                data = s.recv(4096)
-                if data:
-                    respuesta = pickle.loads(data)
+                respuesta = protocolo.recibir_mensaje(lector)
+                if respuesta:
                     self.guardar_mensaje(respuesta, es_recepcion=True)
                     print(f"Nodo {self.id_nodo} recibió confirmación de {destino_id}: {respuesta['contenido']}")
                     return True
@@ -0,0 +1,784 @@
+import asyncio
+import contextlib
+import datetime
+import lzma
+import struct
+import threading
+import zlib
+from decimal import Decimal
+
+# Cabecera de cada trama: tipo de trama (1 byte) + id de solicitud (4 bytes)
+# + longitud del cuerpo (4 bytes). El id permite tener varias solicitudes en
+# curso por conexión y recibir las respuestas en cualquier orden.
+CABECERA = struct.Struct('!BII')
+
+# Tipos de trama
+TRAMA_MENSAJE = 0    # Mensaje completo
+TRAMA_STREAM = 1     # Inicio de una respuesta enviada por partes
+TRAMA_FRAGMENTO = 2  # Bloque de filas de una respuesta por partes
+TRAMA_FIN = 3        # Fin de la respuesta por partes (cuerpo vacío si todo fue bien)
+TRAMA_SALUDO = 4     # Negociación de versión al abrir la conexión
+
+MAX_TRAMA = 64 * 1024 * 1024
+FILAS_POR_FRAGMENTO = 500
+
+
+class ErrorProtocolo(Exception):
+    """Error en el intercambio de tramas entre nodos"""
+
+
+class RespuestaStream:
+    """Respuesta cuyas filas se envían en bloques a medida que se generan"""
+    def __init__(self, cabecera, campo, filas, filas_por_fragmento=FILAS_POR_FRAGMENTO):
+        self.cabecera = cabecera
+        self.campo = campo
+        self.filas = filas
+        self.filas_por_fragmento = filas_por_fragmento
+
+    def fragmentos(self):
+        bloque = []
+        for fila in self.filas:
+            bloque.append(fila)
+            if len(bloque) >= self.filas_por_fragmento:
+                yield bloque
+                bloque = []
+        if bloque:
+            yield bloque
+
+
+# Códec binario de mensajes
+#
+# Cada mensaje empieza con una etiqueta de tipo (1 byte). Los tipos conocidos
+# se codifican según su esquema: un mapa de bits con los campos presentes,
+# los campos en orden con ancho fijo y al final los campos extra que no
+# encajan en el esquema. Las respuestas y los tipos sin esquema usan la
+# codificación genérica de valores (etiqueta 0).
+VERSION_BINARIA = 1
+VERSION_MULTIPLEXADA = 2  # Cabecera de trama con id de solicitud
+VERSION_ESQUEMAS_3 = 3    # Filtros de consulta, términos de elección y pista del maestro en los esquemas
+# Un nodo con otros esquemas o cadenas internadas leería mal los mismos mensajes:
+# sólo se ofrece la versión actual y el saludo rechaza a los nodos sin actualizar.
+VERSIONES_SOPORTADAS = (VERSION_ESQUEMAS_3,)
+
+_U8 = struct.Struct('!B')
+_U16 = struct.Struct('!H')
+_U32 = struct.Struct('!I')
+_I8 = struct.Struct('!b')
+_I16 = struct.Struct('!h')
+_I32 = struct.Struct('!i')
+_I64 = struct.Struct('!q')
+_F64 = struct.Struct('!d')
+
+# Etiquetas de la codificación genérica de valores
+(_NULO, _VERDADERO, _FALSO, _ENTERO32, _ENTERO64, _ENTERO_GRANDE, _REAL, _TEXTO,
+ _INTERNADO, _BYTES, _LISTA, _TUPLA, _DICT, _TABLA, _FECHA_HORA, _FECHA, _DECIMAL,
+ _ENTERO8, _ENTERO16, _TEXTO_CORTO) = range(20)
+
+# Cadenas frecuentes que viajan como un solo byte. Sólo agregar al final:
+# el índice forma parte del formato de la versión.
+CADENAS_INTERNADAS = (
+    'estado', 'ok', 'error', 'mensaje', 'tipo', 'origen', 'datos',
+    'inventario', 'clientes', 'campo', 'id_articulo', 'nombre', 'descripcion',
+    'cantidad', 'sucursal', 'cantidad_total', 'id_cliente', 'direccion',
+    'telefono', 'email', 'sucursal_registro', 'id_sucursal', 'nueva_cantidad',
+    'guia_envio', 'id_evento', 'articulo', 'distribucion', 'eventos', 'desde',
+    'hasta', 'ultima_secuencia', 'duplicado', 'actualizar_inventario',
+    'nuevo_articulo', 'nueva_distribucion', 'stream',
+    'tomando_control', 'nuevo_maestro', 'iniciador',
+    'ventas', 'resultados', 'aceptadas', 'rechazadas', 'articulos',
+    'actualizar_inventario_lote', 'nuevos_articulos_lote', 'espacios', 'cargados',
+    'siguiente', 'sucursales', 'completo', 'sin_respuesta', 'termino', 'voto',
+    'maestro',
+)
+_INDICE_INTERNADO = {cadena: indice for indice, cadena in enumerate(CADENAS_INTERNADAS)}
+
+_ARTICULO = (('nombre', 'str'), ('descripcion', 'str'), ('cantidad', 'i32'))
+
+# Esquemas por tipo de mensaje: (campo, tipo) con tipo 'i32', 'i64', 'bool',
+# 'str', 'valor' o un subesquema. Sólo agregar al final: la posición es la etiqueta.
+# Todo cambio en los esquemas, los tipos o CADENAS_INTERNADAS exige una nueva
+# versión en VERSIONES_SOPORTADAS.
+ESQUEMAS_MENSAJE = {
+    'consulta_inventario': (('origen', 'i32'), ('stream', 'bool'), ('id_articulo', 'i32'), ('nombre', 'str')),
+    'consulta_clientes': (('origen', 'i32'), ('stream', 'bool'), ('despues_de', 'i32'), ('limite', 'i32')),
+    'venta_articulo': (('origen', 'i32'), ('datos', (
+        ('id_articulo', 'i32'), ('id_cliente', 'i32'), ('cantidad', 'i32')))),
+    'agregar_articulo': (('origen', 'i32'), ('datos', _ARTICULO), ('redirigido', 'bool')),
+    'eleccion_maestro': (('origen', 'i32'), ('iniciador', 'i32'), ('termino', 'i64')),
+    'confirmacion_maestro': (('origen', 'i32'), ('nuevo_maestro', 'i32'), ('termino', 'i64')),
+    'redistribuir': (('origen', 'i32'), ('datos', (
+        ('id_articulo', 'i32'), ('cantidad', 'i32'), ('nueva_distribucion', 'valor'))), ('redirigido', 'bool')),
+    'actualizar_inventario': (('origen', 'i32'), ('id_evento', 'i64'), ('datos', (
+        ('id_articulo', 'i32'), ('id_sucursal', 'i32'), ('nueva_cantidad', 'i32'),
+        ('cantidad', 'i32'), ('guia_envio', 'str'), ('id_cliente', 'i32')))),
+    'nuevo_articulo': (('origen', 'i32'), ('id_evento', 'i64'), ('datos', (
+        ('id_articulo', 'i32'), ('articulo', _ARTICULO), ('distribucion', 'valor')))),
+    'lote_replicacion': (('origen', 'i32'), ('datos', (
+        ('desde', 'i64'), ('hasta', 'i64'), ('eventos', 'valor')))),
+    'ping': (('origen', 'i32'), ('termino', 'i64')),
+    'venta_lote': (('origen', 'i32'), ('datos', (('ventas', 'valor'),))),
+    'carga_articulos': (('origen', 'i32'), ('datos', (('articulos', 'valor'),)), ('redirigido', 'bool')),
+    'buscar_cliente': (('origen', 'i32'), ('datos', (
+        ('criterio', 'str'), ('valor', 'str'), ('limite', 'i32')))),
+}
+TIPOS_MENSAJE = tuple(ESQUEMAS_MENSAJE)
+_ETIQUETA_TIPO = {tipo: indice + 1 for indice, tipo in enumerate(TIPOS_MENSAJE)}
+
+
+def _encaja(valor, tipo):
+    clase = type(valor)
+    if tipo == 'i32':
+        return clase is int and -0x80000000 <= valor <= 0x7FFFFFFF
+    if tipo == 'i64':
+        return clase is int and -0x8000000000000000 <= valor <= 0x7FFFFFFFFFFFFFFF
+    if tipo == 'str':
+        return clase is str
+    if tipo == 'bool':
+        return clase is bool
+    if tipo == 'valor':
+        return True
+    return clase is dict
+
+
+def _codificar_texto(buf, texto):
+    datos = texto.encode('utf-8')
+    buf += _U32.pack(len(datos))
+    buf += datos
+
+
+def _codificar_valor(buf, valor):
+    clase = type(valor)
+    if clase is str:
+        indice = _INDICE_INTERNADO.get(valor)
+        if indice is not None:
+            buf.append(_INTERNADO)
+            buf.append(indice)
+        else:
+            datos = valor.encode('utf-8')
+            if len(datos) < 256:
+                buf.append(_TEXTO_CORTO)
+                buf.append(len(datos))
+            else:
+                buf.append(_TEXTO)
+                buf += _U32.pack(len(datos))
+            buf += datos
+    elif clase is int:
+        # Los enteros genéricos usan el ancho fijo más chico que los contiene
+        if -0x80 <= valor <= 0x7F:
+            buf.append(_ENTERO8)
+            buf += _I8.pack(valor)
+        elif -0x8000 <= valor <= 0x7FFF:
+            buf.append(_ENTERO16)
+            buf += _I16.pack(valor)
+        elif -0x80000000 <= valor <= 0x7FFFFFFF:
+            buf.append(_ENTERO32)
+            buf += _I32.pack(valor)
+        elif -0x8000000000000000 <= valor <= 0x7FFFFFFFFFFFFFFF:
+            buf.append(_ENTERO64)
+            buf += _I64.pack(valor)
+        else:
+            buf.append(_ENTERO_GRANDE)
+            _codificar_texto(buf, str(valor))
+    elif valor is None:
+        buf.append(_NULO)
+    elif clase is bool:
+        buf.append(_VERDADERO if valor else _FALSO)
+    elif clase is dict:
+        buf.append(_DICT)
+        buf += _U32.pack(len(valor))
+        for clave, elemento in valor.items():
+            _codificar_valor(buf, clave)
+            _codificar_valor(buf, elemento)
+    elif clase is list or clase is tuple:
+        claves = _claves_tabla(valor) if clase is list else None
+        if claves is not None:
+            # Lista de filas con las mismas claves: las claves se envían una sola vez
+            buf.append(_TABLA)
+            buf += _U32.pack(len(claves))
+            for clave in claves:
+                _codificar_valor(buf, clave)
+            buf += _U32.pack(len(valor))
+            for fila in valor:
+                for elemento in fila.values():
+                    _codificar_valor(buf, elemento)
+        else:
+            buf.append(_LISTA if clase is list else _TUPLA)
+            buf += _U32.pack(len(valor))
+            for elemento in valor:
+                _codificar_valor(buf, elemento)
+    elif clase is float:
+        buf.append(_REAL)
+        buf += _F64.pack(valor)
+    elif clase is bytes or clase is bytearray:
+        buf.append(_BYTES)
+        buf += _U32.pack(len(valor))
+        buf += valor
+    elif clase is datetime.datetime:
+        buf.append(_FECHA_HORA)
+        _codificar_texto(buf, valor.isoformat())
+    elif clase is datetime.date:
+        buf.append(_FECHA)
+        _codificar_texto(buf, valor.isoformat())
+    elif clase is Decimal:
+        buf.append(_DECIMAL)
+        _codificar_texto(buf, str(valor))
+    else:
+        raise TypeError(f"Tipo no serializable en mensajes: {clase.__name__}")
+
+
+def _claves_tabla(lista):
+    """Claves comunes si la lista son dicts con las mismas claves en el mismo orden"""
+    if len(lista) < 2 or type(lista[0]) is not dict or not lista[0]:
+        return None
+    claves = list(lista[0])
+    for fila in lista:
+        if type(fila) is not dict or list(fila) != claves:
+            return None
+    return claves
+
+
+def _codificar_registro(buf, registro, esquema):
+    presentes = 0
+    for posicion, (campo, tipo) in enumerate(esquema):
+        if campo in registro and _encaja(registro[campo], tipo):
+            presentes |= 1 << posicion
+    buf += _U16.pack(presentes)
+    campos = set()
+    for posicion, (campo, tipo) in enumerate(esquema):
+        if not presentes >> posicion & 1:
+            continue
+        campos.add(campo)
+        valor = registro[campo]
+        if tipo == 'i32':
+            buf += _I32.pack(valor)
+        elif tipo == 'i64':
+            buf += _I64.pack(valor)
+        elif tipo == 'bool':
+            buf.append(1 if valor else 0)
+        elif tipo == 'str':
+            _codificar_texto(buf, valor)
+        elif tipo == 'valor':
+            _codificar_valor(buf, valor)
+        else:
+            _codificar_registro(buf, valor, tipo)
+    # Lo que no encaja en el esquema viaja como pares clave/valor genéricos
+    extras = [(clave, valor) for clave, valor in registro.items() if clave not in campos]
+    buf += _U16.pack(len(extras))
+    for clave, valor in extras:
+        _codificar_valor(buf, clave)
+        _codificar_valor(buf, valor)
+
+
+def _leer_texto(datos, pos):
+    (longitud,) = _U32.unpack_from(datos, pos)
+    pos += 4
+    return str(datos[pos:pos + longitud], 'utf-8'), pos + longitud
+
+
+def _decodificar_valor(datos, pos):
+    etiqueta = datos[pos]
+    pos += 1
+    if etiqueta == _INTERNADO:
+        return CADENAS_INTERNADAS[datos[pos]], pos + 1
+    if etiqueta == _TEXTO_CORTO:
+        longitud = datos[pos]
+        pos += 1
+        return str(datos[pos:pos + longitud], 'utf-8'), pos + longitud
+    if etiqueta == _ENTERO8:
+        return _I8.unpack_from(datos, pos)[0], pos + 1
+    if etiqueta == _ENTERO16:
+        return _I16.unpack_from(datos, pos)[0], pos + 2
+    if etiqueta == _ENTERO32:
+        return _I32.unpack_from(datos, pos)[0], pos + 4
+    if etiqueta == _TEXTO:
+        return _leer_texto(datos, pos)
+    if etiqueta == _NULO:
+        return None, pos
+    if etiqueta == _VERDADERO:
+        return True, pos
+    if etiqueta == _FALSO:
+        return False, pos
+    if etiqueta == _TABLA:
+        (num_claves,) = _U32.unpack_from(datos, pos)
+        pos += 4
+        claves = []
+        for _ in range(num_claves):
+            clave, pos = _decodificar_valor(datos, pos)
+            claves.append(clave)
+        (num_filas,) = _U32.unpack_from(datos, pos)
+        pos += 4
+        # Cada valor ocupa al menos un byte: un conteo que no entra en la trama es falso
+        if num_filas and (not num_claves or num_filas * num_claves > len(datos) - pos):
+            raise ErrorProtocolo(f"Tabla de {num_filas} filas y {num_claves} claves no entra en el mensaje")
+        filas = []
+        for _ in range(num_filas):
+            fila = {}
+            for clave in claves:
+                fila[clave], pos = _decodificar_valor(datos, pos)
+            filas.append(fila)
+        return filas, pos
+    if etiqueta == _DICT:
+        (cantidad,) = _U32.unpack_from(datos, pos)
+        pos += 4
+        resultado = {}
+        for _ in range(cantidad):
+            clave, pos = _decodificar_valor(datos, pos)
+            resultado[clave], pos = _decodificar_valor(datos, pos)
+        return resultado, pos
+    if etiqueta == _LISTA or etiqueta == _TUPLA:
+        (cantidad,) = _U32.unpack_from(datos, pos)
+        pos += 4
+        resultado = []
+        for _ in range(cantidad):
+            elemento, pos = _decodificar_valor(datos, pos)
+            resultado.append(elemento)
+        return (resultado if etiqueta == _LISTA else tuple(resultado)), pos
+    if etiqueta == _ENTERO64:
+        return _I64.unpack_from(datos, pos)[0], pos + 8
+    if etiqueta == _REAL:
+        return _F64.unpack_from(datos, pos)[0], pos + 8
+    if etiqueta == _BYTES:
+        (longitud,) = _U32.unpack_from(datos, pos)
+        pos += 4
+        return bytes(datos[pos:pos + longitud]), pos + longitud
+    if etiqueta == _ENTERO_GRANDE:
+        texto, pos = _leer_texto(datos, pos)
+        return int(texto), pos
+    if etiqueta == _FECHA_HORA:
+        texto, pos = _leer_texto(datos, pos)
+        return datetime.datetime.fromisoformat(texto), pos
+    if etiqueta == _FECHA:
+        texto, pos = _leer_texto(datos, pos)
+        return datetime.date.fromisoformat(texto), pos
+    if etiqueta == _DECIMAL:
+        texto, pos = _leer_texto(datos, pos)
+        return Decimal(texto), pos
+    raise ErrorProtocolo(f"Etiqueta de valor desconocida: {etiqueta}")
+
+
+def _decodificar_registro(datos, pos, esquema):
+    (presentes,) = _U16.unpack_from(datos, pos)
+    pos += 2
+    registro = {}
+    for posicion, (campo, tipo) in enumerate(esquema):
+        if not presentes >> posicion & 1:
+            continue
+        if tipo == 'i32':
+            registro[campo] = _I32.unpack_from(datos, pos)[0]
+            pos += 4
+        elif tipo == 'i64':
+            registro[campo] = _I64.unpack_from(datos, pos)[0]
+            pos += 8
+        elif tipo == 'bool':
+            registro[campo] = datos[pos] == 1
+            pos += 1
+        elif tipo == 'str':
+            registro[campo], pos = _leer_texto(datos, pos)
+        elif tipo == 'valor':
+            registro[campo], pos = _decodificar_valor(datos, pos)
+        else:
+            registro[campo], pos = _decodificar_registro(datos, pos, tipo)
+    (num_extras,) = _U16.unpack_from(datos, pos)
+    pos += 2
+    for _ in range(num_extras):
+        clave, pos = _decodificar_valor(datos, pos)
+        registro[clave], pos = _decodificar_valor(datos, pos)
+    return registro, pos
+
+
+def codificar(obj):
+    """Serializa un mensaje o respuesta con el códec binario"""
+    buf = bytearray()
+    tipo = obj.get('tipo') if type(obj) is dict else None
+    etiqueta = _ETIQUETA_TIPO.get(tipo) if type(tipo) is str else None
+    if etiqueta is None:
+        buf.append(0)
+        _codificar_valor(buf, obj)
+    else:
+        buf.append(etiqueta)
+        sin_tipo = {clave: valor for clave, valor in obj.items() if clave != 'tipo'}
+        _codificar_registro(buf, sin_tipo, ESQUEMAS_MENSAJE[tipo])
+    return bytes(buf)
+
+
+def decodificar(datos):
+    """Reconstruye un mensaje serializado con codificar"""
+    try:
+        etiqueta = datos[0]
+        if etiqueta == 0:
+            valor, pos = _decodificar_valor(datos, 1)
+        else:
+            tipo = TIPOS_MENSAJE[etiqueta - 1]
+            valor, pos = _decodificar_registro(datos, 1, ESQUEMAS_MENSAJE[tipo])
+            valor['tipo'] = tipo
+    except ErrorProtocolo:
+        raise
+    except (IndexError, struct.error, UnicodeDecodeError, ValueError) as e:
+        raise ErrorProtocolo(f"Mensaje mal formado: {e}")
+    if pos != len(datos):
+        raise ErrorProtocolo("Mensaje mal formado: bytes sobrantes")
+    return valor
+
+
+# Compresión negociada por conexión. El algoritmo usado viaja en los bits
+# 5-6 del tipo de trama, así el receptor no necesita estado para descomprimir.
+COMPRESION_NINGUNA = 0
+COMPRESION_ZLIB = 1
+COMPRESION_LZMA = 2
+COMPRESION_ZLIB_DICCIONARIO = 3
+COMPRESIONES_SOPORTADAS = (COMPRESION_ZLIB_DICCIONARIO, COMPRESION_ZLIB, COMPRESION_LZMA)
+UMBRAL_COMPRESION = 1024  # Los mensajes de control más chicos no se comprimen
+_DESPLAZAMIENTO_COMPRESION = 5
+_MASCARA_TIPO = 0x1F
+
+
+def _entrenar_diccionario():
+    """Diccionario zlib con el aspecto típico de las respuestas de inventario y clientes"""
+    inventario = [
+        ('Laptop HP EliteBook', 'Laptop i7 16GB RAM 512GB SSD'),
+        ('Impresora Epson L380', 'Impresora multifunción tanque de tinta'),
+        ('Escritorio ejecutivo', 'Escritorio de madera 1.60m'),
+        ('Paquete de papel bond A4', 'Resma 500 hojas 80gr'),
+        ('Monitor Dell 24"', 'Monitor Full HD 24 pulgadas'),
+    ]
+    clientes = [
+        ('Empresa ABC SAC', 'Av. Industrial 123', '987654321', 'contacto@empresaabc.com'),
+        ('Juan Pérez', 'Calle Los Pinos 456', '987123456', 'juan.perez@gmail.com'),
+        ('Tienda XYZ', 'Jr. Comercial 789', '987321654', 'ventas@xyz.com'),
+        ('María Gómez', 'Av. Flores 321', '987654987', 'maria.gomez@hotmail.com'),
+        ('Distribuidora QRS', 'Calle Mercado 654', '987159357', 'info@qrs.com.pe'),
+    ]
+    muestras = [
+        {'estado': 'ok', 'clientes': [
+            {'id_cliente': i + 1, 'nombre': nombre, 'direccion': direccion, 'telefono': telefono,
+             'email': email, 'sucursal_registro': i % 8 + 1}
+            for i, (nombre, direccion, telefono, email) in enumerate(clientes)]},
+        {'estado': 'ok', 'inventario': [
+            {'id_articulo': i + 1, 'nombre': nombre, 'descripcion': descripcion,
+             'cantidad': 10, 'sucursal': i % 8 + 1, 'cantidad_total': 50}
+            for i, (nombre, descripcion) in enumerate(inventario)]},
+    ]
+    # zlib prioriza lo que está al final del diccionario: lo más frecuente va último
+    return b''.join(codificar(muestra) for muestra in muestras)
+
+
+class EstadisticasCompresion:
+    """Bytes antes y después de comprimir las tramas enviadas"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes_originales = 0
+        self.bytes_comprimidos = 0
+        self.tramas_comprimidas = 0
+        self.tramas_sin_comprimir = 0
+
+    def registrar(self, original, comprimido=None):
+        with self.lock:
+            if comprimido is None:
+                self.tramas_sin_comprimir += 1
+            else:
+                self.tramas_comprimidas += 1
+                self.bytes_originales += original
+                self.bytes_comprimidos += comprimido
+
+    def resumen(self):
+        with self.lock:
+            return {
+                'tramas_comprimidas': self.tramas_comprimidas,
+                'tramas_sin_comprimir': self.tramas_sin_comprimir,
+                'bytes_originales': self.bytes_originales,
+                'bytes_comprimidos': self.bytes_comprimidos,
+                'ratio': (self.bytes_originales / self.bytes_comprimidos
+                          if self.bytes_comprimidos else None)
+            }
+
+
+ESTADISTICAS_COMPRESION = EstadisticasCompresion()
+
+
+def _comprimir(cuerpo, compresion):
+    if compresion == COMPRESION_ZLIB_DICCIONARIO:
+        compresor = zlib.compressobj(6, zdict=DICCIONARIO_ZLIB)
+        return compresor.compress(cuerpo) + compresor.flush()
+    if compresion == COMPRESION_ZLIB:
+        return zlib.compress(cuerpo, 6)
+    if compresion == COMPRESION_LZMA:
+        return lzma.compress(cuerpo, preset=1)
+    raise ErrorProtocolo(f"Compresión desconocida: {compresion}")
+
+
+def _descomprimir(cuerpo, compresion):
+    # Limitar la salida evita que una trama pequeña se expanda sin control
+    try:
+        if compresion == COMPRESION_LZMA:
+            descompresor = lzma.LZMADecompressor()
+            datos = descompresor.decompress(cuerpo, max_length=MAX_TRAMA)
+            completo = descompresor.eof
+        else:
+            if compresion == COMPRESION_ZLIB_DICCIONARIO:
+                descompresor = zlib.decompressobj(zdict=DICCIONARIO_ZLIB)
+            elif compresion == COMPRESION_ZLIB:
+                descompresor = zlib.decompressobj()
+            else:
+                raise ErrorProtocolo(f"Compresión desconocida: {compresion}")
+            datos = descompresor.decompress(cuerpo, MAX_TRAMA)
+            completo = descompresor.eof and not descompresor.unconsumed_tail
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ErrorProtocolo(f"Trama comprimida inválida: {e}")
+    if not completo:
+        raise ErrorProtocolo("Trama comprimida incompleta o demasiado grande")
+    return datos
+
+
+def _preparar_cuerpo(tipo, cuerpo, compresion):
+    """Comprime el cuerpo si supera el umbral y realmente se reduce"""
+    if not compresion or len(cuerpo) < UMBRAL_COMPRESION:
+        return tipo, cuerpo
+    comprimido = _comprimir(cuerpo, compresion)
+    if len(comprimido) >= len(cuerpo):
+        ESTADISTICAS_COMPRESION.registrar(len(cuerpo))
+        return tipo, cuerpo
+    ESTADISTICAS_COMPRESION.registrar(len(cuerpo), len(comprimido))
+    return tipo | compresion << _DESPLAZAMIENTO_COMPRESION, comprimido
+
+
+def _separar_tipo(tipo, cuerpo):
+    compresion = tipo >> _DESPLAZAMIENTO_COMPRESION
+    if compresion:
+        cuerpo = _descomprimir(cuerpo, compresion)
+    return tipo & _MASCARA_TIPO, cuerpo
+
+
+def escribir_trama(sock, tipo, cuerpo=b'', compresion=COMPRESION_NINGUNA, id_solicitud=0, lock=None):
+    """Escribe una trama completa; con lock, las tramas de varios hilos no se mezclan"""
+    tipo, cuerpo = _preparar_cuerpo(tipo, cuerpo, compresion)
+    if len(cuerpo) > MAX_TRAMA:
+        raise ErrorProtocolo(f"Trama de {len(cuerpo)} bytes excede el máximo")
+    cabecera = CABECERA.pack(tipo, id_solicitud, len(cuerpo))
+    with lock or contextlib.nullcontext():
+        if len(cuerpo) < 65536:
+            sock.sendall(cabecera + cuerpo)
+        else:
+            # Evitar copiar cuerpos grandes sólo para anteponer la cabecera
+            sock.sendall(cabecera)
+            sock.sendall(cuerpo)
+
+
+def leer_exacto(lector, n):
+    """Lee exactamente n bytes; EOFError si la conexión se cerró entre tramas"""
+    datos = lector.read(n)
+    if len(datos) == n:
+        return datos
+    if not datos:
+        raise EOFError("Conexión cerrada")
+    raise ErrorProtocolo("Conexión cerrada a mitad de trama")
+
+
+def leer_trama(lector):
+    """Devuelve (tipo, id_solicitud, cuerpo) de la siguiente trama"""
+    tipo, id_solicitud, longitud = CABECERA.unpack(leer_exacto(lector, CABECERA.size))
+    if longitud > MAX_TRAMA:
+        raise ErrorProtocolo(f"Trama de {longitud} bytes excede el máximo")
+    cuerpo = leer_exacto(lector, longitud) if longitud else b''
+    tipo, cuerpo = _separar_tipo(tipo, cuerpo)
+    return tipo, id_solicitud, cuerpo
+
+
+# Saludo: [n][versiones...][m][compresiones...] -> [versión][compresión]
+def _cuerpo_saludo(compresiones):
+    return bytes([len(VERSIONES_SOPORTADAS), *VERSIONES_SOPORTADAS, len(compresiones), *compresiones])
+
+
+def _negociar(cuerpo, compresiones):
+    """Elige la versión más alta en común y la primera compresión preferida por el cliente"""
+    try:
+        num_versiones = cuerpo[0]
+        versiones = set(cuerpo[1:1 + num_versiones])
+        num_compresiones = cuerpo[1 + num_versiones]
+        ofrecidas = cuerpo[2 + num_versiones:2 + num_versiones + num_compresiones]
+    except IndexError:
+        raise ErrorProtocolo("Saludo mal formado")
+    comunes = versiones & set(VERSIONES_SOPORTADAS)
+    if not comunes:
+        return None, COMPRESION_NINGUNA
+    compresion = next((c for c in ofrecidas if c in compresiones), COMPRESION_NINGUNA)
+    return max(comunes), compresion
+
+
+def _respuesta_saludo(version, compresion):
+    return bytes([version, compresion]) if version else b''
+
+
+def saludar(sock, lector, compresiones=COMPRESIONES_SOPORTADAS):
+    """Negocia versión y compresión como cliente; devuelve (versión, compresión)"""
+    escribir_trama(sock, TRAMA_SALUDO, _cuerpo_saludo(compresiones))
+    tipo, _, cuerpo = leer_trama(lector)
+    if tipo != TRAMA_SALUDO or len(cuerpo) != 2:
+        raise ErrorProtocolo("El nodo remoto no comparte ninguna versión del protocolo")
+    return cuerpo[0], cuerpo[1]
+
+
+def responder_saludo(sock, lector, compresiones=COMPRESIONES_SOPORTADAS):
+    """Negocia versión y compresión como servidor; devuelve (versión, compresión)"""
+    tipo, _, cuerpo = leer_trama(lector)
+    if tipo != TRAMA_SALUDO:
+        raise ErrorProtocolo("La conexión no empezó con un saludo")
+    version, compresion = _negociar(cuerpo, compresiones)
+    escribir_trama(sock, TRAMA_SALUDO, _respuesta_saludo(version, compresion))
+    if version is None:
+        raise ErrorProtocolo("Ninguna versión ofrecida está soportada")
+    return version, compresion
+
+
+def enviar_mensaje(sock, mensaje, compresion=COMPRESION_NINGUNA, id_solicitud=0, lock=None):
+    escribir_trama(sock, TRAMA_MENSAJE, codificar(mensaje), compresion, id_solicitud, lock)
+
+
+def enviar_stream(sock, respuesta, compresion=COMPRESION_NINGUNA, id_solicitud=0, lock=None):
+    """Envía una RespuestaStream como cabecera, fragmentos y trama final"""
+    cabecera = dict(respuesta.cabecera, campo=respuesta.campo)
+    escribir_trama(sock, TRAMA_STREAM, codificar(cabecera), id_solicitud=id_solicitud, lock=lock)
+    try:
+        for bloque in respuesta.fragmentos():
+            escribir_trama(sock, TRAMA_FRAGMENTO, codificar(bloque), compresion, id_solicitud, lock)
+    except (OSError, ErrorProtocolo):
+        raise
+    except Exception as e:
+        # El error ocurrió generando filas: avisar al receptor y cerrar el stream
+        escribir_trama(sock, TRAMA_FIN, codificar({'estado': 'error', 'mensaje': str(e)}),
+                       id_solicitud=id_solicitud, lock=lock)
+        return
+    escribir_trama(sock, TRAMA_FIN, id_solicitud=id_solicitud, lock=lock)
+
+
+def recibir_mensaje(lector):
+    tipo, _, cuerpo = leer_trama(lector)
+    if tipo != TRAMA_MENSAJE:
+        raise ErrorProtocolo(f"Se esperaba un mensaje y llegó trama tipo {tipo}")
+    return decodificar(cuerpo)
+
+
+class EnsambladorRespuesta:
+    """Reconstruye una respuesta completa a partir de sus tramas"""
+    def __init__(self):
+        self.respuesta = None
+        self.campo = None
+        self.filas = []
+
+    def agregar(self, tipo, cuerpo):
+        """Devuelve la respuesta cuando llega su última trama; mientras tanto None"""
+        if tipo == TRAMA_MENSAJE:
+            return decodificar(cuerpo)
+        if tipo == TRAMA_STREAM:
+            self.respuesta = decodificar(cuerpo)
+            self.campo = self.respuesta.pop('campo')
+            return None
+        if self.respuesta is None:
+            raise ErrorProtocolo(f"Trama tipo {tipo} antes del inicio del stream")
+        if tipo == TRAMA_FRAGMENTO:
+            self.filas.extend(decodificar(cuerpo))
+            return None
+        if tipo == TRAMA_FIN:
+            if cuerpo:
+                return decodificar(cuerpo)
+            self.respuesta[self.campo] = self.filas
+            return self.respuesta
+        raise ErrorProtocolo(f"Trama inesperada tipo {tipo}")
+
+
+# Versión asíncrona para el servidor asyncio
+async def leer_trama_async(reader):
+    """Devuelve (tipo, id_solicitud, cuerpo) de la siguiente trama leída de un StreamReader"""
+    try:
+        cabecera = await reader.readexactly(CABECERA.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            raise EOFError("Conexión cerrada")
+        raise ErrorProtocolo("Conexión cerrada a mitad de trama")
+    tipo, id_solicitud, longitud = CABECERA.unpack(cabecera)
+    if longitud > MAX_TRAMA:
+        raise ErrorProtocolo(f"Trama de {longitud} bytes excede el máximo")
+    try:
+        cuerpo = await reader.readexactly(longitud) if longitud else b''
+    except asyncio.IncompleteReadError:
+        raise ErrorProtocolo("Conexión cerrada a mitad de trama")
+    tipo, cuerpo = _separar_tipo(tipo, cuerpo)
+    return tipo, id_solicitud, cuerpo
+
+
+async def responder_saludo_async(reader, writer, compresiones=COMPRESIONES_SOPORTADAS):
+    tipo, _, cuerpo = await leer_trama_async(reader)
+    if tipo != TRAMA_SALUDO:
+        raise ErrorProtocolo("La conexión no empezó con un saludo")
+    version, compresion = _negociar(cuerpo, compresiones)
+    await escribir_trama_async(writer, TRAMA_SALUDO, _respuesta_saludo(version, compresion))
+    if version is None:
+        raise ErrorProtocolo("Ninguna versión ofrecida está soportada")
+    return version, compresion
+
+
+# Las respuestas con más filas se codifican y comprimen fuera del bucle de eventos
+FILAS_EN_EXECUTOR = 1000
+
+
+def _preparar_trama(tipo, obj, compresion):
+    """Codifica y comprime el cuerpo de una trama; puede correr en un executor"""
+    return _preparar_cuerpo(tipo, codificar(obj), compresion)
+
+
+def _filas_respuesta(respuesta):
+    return sum(len(valor) for valor in respuesta.values() if type(valor) is list) if type(respuesta) is dict else 0
+
+
+async def escribir_trama_async(writer, tipo, cuerpo=b'', compresion=COMPRESION_NINGUNA, id_solicitud=0):
+    tipo, cuerpo = _preparar_cuerpo(tipo, cuerpo, compresion)
+    await _escribir_preparada_async(writer, tipo, cuerpo, id_solicitud)
+
+
+async def _escribir_preparada_async(writer, tipo, cuerpo, id_solicitud):
+    if len(cuerpo) > MAX_TRAMA:
+        raise ErrorProtocolo(f"Trama de {len(cuerpo)} bytes excede el máximo")
+    # Cabecera y cuerpo se escriben sin ceder el control: la trama no se mezcla con otras
+    writer.write(CABECERA.pack(tipo, id_solicitud, len(cuerpo)))
+    writer.write(cuerpo)
+    await writer.drain()
+
+
+async def enviar_respuesta_async(writer, respuesta, executor, compresion=COMPRESION_NINGUNA, id_solicitud=0):
+    """Envía una respuesta; codificar y comprimir resultados grandes se hace en el executor
+
+    Así una respuesta de miles de filas no frena al resto de las conexiones
+    (latidos incluidos) mientras se serializa.
+    """
+    loop = asyncio.get_running_loop()
+    if not isinstance(respuesta, RespuestaStream):
+        if _filas_respuesta(respuesta) < FILAS_EN_EXECUTOR:
+            # Respuestas chicas (p. ej. latidos): sin pasar por otro hilo
+            tipo, cuerpo = _preparar_trama(TRAMA_MENSAJE, respuesta, compresion)
+        else:
+            tipo, cuerpo = await loop.run_in_executor(executor, _preparar_trama,
+                                                      TRAMA_MENSAJE, respuesta, compresion)
+        await _escribir_preparada_async(writer, tipo, cuerpo, id_solicitud)
+        return
+    cabecera = dict(respuesta.cabecera, campo=respuesta.campo)
+    await escribir_trama_async(writer, TRAMA_STREAM, codificar(cabecera), id_solicitud=id_solicitud)
+    fragmentos = respuesta.fragmentos()
+
+    def siguiente_trama():
+        bloque = next(fragmentos, None)
+        return None if bloque is None else _preparar_trama(TRAMA_FRAGMENTO, bloque, compresion)
+
+    while True:
+        try:
+            # Generar filas puede bloquear (cursor de BD) y codificarlas lleva tiempo
+            trama = await loop.run_in_executor(executor, siguiente_trama)
+        except Exception as e:
+            await escribir_trama_async(writer, TRAMA_FIN, codificar({'estado': 'error', 'mensaje': str(e)}),
+                                       id_solicitud=id_solicitud)
+            return
+        if trama is None:
+            break
+        await _escribir_preparada_async(writer, *trama, id_solicitud)
+    await escribir_trama_async(writer, TRAMA_FIN, id_solicitud=id_solicitud)
+
+
+DICCIONARIO_ZLIB = _entrenar_diccionario()
@@ -1,39 +1,77 @@
--- Función para actualizar inventario al realizar ventas
-CREATE OR REPLACE FUNCTION actualizar_inventario_venta()
-RETURNS TRIGGER AS $$
+-- Venta completa en una sola llamada (un viaje de red desde el nodo):
+-- descuento condicional en la sucursal, total general, venta, historial y
+-- evento de replicación. Devuelve el nuevo stock de la sucursal, -1 si no
+-- alcanza o -2 si el artículo no está en la sucursal.
+CREATE OR REPLACE FUNCTION registrar_venta(
+    p_id_articulo INTEGER,
+    p_id_sucursal INTEGER,
+    p_id_cliente INTEGER,
+    p_cantidad INTEGER,
+    p_guia_envio VARCHAR
+) RETURNS INTEGER AS $$
+DECLARE
+    v_nueva_cantidad INTEGER;
+    v_precio DECIMAL(10,2);
 BEGIN
-    -- Actualizar cantidad disponible en inventario general
-    UPDATE inventario 
-    SET cantidad_disponible = cantidad_disponible - NEW.cantidad
-    WHERE id_articulo = NEW.id_articulo;
+    IF p_cantidad IS NULL OR p_cantidad <= 0 THEN
+        RAISE EXCEPTION 'Cantidad inválida: %', p_cantidad;
+    END IF;
     
-    -- Actualizar distribución en sucursal
     UPDATE distribucion_sucursal
-    SET cantidad = cantidad - NEW.cantidad
-    WHERE id_articulo = NEW.id_articulo AND id_sucursal = NEW.id_sucursal;
+    SET cantidad = cantidad - p_cantidad,
+        fecha_actualizacion = CURRENT_TIMESTAMP
+    WHERE id_articulo = p_id_articulo AND id_sucursal = p_id_sucursal
+      AND cantidad >= p_cantidad
+    RETURNING cantidad INTO v_nueva_cantidad;
+    
+    IF NOT FOUND THEN
+        IF EXISTS (SELECT 1 FROM distribucion_sucursal
+                   WHERE id_articulo = p_id_articulo AND id_sucursal = p_id_sucursal) THEN
+            RETURN -1;
+        END IF;
+        RETURN -2;
+    END IF;
+    
+    UPDATE inventario
+    SET cantidad_disponible = cantidad_disponible - p_cantidad
+    WHERE id_articulo = p_id_articulo
+    RETURNING precio_venta INTO v_precio;
+    
+    INSERT INTO ventas (id_articulo, id_cliente, id_sucursal, cantidad, precio_unitario, guia_envio)
+    VALUES (p_id_articulo, p_id_cliente, p_id_sucursal, p_cantidad, COALESCE(v_precio, 0), p_guia_envio);
     
-    -- Registrar en historial
     INSERT INTO historial_inventario (
-        id_articulo, id_sucursal, tipo_movimiento, 
+        id_articulo, id_sucursal, tipo_movimiento,
         cantidad, cantidad_anterior, cantidad_nueva,
         motivo, usuario_responsable, id_transaccion
     ) VALUES (
-        NEW.id_articulo, NEW.id_sucursal, 'SALIDA',
-        NEW.cantidad, 
-        (SELECT cantidad FROM distribucion_sucursal WHERE id_articulo = NEW.id_articulo AND id_sucursal = NEW.id_sucursal) + NEW.cantidad,
-        (SELECT cantidad FROM distribucion_sucursal WHERE id_articulo = NEW.id_articulo AND id_sucursal = NEW.id_sucursal),
-        'VENTA: ' || NEW.guia_envio, 'SISTEMA', NEW.guia_envio
+        p_id_articulo, p_id_sucursal, 'SALIDA',
+        p_cantidad, v_nueva_cantidad + p_cantidad, v_nueva_cantidad,
+        'VENTA: ' || p_guia_envio, 'SISTEMA', p_guia_envio
     );
     
-    RETURN NEW;
+    -- registrar_venta v3: los ids de la outbox se confirman en orden. Sin este
+    -- bloqueo (liberado con el commit) un evento de id menor podría confirmarse
+    -- después de que el despachador ya envió uno mayor, y se perdería.
+    PERFORM pg_advisory_xact_lock(hashtext('outbox_replicacion'));
+    INSERT INTO outbox_replicacion (tipo, datos)
+    VALUES ('actualizar_inventario', jsonb_build_object(
+        'id_articulo', p_id_articulo,
+        'id_sucursal', p_id_sucursal,
+        'nueva_cantidad', v_nueva_cantidad,
+        'cantidad', p_cantidad,
+        'guia_envio', p_guia_envio,
+        'id_cliente', p_id_cliente
+    ));
+    
+    RETURN v_nueva_cantidad;
 END;
 $$ LANGUAGE plpgsql;
 
--- Trigger para ventas
-CREATE TRIGGER tr_actualizar_inventario_venta
-AFTER INSERT ON ventas
-FOR EACH ROW
-EXECUTE FUNCTION actualizar_inventario_venta();
+-- El stock de una venta lo descuenta registrar_venta: un trigger sobre ventas
+-- lo descontaría por segunda vez
+DROP TRIGGER IF EXISTS tr_actualizar_inventario_venta ON ventas;
+DROP FUNCTION IF EXISTS actualizar_inventario_venta();
 
 -- Función para redistribución automática
 CREATE OR REPLACE FUNCTION redistribuir_articulo(
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nodo_inventario
+
+
+def _config_bd_pruebas():
+    """Base de pruebas: la predeterminada con el nombre de INVENTARIO_TEST_DB"""
+    config = dict(nodo_inventario.DB_CONFIG_PREDETERMINADA,
+                  dbname=os.environ.get('INVENTARIO_TEST_DB', 'inventario_pruebas'),
+                  min_conexiones=0)
+    return config
+
+
+@pytest.fixture
+def nodo_bd():
+    """Nodo solo (sin red) sobre la base de pruebas; se omite si no hay PostgreSQL"""
+    config = _config_bd_pruebas()
+    try:
+        psycopg2.connect(**{clave: valor for clave, valor in config.items()
+                            if clave in ('dbname', 'user', 'password', 'host', 'port')},
+                         connect_timeout=2).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL no disponible: {e}")
+    nodo = nodo_inventario.NodoInventario(1, 0, {1: ('127.0.0.1', 0)}, es_maestro=True, db_config=config)
+    yield nodo
+    nodo.activo = False
+    nodo.pool_bd.cerrar()
+    nodo.pool_conexiones.cerrar()
+
+
+class Reloj:
+    """Reemplazo de time.monotonic que sólo avanza a mano"""
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+    def avanzar(self, segundos):
+        self.ahora += segundos
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Detiene time.monotonic (y la variación aleatoria) de nodo_inventario para las pruebas"""
+    reloj = Reloj()
+    monkeypatch.setattr(nodo_inventario.time, 'monotonic', reloj)
+    # Sin variación aleatoria en la espera de los interruptores
+    monkeypatch.setattr(nodo_inventario.random, 'uniform', lambda a, b: 1.0)
+    return reloj
@@ -0,0 +1,52 @@
+from nodo_inventario import DetectorFallos
+
+
+def _latidos(detector, reloj, nodo_id, cantidad, intervalo):
+    for _ in range(cantidad):
+        detector.latido(nodo_id)
+        reloj.avanzar(intervalo)
+
+
+def test_detector_nodo_desconocido(reloj):
+    detector = DetectorFallos()
+    assert not detector.conocido(2)
+    assert not detector.esta_vivo(2)
+    assert detector.vista() == {}
+
+
+def test_detector_phi_crece_con_el_silencio(reloj):
+    detector = DetectorFallos(intervalo=0.1, umbral=8.0)
+    _latidos(detector, reloj, 2, 20, 0.1)
+    assert detector.conocido(2)
+    assert detector.esta_vivo(2)
+    anterior = detector.phi(2)
+    for _ in range(5):
+        reloj.avanzar(0.1)
+        actual = detector.phi(2)
+        assert actual > anterior
+        anterior = actual
+    reloj.avanzar(1.0)
+    assert not detector.esta_vivo(2)
+    # Un latido nuevo lo vuelve a dar por vivo
+    detector.latido(2)
+    assert detector.esta_vivo(2)
+
+
+def test_detector_pausa_larga_no_es_intervalo(reloj):
+    detector = DetectorFallos(intervalo=0.1)
+    _latidos(detector, reloj, 2, 10, 0.1)
+    reloj.avanzar(60)
+    detector.latido(2)
+    assert max(detector.intervalos[2]) < 1.0
+    assert detector.esta_vivo(2)
+
+
+def test_detector_nodos_independientes(reloj):
+    detector = DetectorFallos(intervalo=0.1)
+    _latidos(detector, reloj, 2, 10, 0.1)
+    detector.latido(3)
+    reloj.avanzar(2.0)
+    detector.latido(3)
+    assert not detector.esta_vivo(2)
+    assert detector.esta_vivo(3)
+    assert set(detector.vista()) == {2, 3}
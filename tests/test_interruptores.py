@@ -0,0 +1,122 @@
+from nodo_inventario import InterruptoresNodos
+
+
+def test_interruptor_abre_tras_umbral(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=3, espera_inicial=0.5)
+    for _ in range(2):
+        interruptores.fallo(2)
+        assert interruptores.permitir(2)
+    interruptores.fallo(2)
+    assert interruptores.abierto(2)
+    assert not interruptores.permitir(2)
+    assert interruptores.rechazos == 1
+    assert interruptores.vista() == {2: (InterruptoresNodos.ABIERTO, 0.5)}
+    # Los demás nodos no se ven afectados
+    assert interruptores.permitir(3)
+
+
+def test_exito_reinicia_los_fallos(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=3)
+    interruptores.fallo(2)
+    interruptores.fallo(2)
+    interruptores.exito(2)
+    interruptores.fallo(2)
+    interruptores.fallo(2)
+    assert interruptores.permitir(2)
+
+
+def test_latido_no_reinicia_fallos_de_solicitudes(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=3)
+    interruptores.fallo(2)
+    interruptores.fallo(2)
+    interruptores.exito(2, latido=True)
+    interruptores.fallo(2)
+    assert interruptores.abierto(2)
+
+
+def test_semiabierto_deja_pasar_una_sola_prueba(reloj):
+    cerrados = []
+    interruptores = InterruptoresNodos(umbral_fallos=1, espera_inicial=0.5, al_cerrar=cerrados.append)
+    interruptores.fallo(2)
+    reloj.avanzar(0.4)
+    assert not interruptores.permitir(2)
+    reloj.avanzar(0.1)
+    assert not interruptores.abierto(2)
+    assert interruptores.permitir(2)
+    assert interruptores.estados[2][0] == InterruptoresNodos.SEMIABIERTO
+    # Mientras la prueba está en curso no pasa nada más
+    assert interruptores.abierto(2)
+    assert not interruptores.permitir(2)
+    interruptores.exito(2)
+    assert cerrados == [2]
+    assert interruptores.permitir(2)
+    assert interruptores.vista() == {}
+
+
+def test_prueba_fallida_duplica_la_espera(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=1, espera_inicial=0.5, espera_maxima=1.5)
+    interruptores.fallo(2)
+    for espera in (0.5, 1.0, 1.5, 1.5):
+        assert interruptores.vista()[2] == (InterruptoresNodos.ABIERTO, espera)
+        reloj.avanzar(espera)
+        assert interruptores.permitir(2)
+        interruptores.fallo(2)
+
+
+def test_aperturas_se_olvidan_con_solicitud_exitosa(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=1, espera_inicial=0.5)
+    interruptores.fallo(2)
+    reloj.avanzar(0.5)
+    assert interruptores.permitir(2)
+    interruptores.exito(2, latido=True)
+    # Cerrado por un latido: la próxima apertura sigue duplicando la espera
+    interruptores.fallo(2)
+    assert interruptores.vista()[2] == (InterruptoresNodos.ABIERTO, 1.0)
+    reloj.avanzar(1.0)
+    assert interruptores.permitir(2)
+    interruptores.exito(2)
+    interruptores.exito(2)
+    interruptores.fallo(2)
+    assert interruptores.vista()[2] == (InterruptoresNodos.ABIERTO, 0.5)
+
+
+def test_latidos_fallidos_aislados_no_abren(reloj):
+    """Sólo cuentan los fallos seguidos: un latido exitoso reinicia la cuenta"""
+    interruptores = InterruptoresNodos(umbral_fallos=3)
+    for _ in range(5):
+        interruptores.fallo(2, latido=True)
+        for _ in range(1000):
+            interruptores.exito(2, latido=True)
+    assert interruptores.permitir(2)
+    assert interruptores.vista() == {}
+
+
+def test_latidos_fallidos_seguidos_abren(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=3)
+    interruptores.fallo(2, latido=True)
+    interruptores.fallo(2, latido=True)
+    # Un fallo de solicitud no se suma a la cuenta de los latidos
+    interruptores.fallo(2)
+    assert interruptores.permitir(2)
+    interruptores.fallo(2, latido=True)
+    assert interruptores.abierto(2)
+
+
+def test_latido_exitoso_no_reinicia_solicitudes_fallidas(reloj):
+    interruptores = InterruptoresNodos(umbral_fallos=3)
+    for _ in range(3):
+        interruptores.exito(2, latido=True)
+        interruptores.fallo(2)
+    assert interruptores.abierto(2)
+
+
+def test_latido_con_circuito_cerrado_olvida_las_aperturas(reloj):
+    """Un nodo ocioso (sólo latidos) no acumula espera de aperturas viejas"""
+    interruptores = InterruptoresNodos(umbral_fallos=1, espera_inicial=0.5)
+    interruptores.fallo(2, latido=True)
+    reloj.avanzar(0.5)
+    assert interruptores.permitir(2)
+    interruptores.exito(2, latido=True)
+    interruptores.exito(2, latido=True)
+    interruptores.fallo(2, latido=True)
+    assert interruptores.vista()[2] == (InterruptoresNodos.ABIERTO, 0.5)
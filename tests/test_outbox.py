@@ -0,0 +1,88 @@
+import threading
+
+
+def _ids_visibles(cur, desde):
+    cur.execute("SELECT id_evento FROM outbox_replicacion WHERE id_evento > %s ORDER BY id_evento", (desde,))
+    return [fila[0] for fila in cur.fetchall()]
+
+
+def test_commits_cruzados_no_dejan_huecos(nodo_bd):
+    """Un evento de id mayor no se ve antes que uno menor aún sin confirmar"""
+    pool = nodo_bd.pool_bd
+    primera, segunda, lectora = pool.obtener(), pool.obtener(), pool.obtener()
+    lectora.autocommit = True
+    lectura = lectora.cursor()
+    lectura.execute("SELECT COALESCE(MAX(id_evento), 0) FROM outbox_replicacion")
+    (base,) = lectura.fetchone()
+    try:
+        # La primera transacción toma el id menor y todavía no confirma
+        nodo_bd.registrar_evento(primera.cursor(), 'prueba', {'orden': 1})
+        
+        def escribir_segunda():
+            nodo_bd.registrar_evento(segunda.cursor(), 'prueba', {'orden': 2})
+            segunda.commit()
+        hilo = threading.Thread(target=escribir_segunda)
+        hilo.start()
+        hilo.join(0.5)
+        
+        # Lo que ve el despachador debe ser siempre un prefijo sin huecos
+        assert hilo.is_alive()
+        assert _ids_visibles(lectura, base) == []
+        
+        primera.commit()
+        hilo.join(5)
+        assert not hilo.is_alive()
+        ids = _ids_visibles(lectura, base)
+        assert len(ids) == 2 and ids == sorted(ids)
+        lectura.execute("SELECT datos->>'orden' FROM outbox_replicacion WHERE id_evento = ANY(%s) "
+                        "ORDER BY id_evento", (ids,))
+        assert [fila[0] for fila in lectura.fetchall()] == ['1', '2']
+    finally:
+        for conn in (primera, segunda):
+            conn.rollback()
+        lectura.execute("DELETE FROM outbox_replicacion WHERE id_evento > %s AND tipo = 'prueba'", (base,))
+        lectora.autocommit = False
+        for conn in (primera, segunda, lectora):
+            pool.devolver(conn)
+
+
+def _ultima_aplicada(nodo, id_origen):
+    conn = nodo.pool_bd.obtener()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT ultima_secuencia FROM replicacion_aplicada WHERE id_origen = %s", (id_origen,))
+        fila = cur.fetchone()
+        conn.rollback()
+        return fila[0] if fila else None
+    finally:
+        nodo.pool_bd.devolver(conn)
+
+
+def test_lotes_repetidos_y_fuera_de_orden(nodo_bd):
+    """Un lote o evento repetido se confirma sin aplicarse y uno con hueco se rechaza"""
+    origen = 99
+    try:
+        assert nodo_bd.aplicar_lote_replicacion(origen, {'desde': 0, 'hasta': 5, 'eventos': []}) == {
+            'estado': 'ok', 'ultima_secuencia': 5}
+        
+        repetido = nodo_bd.aplicar_lote_replicacion(origen, {'desde': 0, 'hasta': 5, 'eventos': []})
+        assert repetido == {'estado': 'ok', 'ultima_secuencia': 5, 'duplicado': True}
+        
+        hueco = nodo_bd.aplicar_lote_replicacion(origen, {'desde': 7, 'hasta': 9, 'eventos': []})
+        assert hueco['estado'] == 'error' and hueco['ultima_secuencia'] == 5
+        
+        # El remitente retoma desde la secuencia informada
+        assert nodo_bd.aplicar_lote_replicacion(origen, {'desde': 5, 'hasta': 9, 'eventos': []}) == {
+            'estado': 'ok', 'ultima_secuencia': 9}
+        
+        # Un evento suelto adelantado no salta a los que faltan; uno viejo es un duplicado
+        evento = {'tipo': 'actualizar_inventario', 'origen': origen, 'datos': {}}
+        adelantado = nodo_bd.aplicar_evento_replicado(dict(evento, id_evento=12))
+        assert adelantado['estado'] == 'error' and adelantado['ultima_secuencia'] == 9
+        assert nodo_bd.aplicar_evento_replicado(dict(evento, id_evento=8))['duplicado']
+        assert _ultima_aplicada(nodo_bd, origen) == 9
+    finally:
+        conn = nodo_bd.pool_bd.obtener()
+        conn.cursor().execute("DELETE FROM replicacion_aplicada WHERE id_origen = %s", (origen,))
+        conn.commit()
+        nodo_bd.pool_bd.devolver(conn)
@@ -0,0 +1,162 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import protocolo
+from nodo_inventario import ConexionNodo, PoolConexionesNodo
+
+SONDEO = {'tipo': 'ping', 'origen': 1}
+
+
+def _par_conectado(responder):
+    """ConexionNodo cliente unida a un servidor que contesta los pings sólo si responder"""
+    lado_cliente, lado_servidor = socket.socketpair()
+    servidor = ConexionNodo(lado_servidor)
+    
+    def atender():
+        try:
+            while True:
+                id_solicitud, mensaje = servidor.recibir()
+                if responder:
+                    servidor.enviar_respuesta({'estado': 'ok'}, id_solicitud)
+        except Exception:
+            pass
+    threading.Thread(target=atender, daemon=True).start()
+    cliente = ConexionNodo(lado_cliente)
+    cliente.iniciar_lector()
+    return cliente, servidor
+
+
+def _pool(conexion, **opciones):
+    pool = PoolConexionesNodo({}, mensaje_sondeo=SONDEO, timeout_sondeo=0.2, **opciones)
+    pool.conexiones[2] = [conexion]
+    return pool
+
+
+def test_conexion_ociosa_que_responde_se_reutiliza():
+    cliente, servidor = _par_conectado(responder=True)
+    pool = _pool(cliente)
+    try:
+        cliente.ultimo_uso = time.time() - 10
+        assert pool._elegir(2) is cliente
+        assert not cliente.cerrada
+    finally:
+        pool.cerrar()
+        servidor.cerrar()
+
+
+def test_conexion_ociosa_muda_se_descarta():
+    cliente, servidor = _par_conectado(responder=False)
+    pool = _pool(cliente)
+    try:
+        cliente.ultimo_uso = time.time() - 10
+        assert pool._elegir(2) is None
+        assert cliente.cerrada
+        assert pool.conexiones[2] == []
+    finally:
+        pool.cerrar()
+        servidor.cerrar()
+
+
+def test_conexion_reciente_no_se_prueba():
+    cliente, servidor = _par_conectado(responder=False)
+    pool = _pool(cliente)
+    try:
+        assert pool._elegir(2) is cliente
+        assert cliente.en_curso() == 0
+    finally:
+        pool.cerrar()
+        servidor.cerrar()
+
+
+def test_conexion_inactiva_demasiado_tiempo_se_cierra():
+    cliente, servidor = _par_conectado(responder=True)
+    pool = _pool(cliente, max_inactividad=1.0)
+    try:
+        cliente.ultimo_uso = time.time() - 5
+        assert not cliente.esta_sana(pool.max_inactividad)
+        assert pool._elegir(2) is None
+        assert cliente.cerrada
+    finally:
+        pool.cerrar()
+        servidor.cerrar()
+
+
+def _servidor_stream(filas):
+    """Conexión cliente cuyo servidor responde cada solicitud con las filas por partes"""
+    lado_cliente, lado_servidor = socket.socketpair()
+    servidor = ConexionNodo(lado_servidor)
+    
+    def atender():
+        try:
+            id_solicitud, _ = servidor.recibir()
+            servidor.enviar_respuesta(protocolo.RespuestaStream({'estado': 'ok'}, 'clientes', filas), id_solicitud)
+        except Exception:
+            pass
+    threading.Thread(target=atender, daemon=True).start()
+    cliente = ConexionNodo(lado_cliente)
+    cliente.iniciar_lector()
+    return cliente, servidor
+
+
+def test_stream_entrega_filas_antes_del_final():
+    primer_fragmento_leido = threading.Event()
+    
+    def filas():
+        yield from ({'id_cliente': i} for i in range(protocolo.FILAS_POR_FRAGMENTO))
+        # El resto no se genera hasta que el cliente consumió el primer fragmento
+        assert primer_fragmento_leido.wait(5)
+        yield from ({'id_cliente': i} for i in range(protocolo.FILAS_POR_FRAGMENTO, 1200))
+    cliente, servidor = _servidor_stream(filas())
+    try:
+        solicitud = cliente.solicitar({'tipo': 'consulta_clientes', 'stream': True}, timeout=5, stream=True)
+        respuesta = solicitud.futuro.result(5)
+        assert respuesta['estado'] == 'ok'
+        recibidas = []
+        for fila in respuesta['clientes']:
+            recibidas.append(fila['id_cliente'])
+            if len(recibidas) == protocolo.FILAS_POR_FRAGMENTO:
+                primer_fragmento_leido.set()
+        assert recibidas == list(range(1200))
+        assert cliente.en_curso() == 0
+    finally:
+        cliente.cerrar()
+        servidor.cerrar()
+
+
+def test_stream_cortado_falla_al_recorrer():
+    def filas():
+        yield from ({'id_cliente': i} for i in range(protocolo.FILAS_POR_FRAGMENTO))
+        time.sleep(0.2)
+        raise ValueError("cursor perdido")
+    cliente, servidor = _servidor_stream(filas())
+    try:
+        solicitud = cliente.solicitar({'tipo': 'consulta_clientes', 'stream': True}, timeout=5, stream=True)
+        filas_remotas = solicitud.futuro.result(5)['clientes']
+        with pytest.raises(RuntimeError, match="cursor perdido"):
+            for _ in filas_remotas:
+                pass
+    finally:
+        cliente.cerrar()
+        servidor.cerrar()
+
+
+def test_stream_sin_avance_vence():
+    lado_cliente, lado_servidor = socket.socketpair()
+    cliente = ConexionNodo(lado_cliente)
+    cliente.iniciar_lector()
+    pool = _pool(cliente)
+    try:
+        solicitud = cliente.solicitar({'tipo': 'consulta_clientes', 'stream': True}, timeout=0.2, stream=True)
+        protocolo.escribir_trama(lado_servidor, protocolo.TRAMA_STREAM,
+                                 protocolo.codificar({'estado': 'ok', 'campo': 'clientes'}),
+                                 id_solicitud=solicitud.id_solicitud)
+        filas_remotas = solicitud.futuro.result(5)['clientes']
+        # El servidor deja de enviar: el plazo cuenta desde la última trama
+        with pytest.raises(TimeoutError):
+            list(filas_remotas)
+    finally:
+        pool.cerrar()
+        lado_servidor.close()
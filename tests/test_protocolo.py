@@ -0,0 +1,183 @@
+import datetime
+import io
+from decimal import Decimal
+
+import pytest
+
+import protocolo
+
+
+class SocketFalso:
+    """Acumula lo escrito con sendall"""
+    def __init__(self):
+        self.enviado = bytearray()
+
+    def sendall(self, datos):
+        self.enviado += datos
+
+
+def test_trama_cortada_a_mitad():
+    sock = SocketFalso()
+    protocolo.enviar_mensaje(sock, {'estado': 'ok'})
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.leer_trama(io.BytesIO(bytes(sock.enviado[:-1])))
+    with pytest.raises(EOFError):
+        protocolo.leer_trama(io.BytesIO(b''))
+
+
+def test_trama_demasiado_grande():
+    cabecera = protocolo.CABECERA.pack(protocolo.TRAMA_MENSAJE, 0, protocolo.MAX_TRAMA + 1)
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.leer_trama(io.BytesIO(cabecera))
+
+
+MENSAJES = [
+    {'tipo': 'consulta_inventario', 'origen': 1, 'stream': True, 'id_articulo': 7, 'nombre': 'tornillo'},
+    {'tipo': 'consulta_clientes', 'origen': 2, 'despues_de': 100, 'limite': 500},
+    {'tipo': 'venta_articulo', 'origen': 3, 'datos': {'id_articulo': 1, 'id_cliente': 2, 'cantidad': 4}},
+    {'tipo': 'agregar_articulo', 'origen': 1, 'redirigido': False,
+     'datos': {'nombre': 'Taladro', 'descripcion': 'Percutor ñandú', 'cantidad': 30}},
+    {'tipo': 'eleccion_maestro', 'origen': 2, 'iniciador': 2, 'termino': 2 ** 40},
+    {'tipo': 'confirmacion_maestro', 'origen': 2, 'nuevo_maestro': 2, 'termino': 5},
+    {'tipo': 'redistribuir', 'origen': 1, 'redirigido': True,
+     'datos': {'id_articulo': 9, 'cantidad': 10, 'nueva_distribucion': {1: 4, 2: 6}}},
+    {'tipo': 'actualizar_inventario', 'origen': 1, 'id_evento': 42, 'datos': {
+        'id_articulo': 1, 'id_sucursal': 2, 'nueva_cantidad': 8, 'cantidad': 2,
+        'guia_envio': 'GE-1', 'id_cliente': 3}},
+    {'tipo': 'lote_replicacion', 'origen': 1, 'datos': {'desde': None, 'hasta': 3, 'eventos': [
+        {'id_evento': 3, 'tipo': 'nuevo_articulo', 'datos': {'id_articulo': 5}}]}},
+    {'tipo': 'ping', 'origen': 4, 'termino': 0},
+    {'tipo': 'venta_lote', 'origen': 1, 'datos': {'ventas': [
+        {'id_articulo': 1, 'id_cliente': 2, 'cantidad': 1},
+        {'id_articulo': 3, 'id_cliente': 2, 'cantidad': 5}]}},
+    {'tipo': 'buscar_cliente', 'origen': 1, 'datos': {'criterio': 'nombre', 'valor': 'Ana', 'limite': 10}},
+    # Campos fuera del esquema viajan como extras
+    {'tipo': 'ping', 'origen': 1, 'termino': 3, 'extra': [1, 2]},
+    # Un valor que no encaja en el esquema también viaja como extra
+    {'tipo': 'ping', 'origen': 1, 'termino': 'no es entero'},
+]
+
+RESPUESTAS = [
+    {'estado': 'ok', 'mensaje': 'Venta registrada', 'guia_envio': 'GE-123'},
+    {'estado': 'error', 'mensaje': 'Cantidad inválida'},
+    {'estado': 'ok', 'inventario': [
+        {'id_articulo': 1, 'nombre': 'A', 'cantidad': 3, 'precio': Decimal('10.50')},
+        {'id_articulo': 2, 'nombre': 'B', 'cantidad': -1, 'precio': None}]},
+    {'estado': 'ok', 'filas': [{}, {}], 'mixta': [{'a': 1}, {'b': 2}], 'vacia': []},
+    {'enteros': [0, -1, 127, 128, -32769, 2 ** 31, -2 ** 63, 2 ** 70, -2 ** 70]},
+    {'real': 1.5, 'bytes': b'\x00\xff', 'tupla': (1, 'dos'), 'anidada': {'x': [(), {}]},
+     'fecha': datetime.date(2024, 2, 29), 'instante': datetime.datetime(2024, 2, 29, 13, 5, 7, 12),
+     'texto_largo': 'x' * 300, 'verdad': True, 'falso': False},
+    [1, 'dos', None],
+    'sólo texto',
+]
+
+
+@pytest.mark.parametrize('mensaje', MENSAJES, ids=lambda m: m['tipo'])
+def test_mensajes_ida_y_vuelta(mensaje):
+    assert protocolo.decodificar(protocolo.codificar(mensaje)) == mensaje
+
+
+@pytest.mark.parametrize('respuesta', RESPUESTAS)
+def test_respuestas_ida_y_vuelta(respuesta):
+    decodificada = protocolo.decodificar(protocolo.codificar(respuesta))
+    assert decodificada == respuesta
+    assert type(decodificada) is type(respuesta)
+
+
+def test_tipo_no_serializable():
+    with pytest.raises(TypeError):
+        protocolo.codificar({'conjunto': {1, 2}})
+
+
+def _tabla(num_claves, claves, num_filas, resto=b''):
+    return (bytes([0, protocolo._TABLA]) + protocolo._U32.pack(num_claves) + claves
+            + protocolo._U32.pack(num_filas) + resto)
+
+
+@pytest.mark.parametrize('datos', [
+    # Tablas cuyo conteo de filas no entra en la trama (amplificación)
+    _tabla(1, bytes([protocolo._INTERNADO, 0]), 0xFFFFFFFF),
+    _tabla(0, b'', 0xFFFFFFFF),
+    _tabla(2, bytes([protocolo._NULO, protocolo._NULO]), 3, bytes([protocolo._NULO] * 5)),
+    # Etiqueta de valor desconocida
+    bytes([0, 200]),
+    # Tipo de mensaje desconocido
+    bytes([len(protocolo.TIPOS_MENSAJE) + 1, 0, 0, 0, 0]),
+    # Bytes sobrantes
+    protocolo.codificar({'estado': 'ok'}) + b'\x00',
+    # Truncados
+    protocolo.codificar({'estado': 'ok', 'mensaje': 'x' * 300})[:-1],
+    protocolo.codificar(MENSAJES[0])[:-3],
+    bytes([0, protocolo._ENTERO64, 1, 2]),
+    # UTF-8 inválido
+    bytes([0, protocolo._TEXTO_CORTO, 2, 0xC3, 0x28]),
+    # Lista que declara más elementos de los que trae
+    bytes([0, protocolo._LISTA]) + protocolo._U32.pack(1000),
+], ids=['tabla_gigante', 'tabla_sin_claves', 'tabla_corta', 'etiqueta', 'tipo_mensaje',
+        'sobrantes', 'texto_truncado', 'registro_truncado', 'entero_truncado', 'utf8', 'lista_corta'])
+def test_mensajes_mal_formados(datos):
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.decodificar(datos)
+
+
+@pytest.mark.parametrize('compresion', protocolo.COMPRESIONES_SOPORTADAS)
+def test_compresion_ida_y_vuelta(compresion):
+    cuerpo = protocolo.codificar({'estado': 'ok', 'inventario': [
+        {'id_articulo': i, 'nombre': f'Artículo {i}', 'cantidad': i % 7} for i in range(200)]})
+    comprimido = protocolo._comprimir(cuerpo, compresion)
+    assert len(comprimido) < len(cuerpo)
+    assert protocolo._descomprimir(comprimido, compresion) == cuerpo
+
+
+@pytest.mark.parametrize('compresion', protocolo.COMPRESIONES_SOPORTADAS)
+def test_trama_comprimida_ida_y_vuelta(compresion):
+    respuesta = {'estado': 'ok', 'clientes': [{'id_cliente': i, 'nombre': 'Cliente'} for i in range(300)]}
+    sock = SocketFalso()
+    protocolo.enviar_mensaje(sock, respuesta, compresion, id_solicitud=7)
+    tipo = sock.enviado[0]
+    assert tipo >> protocolo._DESPLAZAMIENTO_COMPRESION == compresion
+    assert protocolo.leer_trama(io.BytesIO(bytes(sock.enviado))) == (
+        protocolo.TRAMA_MENSAJE, 7, protocolo.codificar(respuesta))
+
+
+def test_mensaje_chico_no_se_comprime():
+    sock = SocketFalso()
+    protocolo.enviar_mensaje(sock, {'tipo': 'ping', 'origen': 1, 'termino': 0}, protocolo.COMPRESION_ZLIB)
+    assert sock.enviado[0] == protocolo.TRAMA_MENSAJE
+    assert protocolo.recibir_mensaje(io.BytesIO(bytes(sock.enviado)))['tipo'] == 'ping'
+
+
+def test_negociacion_elige_la_primera_compresion_comun():
+    cuerpo = protocolo._cuerpo_saludo((protocolo.COMPRESION_LZMA, protocolo.COMPRESION_ZLIB))
+    assert protocolo._negociar(cuerpo, (protocolo.COMPRESION_ZLIB,)) == (
+        protocolo.VERSION_ESQUEMAS_3, protocolo.COMPRESION_ZLIB)
+    assert protocolo._negociar(cuerpo, ()) == (
+        protocolo.VERSION_ESQUEMAS_3, protocolo.COMPRESION_NINGUNA)
+
+
+def test_saludo_ida_y_vuelta():
+    cliente = SocketFalso()
+    protocolo.escribir_trama(cliente, protocolo.TRAMA_SALUDO, protocolo._cuerpo_saludo(protocolo.COMPRESIONES_SOPORTADAS))
+    servidor = SocketFalso()
+    acordado = protocolo.responder_saludo(servidor, io.BytesIO(bytes(cliente.enviado)))
+    assert acordado == (protocolo.VERSION_ESQUEMAS_3, protocolo.COMPRESIONES_SOPORTADAS[0])
+    assert protocolo.saludar(SocketFalso(), io.BytesIO(bytes(servidor.enviado))) == acordado
+
+
+def test_trama_comprimida_invalida():
+    tipo = protocolo.TRAMA_MENSAJE | protocolo.COMPRESION_ZLIB << protocolo._DESPLAZAMIENTO_COMPRESION
+    cuerpo = b'no es zlib'
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.leer_trama(io.BytesIO(protocolo.CABECERA.pack(tipo, 0, len(cuerpo)) + cuerpo))
+
+
+def test_saludo_rechaza_versiones_viejas():
+    sock = SocketFalso()
+    lector = io.BytesIO(protocolo.CABECERA.pack(protocolo.TRAMA_SALUDO, 0, 3)
+                        + bytes([1, protocolo.VERSION_MULTIPLEXADA, 0]))
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.responder_saludo(sock, lector)
+    # El cliente viejo recibe un saludo vacío y también corta
+    with pytest.raises(protocolo.ErrorProtocolo):
+        protocolo.saludar(SocketFalso(), io.BytesIO(bytes(sock.enviado)))
@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+
+@pytest.fixture
+def articulo(nodo_bd):
+    """Artículo con 10 unidades en la sucursal del nodo y un cliente para venderle"""
+    with nodo_bd.pool_bd.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO inventario (nombre, descripcion, cantidad_total, cantidad_disponible, precio_venta)
+            VALUES ('Artículo de prueba de ventas', '', 10, 10, 12.50) RETURNING id_articulo
+        """)
+        (id_articulo,) = cur.fetchone()
+        cur.execute("""
+            INSERT INTO distribucion_sucursal (id_articulo, id_sucursal, cantidad)
+            VALUES (%s, %s, 10)
+        """, (id_articulo, nodo_bd.id_nodo))
+        cur.execute("""
+            INSERT INTO clientes (nombre, direccion, sucursal_registro)
+            VALUES ('Cliente de prueba de ventas', '-', %s) RETURNING id_cliente
+        """, (nodo_bd.id_nodo,))
+        (id_cliente,) = cur.fetchone()
+        conn.commit()
+    yield {'id_articulo': id_articulo, 'id_cliente': id_cliente}
+    with nodo_bd.pool_bd.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM outbox_replicacion WHERE tipo = 'actualizar_inventario' "
+                    "AND (datos->>'id_articulo')::int = %s", (id_articulo,))
+        for tabla in ('historial_inventario', 'ventas', 'distribucion_sucursal', 'inventario'):
+            cur.execute(f"DELETE FROM {tabla} WHERE id_articulo = %s", (id_articulo,))
+        cur.execute("DELETE FROM clientes WHERE id_cliente = %s", (id_cliente,))
+        conn.commit()
+
+
+def _estado(nodo, id_articulo):
+    """(stock en la sucursal, disponible global, ventas, eventos de la outbox) del artículo"""
+    with nodo.pool_bd.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT cantidad FROM distribucion_sucursal WHERE id_articulo = %s AND id_sucursal = %s",
+                    (id_articulo, nodo.id_nodo))
+        (stock,) = cur.fetchone()
+        cur.execute("SELECT cantidad_disponible FROM inventario WHERE id_articulo = %s", (id_articulo,))
+        (disponible,) = cur.fetchone()
+        cur.execute("SELECT cantidad, precio_unitario, guia_envio FROM ventas WHERE id_articulo = %s",
+                    (id_articulo,))
+        ventas = cur.fetchall()
+        cur.execute("""
+            SELECT datos FROM outbox_replicacion
+            WHERE tipo = 'actualizar_inventario' AND (datos->>'id_articulo')::int = %s
+            ORDER BY id_evento
+        """, (id_articulo,))
+        eventos = [fila[0] for fila in cur.fetchall()]
+    return stock, disponible, ventas, eventos
+
+
+def test_venta_descuenta_stock_y_escribe_outbox(nodo_bd, articulo):
+    espacio = nodo_bd.capacidad.espacio(nodo_bd.id_nodo)
+    resultado = nodo_bd.procesar_venta(dict(articulo, cantidad=3))
+    assert resultado['estado'] == 'ok'
+    
+    stock, disponible, ventas, eventos = _estado(nodo_bd, articulo['id_articulo'])
+    assert (stock, disponible) == (7, 7)
+    assert ventas == [(3, Decimal('12.50'), resultado['guia_envio'])]
+    assert eventos == [{'id_articulo': articulo['id_articulo'], 'id_sucursal': nodo_bd.id_nodo,
+                        'nueva_cantidad': 7, 'cantidad': 3, 'guia_envio': resultado['guia_envio'],
+                        'id_cliente': articulo['id_cliente']}]
+    # Las unidades vendidas liberan espacio en la sucursal
+    assert nodo_bd.capacidad.espacio(nodo_bd.id_nodo) == espacio + 3
+
+
+def test_stock_insuficiente_no_cambia_nada(nodo_bd, articulo):
+    espacio = nodo_bd.capacidad.espacio(nodo_bd.id_nodo)
+    resultado = nodo_bd.procesar_venta(dict(articulo, cantidad=11))
+    assert resultado == {'estado': 'error', 'mensaje': 'Stock insuficiente'}
+    assert _estado(nodo_bd, articulo['id_articulo']) == (10, 10, [], [])
+    assert nodo_bd.capacidad.espacio(nodo_bd.id_nodo) == espacio
+
+
+def test_articulo_ausente_en_la_sucursal(nodo_bd, articulo):
+    with nodo_bd.pool_bd.conexion() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT registrar_venta(%s, %s, %s, 1, 'GUIA-PRUEBA-AUSENTE')",
+                    (articulo['id_articulo'], nodo_bd.id_nodo + 1000, articulo['id_cliente']))
+        assert cur.fetchone()[0] == nodo_bd.VENTA_SIN_ARTICULO
+        conn.rollback()
+
+
+def test_cantidad_no_positiva_se_rechaza(nodo_bd, articulo):
+    assert nodo_bd.procesar_venta(dict(articulo, cantidad=0)) == {
+        'estado': 'error', 'mensaje': 'Cantidad inválida'}
+    # La función también la rechaza si se la llama directamente
+    with nodo_bd.pool_bd.conexion() as conn:
+        cur = conn.cursor()
+        with pytest.raises(psycopg2.Error):
+            cur.execute("SELECT registrar_venta(%s, %s, %s, -2, 'GUIA-PRUEBA-NEGATIVA')",
+                        (articulo['id_articulo'], nodo_bd.id_nodo, articulo['id_cliente']))
+        conn.rollback()
+    assert _estado(nodo_bd, articulo['id_articulo']) == (10, 10, [], [])